@@ -2,6 +2,7 @@
 # (c) @AbirHasan2005
 
 import os
+import socket
 from dotenv import load_dotenv
 
 # Load environment variables from .env file for local development
@@ -20,24 +21,87 @@ class Config(object):
     SESSION_NAME = os.environ.get("SESSION_NAME", "VideoMerge-Bot-Enhanced")
     UPDATES_CHANNEL = os.environ.get("UPDATES_CHANNEL")  # Can be None
     LOG_CHANNEL = os.environ.get("LOG_CHANNEL")          # Can be None
+    LOG_DIGEST_INTERVAL = int(os.environ.get("LOG_DIGEST_INTERVAL", 60))  # Max seconds an event waits for its digest
+    LOG_DIGEST_MAX_EVENTS = int(os.environ.get("LOG_DIGEST_MAX_EVENTS", 50))  # Events that trigger an early digest
+    FORCESUB_CACHE_TTL = int(os.environ.get("FORCESUB_CACHE_TTL", 3600))  # Seconds a channel member is trusted without re-checking
+    FORCESUB_NEGATIVE_TTL = int(os.environ.get("FORCESUB_NEGATIVE_TTL", 30))  # Seconds before a non-member is re-checked
+    FORCESUB_CACHE_SIZE = int(os.environ.get("FORCESUB_CACHE_SIZE", 50000))  # Membership statuses kept in memory
     DOWN_PATH = os.environ.get("DOWN_PATH", "./downloads")
+    JOB_STORE = os.environ.get("JOB_STORE", "sqlite").lower()  # "sqlite" or "mongodb"
+    JOB_STORE_PATH = os.environ.get("JOB_STORE_PATH", os.path.join(DOWN_PATH, "jobs.db"))
+    BULK_PATHS = os.environ.get("BULK_PATHS")  # Comma-separated volumes for queued downloads, default DOWN_PATH
+    SCRATCH_PATHS = os.environ.get("SCRATCH_PATHS")  # Comma-separated fast volumes (tmpfs, NVMe) for merge work
+    SCRATCH_HEADROOM = int(os.environ.get("SCRATCH_HEADROOM", 268435456))  # 256MB left free on scratch volumes
+    BLOB_STORE_PATH = os.environ.get("BLOB_STORE_PATH", os.path.join(DOWN_PATH, ".store"))
     
     # Improved boolean handling
     BROADCAST_AS_COPY = os.environ.get("BROADCAST_AS_COPY", "False").lower() in ("true", "1", "yes")
+    BROADCAST_RATE = int(os.environ.get("BROADCAST_RATE", 25))  # Messages/s, Telegram allows bots about 30
+    BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", 20))  # Sends in flight at once
+    BROADCAST_BATCH_SIZE = int(os.environ.get("BROADCAST_BATCH_SIZE", 500))  # Users per cursor batch and checkpoint
 
     # Numeric configurations with type casting and defaults
-    TIME_GAP = int(os.environ.get("TIME_GAP", 5))
+    TIME_GAP = int(os.environ.get("TIME_GAP", 5))  # Rate limit tokens a merge costs, i.e. seconds per merge
+    RATE_LIMIT_RATE = float(os.environ.get("RATE_LIMIT_RATE", 1.0))  # Tokens each user regains per second
+    RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", 10))  # Most tokens a user can save up
+    SESSION_MAX = int(os.environ.get("SESSION_MAX", 50000))  # User sessions kept in memory at most, new users wait while all of them hold a queue
+    SESSION_IDLE_TIMEOUT = int(os.environ.get("SESSION_IDLE_TIMEOUT", 21600))  # Seconds before an untouched queue and its files are cleared, 0 to keep them
+    SESSION_SWEEP_INTERVAL = int(os.environ.get("SESSION_SWEEP_INTERVAL", 60))  # Seconds between idle session sweeps
     MAX_VIDEOS = int(os.environ.get("MAX_VIDEOS", 5))
     MAX_DOWNLOAD_SIZE = int(os.environ.get("MAX_DOWNLOAD_SIZE", 2147483648))  # 2GB
     DOWNLOAD_TIMEOUT = int(os.environ.get("DOWNLOAD_TIMEOUT", 300))  # 5 minutes
     CONCURRENT_DOWNLOADS = int(os.environ.get("CONCURRENT_DOWNLOADS", 3))
+    USER_CONCURRENT_DOWNLOADS = int(os.environ.get("USER_CONCURRENT_DOWNLOADS", 2))
+    MAX_DOWNLOAD_JOBS = int(os.environ.get("MAX_DOWNLOAD_JOBS", 4))  # Download jobs (a link, file or album) running at once
+    MAX_MERGE_JOBS = int(os.environ.get("MAX_MERGE_JOBS", 2))  # ffmpeg merges running at once
+    MAX_UPLOAD_JOBS = int(os.environ.get("MAX_UPLOAD_JOBS", 3))  # Merged files being uploaded at once
+    ALBUM_WAIT = float(os.environ.get("ALBUM_WAIT", 1.5))  # Seconds of quiet before an album is admitted
+    MAX_URL_LIST_SIZE = int(os.environ.get("MAX_URL_LIST_SIZE", 1048576))  # 1MB .txt link lists
+    USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000))  # User documents kept in memory
+    USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 300))  # Seconds before a cached user is re-read
+    PROGRESS_UPDATE_INTERVAL = int(os.environ.get("PROGRESS_UPDATE_INTERVAL", 5))  # Min seconds between edits of one status message
+    MERGE_WORKERS = os.environ.get("MERGE_WORKERS", "False").lower() in ("true", "1", "yes")  # Merge in worker.py processes
+    WORKER_NAME = os.environ.get("WORKER_NAME", socket.gethostname())
+    WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", 1))  # Merges one worker runs at once
+    WORKER_POLL_INTERVAL = float(os.environ.get("WORKER_POLL_INTERVAL", 2.0))  # Seconds between job queue checks
+    WORKER_LEASE_TIMEOUT = int(os.environ.get("WORKER_LEASE_TIMEOUT", 120))  # Seconds without heartbeat before a job is requeued
+    JOB_STORE_FLUSH_INTERVAL = float(os.environ.get("JOB_STORE_FLUSH_INTERVAL", 1.0))  # Seconds between batched queue writes
     MAX_RETRY_ATTEMPTS = int(os.environ.get("MAX_RETRY_ATTEMPTS", 3))
     CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", 131072))  # 128KB
+    TG_DOWNLOAD_WORKERS = int(os.environ.get("TG_DOWNLOAD_WORKERS", 4))  # Parallel ranges per Telegram file
+    TG_MAX_TRANSMISSIONS = int(os.environ.get("TG_MAX_TRANSMISSIONS", 16))  # Telegram file transfers in flight, bot-wide
+    TG_PARALLEL_THRESHOLD = int(os.environ.get("TG_PARALLEL_THRESHOLD", 20971520))  # 20MB
+    MAX_INGRESS_RATE = int(os.environ.get("MAX_INGRESS_RATE", 0))  # Bytes/s for all downloads, 0 = unlimited
+    MAX_EGRESS_RATE = int(os.environ.get("MAX_EGRESS_RATE", 0))  # Bytes/s for all uploads, 0 = unlimited
+    TG_MAX_FILE_SIZE = int(os.environ.get("TG_MAX_FILE_SIZE", 2097152000))  # 2000MB, larger outputs are split
+    TG_PARALLEL_PARTS = int(os.environ.get("TG_PARALLEL_PARTS", 2))  # Split parts uploaded at once
+    TG_UPLOAD_WORKERS = int(os.environ.get("TG_UPLOAD_WORKERS", 4))  # Telegram upload parts in flight
+    FANOUT_CHUNK_SIZE = int(os.environ.get("FANOUT_CHUNK_SIZE", 4194304))  # 4MB shared read size for uploads
+    FANOUT_MAX_LAG = int(os.environ.get("FANOUT_MAX_LAG", 8))  # Chunks an upload may fall behind the shared read
+    FANOUT_LAG_TIMEOUT = int(os.environ.get("FANOUT_LAG_TIMEOUT", 15))  # Seconds before a lagging upload reads on its own
+    UPLOAD_DESTINATIONS = os.environ.get("UPLOAD_DESTINATIONS", "telegram,gofile")  # Default for users who never chose
+    UPLOAD_BASE_TIMEOUT = int(os.environ.get("UPLOAD_BASE_TIMEOUT", 300))  # Seconds per upload attempt, plus size-based allowance
+    UPLOAD_MIN_RATE = int(os.environ.get("UPLOAD_MIN_RATE", 262144))  # 256KB/s slowest expected upload link
+    TG_CONCURRENT_UPLOADS = int(os.environ.get("TG_CONCURRENT_UPLOADS", 3))  # Telegram uploads running at once, bot-wide
+    GOFILE_CONCURRENT_UPLOADS = int(os.environ.get("GOFILE_CONCURRENT_UPLOADS", 2))
+    STREAMTAPE_CONCURRENT_UPLOADS = int(os.environ.get("STREAMTAPE_CONCURRENT_UPLOADS", 1))
+    LOCAL_UPLOAD_PATH = os.environ.get("LOCAL_UPLOAD_PATH")  # Enables the local directory destination
+    CLEANUP_FILE_TTL = int(os.environ.get("CLEANUP_FILE_TTL", 86400))  # Seconds before downloaded files and merge leftovers expire
+    CLEANUP_TICK = int(os.environ.get("CLEANUP_TICK", 60))  # Expiry resolution in seconds
+    CLEANUP_RECONCILE_INTERVAL = int(os.environ.get("CLEANUP_RECONCILE_INTERVAL", 21600))  # Seconds between scans for untracked files
+    STORAGE_MIN_FREE = int(os.environ.get("STORAGE_MIN_FREE", 1073741824))  # 1GB always kept free on every bulk volume
+    USER_DISK_QUOTA = int(os.environ.get("USER_DISK_QUOTA", 0))  # Bytes one user's queue and work may use, 0 = unlimited
+    STORAGE_EVICT_IDLE = int(os.environ.get("STORAGE_EVICT_IDLE", 3600))  # Seconds a queue must be untouched before it can be evicted
+    MERGE_SPACE_FACTOR = float(os.environ.get("MERGE_SPACE_FACTOR", 1.1))  # Merge output size estimate relative to its inputs
+    BLOB_STORE_MAX_SIZE = int(os.environ.get("BLOB_STORE_MAX_SIZE", 10737418240))  # 10GB, 0 disables sharing
     
     # External service credentials (optional)
     STREAMTAPE_API_USERNAME = os.environ.get("STREAMTAPE_API_USERNAME")
     STREAMTAPE_API_PASS = os.environ.get("STREAMTAPE_API_PASS")
     GOFILE_API_TOKEN = os.environ.get("GOFILE_API_TOKEN")
+    GOFILE_SERVER_TTL = int(os.environ.get("GOFILE_SERVER_TTL", 600))  # Seconds to reuse the chosen server
+    GOFILE_BASE_TIMEOUT = int(os.environ.get("GOFILE_BASE_TIMEOUT", 120))  # Seconds, plus size-based allowance
+    GOFILE_MIN_UPLOAD_RATE = int(os.environ.get("GOFILE_MIN_UPLOAD_RATE", 262144))  # 256KB/s slowest expected link
 
     # --- STATIC TEXT AND MESSAGES ---
     START_TEXT = """
@@ -81,6 +145,16 @@ Made with ❤️ by @AbirHasan2005
 """
 
     PROGRESS = """
+Percentage : {0}%
+Done: {1}
+Total: {2}
+Speed: {3}/s
+ETA: {4}
+"""
+
+    DOWNLOAD_PROGRESS = """
+📥 **Downloading...**
+
 Percentage : {0}%
 Done: {1}
 Total: {2}
@@ -0,0 +1,66 @@
+"""
+Album-aware ingestion helper
+Collects the messages of one album (or one burst of forwarded files) so they are admitted as a unit
+"""
+
+import asyncio
+from typing import Dict, List, Optional, Callable, Awaitable
+from pyrogram import Client
+from pyrogram.types import Message
+from configs import Config
+from helpers.executor import executor, reply_error
+
+
+class _PendingGroup:
+    __slots__ = ('messages', 'timer')
+
+    def __init__(self):
+        self.messages: List[Message] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class AlbumCollector:
+    """
+    Telegram delivers an album as one update per message. The collector buffers
+    them per group and flushes the whole group once no new member has arrived
+    for ALBUM_WAIT seconds, handing the messages over in album order.
+    """
+
+    def __init__(self, on_group: Callable[[Client, List[Message]], Awaitable[None]], delay: float = None):
+        self.on_group = on_group
+        self.delay = Config.ALBUM_WAIT if delay is None else delay
+        self._groups: Dict[str, _PendingGroup] = {}
+
+    @staticmethod
+    def group_key(message: Message) -> Optional[str]:
+        """Albums share a media_group_id, multi-file forwards arrive as a burst of forwards"""
+        if message.media_group_id:
+            return f"album:{message.chat.id}:{message.media_group_id}"
+        if message.forward_date:
+            return f"forward:{message.chat.id}"
+        return None
+
+    def add(self, bot: Client, message: Message) -> bool:
+        """Buffer a message. Returns False if it doesn't belong to any group"""
+        key = self.group_key(message)
+        if key is None:
+            return False
+
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = _PendingGroup()
+        group.messages.append(message)
+
+        # Debounce: the group is complete once it stays quiet for `delay` seconds
+        if group.timer:
+            group.timer.cancel()
+        group.timer = asyncio.get_event_loop().call_later(self.delay, self._flush, bot, key)
+        return True
+
+    def _flush(self, bot: Client, key: str):
+        group = self._groups.pop(key, None)
+        if not group:
+            return
+        messages = sorted(group.messages, key=lambda m: m.id)
+        # Held and reported like any other ingestion, the download slots still bound it
+        executor.submit(self.on_group(bot, messages), on_error=reply_error(messages[0]))
@@ -0,0 +1,130 @@
+"""
+Global bandwidth governor with per-user fair sharing
+Downloads draw from the ingress budget, uploads from the egress budget
+"""
+
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Optional
+from configs import Config
+
+logger = logging.getLogger(__name__)
+
+INGRESS = "ingress"
+EGRESS = "egress"
+
+# A user counts towards the fair share while they moved data within this window
+ACTIVE_WINDOW = 2.0
+# Idle per-user buckets are dropped after this long
+IDLE_TIMEOUT = 30.0
+# Utilization is averaged over this window
+STATS_WINDOW = 5.0
+
+
+class TokenBucket:
+    """Token bucket that refills at `rate` tokens per second up to `capacity`"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_consume(self, amount: float = 1) -> float:
+        """Take tokens if available. Returns 0 on success, else the seconds until they would be"""
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    async def consume(self, amount: float):
+        """Take tokens, sleeping off any debt. Amounts above capacity are allowed"""
+        self._refill()
+        self.tokens -= amount
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class _Direction:
+    """Budget of one traffic direction, split evenly between active users"""
+
+    def __init__(self, name: str, rate: int):
+        self.name = name
+        self.rate = rate
+        self.buckets: Dict[int, TokenBucket] = {}
+        self.last_seen: Dict[int, float] = {}
+        self.samples = deque()  # (timestamp, user_id, nbytes)
+
+    async def throttle(self, user_id: int, nbytes: int):
+        now = time.monotonic()
+        self.last_seen[user_id] = now
+        self.samples.append((now, user_id, nbytes))
+        self._expire(now)
+
+        if self.rate <= 0:
+            return
+
+        active = sum(1 for seen in self.last_seen.values() if now - seen <= ACTIVE_WINDOW)
+        share = self.rate / max(active, 1)
+
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            # Allow a short burst so the first chunks don't stall
+            bucket = self.buckets[user_id] = TokenBucket(share, capacity=share / 4)
+        bucket.rate = share
+        bucket.capacity = share / 4
+        await bucket.consume(nbytes)
+
+    def _expire(self, now: float):
+        while self.samples and now - self.samples[0][0] > STATS_WINDOW:
+            self.samples.popleft()
+        for user_id in [u for u, seen in self.last_seen.items() if now - seen > IDLE_TIMEOUT]:
+            del self.last_seen[user_id]
+            self.buckets.pop(user_id, None)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        self._expire(now)
+        per_user: Dict[int, int] = {}
+        for _, user_id, nbytes in self.samples:
+            per_user[user_id] = per_user.get(user_id, 0) + nbytes
+        throughput = sum(per_user.values()) / STATS_WINDOW
+        return {
+            'limit': self.rate,
+            'throughput': throughput,
+            'utilization': (throughput / self.rate) if self.rate > 0 else None,
+            'active_users': sum(1 for seen in self.last_seen.values() if now - seen <= ACTIVE_WINDOW),
+            'per_user': {user_id: nbytes / STATS_WINDOW for user_id, nbytes in per_user.items()}
+        }
+
+
+class BandwidthGovernor:
+    def __init__(self, ingress_rate: int = None, egress_rate: int = None):
+        self.directions = {
+            INGRESS: _Direction(INGRESS, Config.MAX_INGRESS_RATE if ingress_rate is None else ingress_rate),
+            EGRESS: _Direction(EGRESS, Config.MAX_EGRESS_RATE if egress_rate is None else egress_rate)
+        }
+
+    async def throttle(self, direction: str, user_id: Optional[int], nbytes: int):
+        """Account nbytes moved for a user, waiting if they are over their fair share"""
+        if nbytes <= 0:
+            return
+        await self.directions[direction].throttle(user_id or 0, nbytes)
+
+    def stats(self) -> Dict[str, dict]:
+        """Live utilization of both directions"""
+        return {name: direction.stats() for name, direction in self.directions.items()}
+
+
+# Global bandwidth governor instance
+bandwidth = BandwidthGovernor()
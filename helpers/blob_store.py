@@ -0,0 +1,177 @@
+"""
+Content-addressed download store shared between users
+Blobs are hard-linked into user directories, so a cache hit costs neither a download nor a copy.
+Volumes on another filesystem than the store don't use it, as a copy would be neither free nor counted
+"""
+
+import os
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional, Mapping
+from configs import Config
+from helpers.tiers import same_volume
+
+logger = logging.getLogger(__name__)
+
+
+class BlobStore:
+    """
+    Blobs live at <root>/<digest[:2]>/<digest>.
+    A blob's reference count is its hard-link count minus the store's own link,
+    so removing a user's directory only drops that user's reference and a blob
+    is evicted only once no queue links to it any more.
+    """
+
+    def __init__(self, root: str = None, max_size: int = None):
+        self.root = root or Config.BLOB_STORE_PATH
+        self.max_size = Config.BLOB_STORE_MAX_SIZE if max_size is None else max_size
+        self._lru: "OrderedDict[str, int]" = OrderedDict()  # digest -> size, oldest first
+        self._total_size = 0
+        self._loaded = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    @staticmethod
+    def telegram_key(file_unique_id: str) -> str:
+        """Cache key for a Telegram file"""
+        return f"tg:{file_unique_id}"
+
+    @staticmethod
+    def url_key(url: str, headers: Mapping[str, str]) -> Optional[str]:
+        """Cache key for a URL, only when the server sent validators to tell versions apart"""
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return None
+        return f"url:{url}|{etag or ''}|{last_modified or ''}|{headers.get('Content-Length', '')}"
+
+    def fetch(self, key: str, dest_path: str) -> bool:
+        """Link a stored blob to dest_path. Returns False on a miss"""
+        if not self.enabled:
+            return False
+        self._load()
+
+        digest = self._digest(key)
+        blob_path = self._blob_path(digest)
+        if digest not in self._lru or not os.path.exists(blob_path):
+            return False
+        if not same_volume(blob_path, os.path.dirname(dest_path)):
+            return False
+
+        try:
+            self._link(blob_path, dest_path)
+        except OSError as e:
+            logger.warning(f"Blob store link failed for {dest_path}: {e}")
+            return False
+
+        self._touch(digest, blob_path)
+        logger.debug(f"Blob store hit: {key}")
+        return True
+
+    def add(self, key: str, src_path: str):
+        """Adopt a freshly downloaded file into the store"""
+        if not self.enabled:
+            return
+        self._load()
+
+        digest = self._digest(key)
+        blob_path = self._blob_path(digest)
+        if digest in self._lru:
+            self._touch(digest, blob_path)
+            return
+
+        try:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            if not same_volume(src_path, self.root):
+                return
+            self._link(src_path, blob_path)
+        except OSError as e:
+            logger.warning(f"Blob store add failed for {src_path}: {e}")
+            return
+
+        size = os.path.getsize(blob_path)
+        self._lru[digest] = size
+        self._total_size += size
+        self.evict()
+
+    def evict(self) -> int:
+        """Drop least recently used unreferenced blobs until the store fits its cap"""
+        if not self.enabled:
+            return 0
+        self._load()
+
+        freed = 0
+        for digest in list(self._lru):
+            if self._total_size <= self.max_size:
+                break
+            blob_path = self._blob_path(digest)
+            try:
+                if os.stat(blob_path).st_nlink > 1:
+                    continue  # Still linked from some user's queue
+                os.remove(blob_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Blob store eviction failed for {blob_path}: {e}")
+                continue
+            size = self._lru.pop(digest)
+            self._total_size -= size
+            freed += size
+
+        if freed:
+            logger.info(f"Blob store evicted {freed} bytes, {self._total_size} bytes in use")
+        return freed
+
+    def stats(self) -> dict:
+        self._load()
+        return {'blobs': len(self._lru), 'total_size': self._total_size, 'max_size': self.max_size}
+
+    def _load(self):
+        """Rebuild the LRU order from blob access times on first use"""
+        if self._loaded:
+            return
+        self._loaded = True
+
+        entries = []
+        if os.path.isdir(self.root):
+            for prefix in os.scandir(self.root):
+                if not prefix.is_dir():
+                    continue
+                for blob in os.scandir(prefix.path):
+                    if blob.is_file() and not blob.name.endswith('.link'):
+                        stat = blob.stat()
+                        entries.append((stat.st_atime, blob.name, stat.st_size))
+
+        for _, digest, size in sorted(entries):
+            self._lru[digest] = size
+            self._total_size += size
+
+    def _touch(self, digest: str, blob_path: str):
+        self._lru.move_to_end(digest)
+        try:
+            os.utime(blob_path)  # Persist recency across restarts
+        except OSError:
+            pass
+
+    @staticmethod
+    def _link(src_path: str, dest_path: str):
+        """Hard-link src to dest, replacing dest atomically"""
+        tmp_path = f"{dest_path}.link"
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        os.link(src_path, tmp_path)
+        os.replace(tmp_path, dest_path)
+
+    @staticmethod
+    def _digest(key: str) -> str:
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+
+# Global blob store instance
+blob_store = BlobStore()
@@ -6,96 +6,167 @@ import string
 import random
 import asyncio
 import datetime
+import logging
 import aiofiles
 import traceback
 from configs import Config
 from helpers.database.access_db import db
+from helpers.bandwidth import TokenBucket
+from helpers.executor import executor
+from pyrogram import Client
 from pyrogram.types import Message
 from pyrogram.errors import FloodWait, InputUserDeactivated, UserIsBlocked, PeerIdInvalid
 
+logger = logging.getLogger(__name__)
+
 broadcast_ids = {}
 
+# Shared by every running broadcast, so together they stay within Telegram's limits
+_limiter = TokenBucket(Config.BROADCAST_RATE)
+_paused_until = 0.0
+
+
+async def _throttle():
+    """Wait for a send slot under the global rate, sitting out any FloodWait another send hit"""
+    while True:
+        pause = _paused_until - time.time()
+        if pause > 0:
+            await asyncio.sleep(pause)
+            continue
+        wait = _limiter.try_consume(1)
+        if not wait:
+            return
+        await asyncio.sleep(wait)
+
 
 async def send_msg(user_id, message):
-    try:
-        if Config.BROADCAST_AS_COPY is False:
-            await message.forward(chat_id=user_id)
-        elif Config.BROADCAST_AS_COPY is True:
-            await message.copy(chat_id=user_id)
-        return 200, None
-    except FloodWait as e:
-        await asyncio.sleep(e.x)
-        return send_msg(user_id, message)
-    except InputUserDeactivated:
-        return 400, f"{user_id} : deactivated\n"
-    except UserIsBlocked:
-        return 400, f"{user_id} : blocked the bot\n"
-    except PeerIdInvalid:
-        return 400, f"{user_id} : user id invalid\n"
-    except Exception as e:
-        return 500, f"{user_id} : {traceback.format_exc()}\n"
-
-
-async def broadcast_handler(m: Message):
-    all_users = await db.get_all_users()
+    global _paused_until
+    while True:
+        await _throttle()
+        try:
+            if Config.BROADCAST_AS_COPY is False:
+                await message.forward(chat_id=user_id)
+            elif Config.BROADCAST_AS_COPY is True:
+                await message.copy(chat_id=user_id)
+            return 200, None
+        except FloodWait as e:
+            # Every sender backs off, not just the one that was told to
+            _paused_until = max(_paused_until, time.time() + e.value)
+        except InputUserDeactivated:
+            return 400, f"{user_id} : deactivated\n"
+        except UserIsBlocked:
+            return 400, f"{user_id} : blocked the bot\n"
+        except PeerIdInvalid:
+            return 400, f"{user_id} : user id invalid\n"
+        except Exception as e:
+            return 500, f"{user_id} : {traceback.format_exc()}\n"
+
+
+async def broadcast_handler(bot: Client, m: Message):
     broadcast_msg = m.reply_to_message
     while True:
-        broadcast_id = ''.join([random.choice(string.ascii_letters) for i in range(3)])
+        broadcast_id = ''.join([random.choice(string.ascii_letters) for i in range(8)])
         if not broadcast_ids.get(broadcast_id):
             break
     out = await m.reply_text(
         text=f"Broadcast Started! You will be notified with log file when all the users are notified."
     )
-    start_time = time.time()
-    total_users = await db.total_users_count()
-    done = 0
-    failed = 0
-    success = 0
-    broadcast_ids[broadcast_id] = dict(
-        total=total_users,
-        current=done,
-        failed=failed,
-        success=success
+    state = dict(
+        _id=broadcast_id,
+        chat_id=m.chat.id,
+        message_id=broadcast_msg.id,
+        status='running',
+        started_at=time.time(),
+        last_id=None,
+        total=await db.total_users_count(),
+        current=0,
+        failed=0,
+        success=0
     )
-    async with aiofiles.open('broadcast.txt', 'w') as broadcast_log_file:
-        async for user in all_users:
-            sts, msg = await send_msg(
-                user_id=int(user['id']),
-                message=broadcast_msg
-            )
+    await db.save_broadcast(state)
+    await run_broadcast(bot, state, broadcast_msg, out)
+
+
+async def resume_broadcasts(bot: Client):
+    """Continue broadcasts that were interrupted by a restart, from their last checkpoint"""
+    for state in await db.get_running_broadcasts():
+        try:
+            broadcast_msg = await bot.get_messages(state['chat_id'], state['message_id'])
+        except Exception:
+            broadcast_msg = None
+        if not broadcast_msg or broadcast_msg.empty:
+            state['status'] = 'failed'
+            await db.save_broadcast(state)
+            continue
+        logger.info(f"Resuming broadcast {state['_id']} at {state['current']}/{state['total']}")
+        # Held by the executor, which cancels it on shutdown; the next start resumes it from its checkpoint
+        executor.submit(run_broadcast(bot, state, broadcast_msg))
+
+
+async def run_broadcast(bot: Client, state: dict, broadcast_msg: Message, out: Message = None):
+    """
+    Send to users in _id order, BROADCAST_BATCH_SIZE at a time with up to
+    BROADCAST_CONCURRENCY sends in flight. After each batch the dead users are
+    deleted in one bulk write and the position is checkpointed.
+    """
+    broadcast_id = state['_id']
+    log_path = os.path.join(Config.DOWN_PATH, f"broadcast_{broadcast_id}.txt")
+    os.makedirs(Config.DOWN_PATH, exist_ok=True)
+    slots = asyncio.Semaphore(Config.BROADCAST_CONCURRENCY)
+    broadcast_ids[broadcast_id] = state
+
+    async def _send(user):
+        async with slots:
+            return await send_msg(user_id=int(user['id']), message=broadcast_msg)
+
+    async def _run_batch(batch, broadcast_log_file):
+        results = await asyncio.gather(*[_send(user) for user in batch])
+        dead = []
+        for user, (sts, msg) in zip(batch, results):
             if msg is not None:
                 await broadcast_log_file.write(msg)
             if sts == 200:
-                success += 1
+                state['success'] += 1
             else:
-                failed += 1
+                state['failed'] += 1
             if sts == 400:
-                await db.delete_user(user['id'])
-            done += 1
+                dead.append(user['id'])
+        await db.delete_users(dead)
+        state['current'] += len(batch)
+        state['last_id'] = batch[-1]['_id']
+        await broadcast_log_file.flush()
+        await db.save_broadcast(state)
+
+    async with aiofiles.open(log_path, 'a') as broadcast_log_file:
+        batch = []
+        async for user in db.iter_users(after=state['last_id'], batch_size=Config.BROADCAST_BATCH_SIZE):
+            batch.append(user)
+            if len(batch) < Config.BROADCAST_BATCH_SIZE:
+                continue
+            await _run_batch(batch, broadcast_log_file)
+            batch = []
             if broadcast_ids.get(broadcast_id) is None:
                 break
-            else:
-                broadcast_ids[broadcast_id].update(
-                    dict(
-                        current=done,
-                        failed=failed,
-                        success=success
-                    )
-                )
-        if broadcast_ids.get(broadcast_id):
-            broadcast_ids.pop(broadcast_id)
-        completed_in = datetime.timedelta(seconds=int(time.time() - start_time))
+        if batch and broadcast_ids.get(broadcast_id) is not None:
+            await _run_batch(batch, broadcast_log_file)
+
+    state['status'] = 'done' if broadcast_ids.get(broadcast_id) else 'cancelled'
+    await db.save_broadcast(state)
+    if broadcast_ids.get(broadcast_id):
+        broadcast_ids.pop(broadcast_id)
+    completed_in = datetime.timedelta(seconds=int(time.time() - state['started_at']))
+    done, success, failed = state['current'], state['success'], state['failed']
+    summary = f"broadcast completed in `{completed_in}`\n\nTotal users {state['total']}.\nTotal done {done}, {success} success and {failed} failed."
+    if out:
         await asyncio.sleep(3)
         await out.delete()
-        if failed == 0:
-            await m.reply_text(
-                text=f"broadcast completed in `{completed_in}`\n\nTotal users {total_users}.\nTotal done {done}, {success} success and {failed} failed.",
-                quote=True
-            )
-        else:
-            await m.reply_document(
-                document='broadcast.txt',
-                caption=f"broadcast completed in `{completed_in}`\n\nTotal users {total_users}.\nTotal done {done}, {success} success and {failed} failed.",
-                quote=True
-            )
-        os.remove('broadcast.txt')
+    if failed == 0:
+        await bot.send_message(chat_id=state['chat_id'], text=summary, reply_to_message_id=state['message_id'])
+    else:
+        await bot.send_document(
+            chat_id=state['chat_id'],
+            document=log_path,
+            caption=summary,
+            reply_to_message_id=state['message_id']
+        )
+    os.remove(log_path)
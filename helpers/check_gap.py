@@ -1,21 +1,12 @@
-import time
-from configs import Config
+from helpers.rate_limit import rate_limiter, retry_seconds
 
-GAP = {}
 
-
-async def CheckTimeGap(user_id: int):
+async def CheckTimeGap(user_id: int, action: str = 'merge'):
     """A Function for checking user time gap!
-    :parameter user_id Telegram User ID"""
+    :parameter user_id Telegram User ID
+    :parameter action Key of helpers.rate_limit.COSTS"""
 
-    if str(user_id) in GAP:
-        current_time = time.time()
-        previous_time = GAP[str(user_id)]
-        if round(current_time - previous_time) < Config.TIME_GAP:
-            return True, round(previous_time - current_time + Config.TIME_GAP)
-        elif round(current_time - previous_time) >= Config.TIME_GAP:
-            del GAP[str(user_id)]
-            return False, None
-    elif str(user_id) not in GAP:
-        GAP[str(user_id)] = time.time()
+    allowed, wait = rate_limiter.check(user_id, action)
+    if allowed:
         return False, None
+    return True, retry_seconds(wait)
@@ -1,39 +1,199 @@
 """
 Enhanced cleanup module with advanced file management
-Provides comprehensive cleanup of temporary files and directories
+Files created by jobs are tracked with an expiry on a timer wheel; deletion
+runs in a thread and the full tree is only reconciled occasionally
 """
 
 import os
+import math
 import shutil
 import asyncio
 import time
-from typing import List, Optional
+from typing import Dict, List, Optional, Set, Tuple
 from configs import Config
+from helpers.blob_store import blob_store
+from helpers.job_store import job_store
+from helpers.user_jobs import user_jobs
+from helpers.tiers import volumes, user_dirs
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+def _is_blob_store(path: str) -> bool:
+    """Check if path is the shared blob store directory"""
+    return os.path.abspath(path) == os.path.abspath(blob_store.root)
+
+
+def _remove_paths(paths: List[str]) -> int:
+    """Blocking removal of files and directory trees, run in a thread"""
+    removed = 0
+    for path in paths:
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+            else:
+                continue
+            removed += 1
+        except Exception as e:
+            logger.warning(f"Failed to remove {path}: {e}")
+    return removed
+
+
 class CleanupManager:
+    """
+    Keeps a registry of tracked paths. Each path sits in the timer wheel slot
+    of its expiry time (slot = ceil(expiry / CLEANUP_TICK)), so registering,
+    refreshing and forgetting a path are O(1) and every tick only looks at
+    the slots that came due.
+    """
+
     def __init__(self):
         self.base_path = Config.DOWN_PATH
+        self.tick = Config.CLEANUP_TICK
+        self._tracked: Dict[str, Tuple[int, int]] = {}  # path -> (owner, slot)
+        self._wheel: Dict[int, Set[str]] = {}
+        self._cursor = int(time.time() // self.tick)
+        self.expired = 0
+
+    # --- Registry ---
+
+    def track(self, path: str, owner: int, ttl: float = None, created_at: float = None):
+        """Register a file or directory created by a job, to be removed after ttl seconds"""
+        path = os.path.abspath(path)
+        self.untrack(path)
+        expires_at = (created_at or time.time()) + (Config.CLEANUP_FILE_TTL if ttl is None else ttl)
+        # Rounded up, so a path is never removed before its ttl is over
+        slot = max(math.ceil(expires_at / self.tick), self._cursor)
+        self._tracked[path] = (owner, slot)
+        self._wheel.setdefault(slot, set()).add(path)
+
+    def untrack(self, path: str):
+        path = os.path.abspath(path)
+        entry = self._tracked.pop(path, None)
+        if entry is None:
+            return
+        bucket = self._wheel.get(entry[1])
+        if bucket is not None:
+            bucket.discard(path)
+            if not bucket:
+                del self._wheel[entry[1]]
+
+    def _untrack_under(self, root: str):
+        root = os.path.abspath(root)
+        prefix = root + os.sep
+        for path in [path for path in self._tracked if path == root or path.startswith(prefix)]:
+            self.untrack(path)
+
+    async def remove(self, paths: List[str]) -> int:
+        """Forget paths and delete them off the event loop"""
+        for path in paths:
+            self._untrack_under(path)
+        return await asyncio.to_thread(_remove_paths, paths)
+
+    async def expire_due(self) -> int:
+        """Remove every tracked path whose slot has come due"""
+        now_slot = int(time.time() // self.tick)
+        due: List[Tuple[str, int]] = []
+        while self._cursor <= now_slot:
+            for path in self._wheel.pop(self._cursor, ()):
+                due.append((path, self._tracked.pop(path)[0]))
+            self._cursor += 1
+
+        expired = []
+        dequeued = False
+        for path, owner in due:
+            if user_jobs.busy(owner):
+                # A merge or queue change is using it, look again shortly
+                self.track(path, owner, ttl=self.tick * 5)
+                continue
+            for queued in job_store.queue(owner):
+                if os.path.abspath(queued) == path:
+                    job_store.remove_from_queue(owner, queued)
+                    dequeued = True
+            expired.append(path)
+        if dequeued:
+            await job_store.flush()
+        if expired:
+            await asyncio.to_thread(_remove_paths, expired)
+            self.expired += len(expired)
+            blob_store.evict()
+            logger.info(f"Expired {len(expired)} tracked path(s)")
+        return len(expired)
+
+    async def reconcile(self) -> int:
+        """Occasional pass over DOWN_PATH for files the registry doesn't know, e.g. after a crash"""
+        keep = set(self._tracked)
+        for user_id in job_store.queued_users():
+            keep.update(os.path.abspath(path) for path in job_store.queue(user_id))
+        busy = {str(user_id) for user_id in user_jobs.busy_users()}
+        orphans = await asyncio.to_thread(self._scan_orphans, keep, busy, time.time() - Config.CLEANUP_FILE_TTL)
+        removed = await asyncio.to_thread(_remove_paths, orphans)
+        if removed:
+            blob_store.evict()
+            logger.info(f"Reconcile removed {removed} untracked path(s)")
+        return removed
+
+    def _scan_orphans(self, keep: Set[str], busy: Set[str], cutoff: float) -> List[str]:
+        """Blocking scan of user directories on every volume, two levels deep only"""
+        orphans = []
+        for volume in volumes():
+            if not os.path.isdir(volume):
+                continue
+            for user_dir in os.listdir(volume):
+                user_path = os.path.join(volume, user_dir)
+                if not user_dir.isdigit() or not os.path.isdir(user_path) or user_dir in busy:
+                    continue
+                try:
+                    entries = os.listdir(user_path)
+                    if not entries and os.path.getmtime(user_path) < cutoff:
+                        orphans.append(user_path)
+                    for entry in entries:
+                        path = os.path.abspath(os.path.join(user_path, entry))
+                        if path not in keep and os.path.getmtime(path) < cutoff:
+                            orphans.append(path)
+                except OSError:
+                    continue
+        return orphans
+
+    async def start_cleanup_scheduler(self):
+        """Expire tracked paths every tick and reconcile every CLEANUP_RECONCILE_INTERVAL"""
+        # The registry starts empty, queued files carry over from the job store
+        for user_id in job_store.queued_users():
+            for item in job_store.queue_items(user_id):
+                self.track(item['file_path'], user_id, created_at=item['added_at'])
+        last_reconcile = time.time()
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.expire_due()
+                if time.time() - last_reconcile >= Config.CLEANUP_RECONCILE_INTERVAL:
+                    last_reconcile = time.time()
+                    await self.reconcile()
+            except Exception as e:
+                logger.error(f"Cleanup scheduler error: {e}")
+
+    # --- Removal ---
 
     async def clean_user_directory(self, user_id: int, keep_recent: bool = False) -> bool:
         """Clean up user's download directory"""
         try:
-            user_dir = f"{self.base_path}/{user_id}"
-
-            if not os.path.exists(user_dir):
-                logger.debug(f"User directory doesn't exist: {user_dir}")
-                return True
-
-            if keep_recent:
-                # Keep files newer than 1 hour
-                cutoff_time = time.time() - 3600
-                await self._clean_old_files(user_dir, cutoff_time)
-            else:
-                # Remove entire directory
-                shutil.rmtree(user_dir, ignore_errors=True)
-                logger.info(f"Cleaned user directory: {user_dir}")
+            for user_dir in user_dirs(user_id):
+                if not os.path.exists(user_dir):
+                    logger.debug(f"User directory doesn't exist: {user_dir}")
+                    continue
+
+                if keep_recent:
+                    # Keep files newer than 1 hour
+                    cutoff_time = time.time() - 3600
+                    await self._clean_old_files(user_dir, cutoff_time)
+                else:
+                    # Remove entire directory; shared blobs only lose this user's link
+                    await self.remove([user_dir])
+                    logger.info(f"Cleaned user directory: {user_dir}")
+            blob_store.evict()
 
             return True
 
@@ -41,8 +201,16 @@ class CleanupManager:
             logger.error(f"Error cleaning user {user_id} directory: {e}")
             return False
 
+    async def clean_job_files(self, paths: List[str]):
+        """Remove what one job used, leaving the rest of the user directory alone"""
+        await self.remove(paths)
+        blob_store.evict()
+
     async def _clean_old_files(self, directory: str, cutoff_time: float):
         """Remove files older than cutoff time"""
+        return await asyncio.to_thread(self._clean_old_files_blocking, directory, cutoff_time)
+
+    def _clean_old_files_blocking(self, directory: str, cutoff_time: float):
         try:
             for root, dirs, files in os.walk(directory):
                 for file in files:
@@ -58,6 +226,9 @@ class CleanupManager:
 
     async def cleanup_temp_files(self, patterns: List[str] = None) -> int:
         """Clean up temporary files matching patterns"""
+        return await asyncio.to_thread(self._cleanup_temp_files_blocking, patterns)
+
+    def _cleanup_temp_files_blocking(self, patterns: List[str] = None) -> int:
         if patterns is None:
             patterns = ['*.tmp', '*.temp', 'input.txt', 'temp_*', '*.part']
 
@@ -65,6 +236,8 @@ class CleanupManager:
 
         try:
             for root, dirs, files in os.walk(self.base_path):
+                # The shared blob store manages its own files
+                dirs[:] = [d for d in dirs if not _is_blob_store(os.path.join(root, d))]
                 for file in files:
                     if any(self._matches_pattern(file, pattern) for pattern in patterns):
                         file_path = os.path.join(root, file)
@@ -91,6 +264,9 @@ class CleanupManager:
 
     async def get_directory_size(self, path: str) -> int:
         """Get total size of directory in bytes"""
+        return await asyncio.to_thread(self._get_directory_size_blocking, path)
+
+    def _get_directory_size_blocking(self, path: str) -> int:
         total_size = 0
         try:
             for root, dirs, files in os.walk(path):
@@ -107,11 +283,15 @@ class CleanupManager:
 
     async def cleanup_large_files(self, max_size_mb: int = 100) -> List[str]:
         """Remove files larger than specified size"""
+        return await asyncio.to_thread(self._cleanup_large_files_blocking, max_size_mb)
+
+    def _cleanup_large_files_blocking(self, max_size_mb: int = 100) -> List[str]:
         max_size_bytes = max_size_mb * 1024 * 1024
         removed_files = []
 
         try:
             for root, dirs, files in os.walk(self.base_path):
+                dirs[:] = [d for d in dirs if not _is_blob_store(os.path.join(root, d))]
                 for file in files:
                     file_path = os.path.join(root, file)
                     try:
@@ -139,37 +319,21 @@ async def clean_downloads(user_id: int) -> bool:
 async def scheduled_cleanup():
     """Perform scheduled cleanup of old files"""
     try:
-        logger.info("Starting scheduled cleanup...")
-
-        # Clean temp files
-        temp_count = await cleanup_manager.cleanup_temp_files()
-
-        # Clean old user directories (older than 24 hours)
-        cutoff_time = time.time() - (24 * 3600)  # 24 hours
-
-        if os.path.exists(Config.DOWN_PATH):
-            for user_dir in os.listdir(Config.DOWN_PATH):
-                user_path = os.path.join(Config.DOWN_PATH, user_dir)
-                if os.path.isdir(user_path):
-                    if os.path.getmtime(user_path) < cutoff_time:
-                        try:
-                            shutil.rmtree(user_path)
-                            logger.info(f"Cleaned old user directory: {user_dir}")
-                        except Exception as e:
-                            logger.warning(f"Failed to clean {user_dir}: {e}")
-
-        logger.info(f"Scheduled cleanup completed. Cleaned {temp_count} temp files.")
-
+        await cleanup_manager.expire_due()
+        await cleanup_manager.reconcile()
     except Exception as e:
         logger.error(f"Scheduled cleanup error: {e}")
 
 async def get_storage_stats() -> dict:
     """Get storage usage statistics"""
+    return await asyncio.to_thread(_storage_stats_blocking)
+
+def _storage_stats_blocking() -> dict:
     try:
         if not os.path.exists(Config.DOWN_PATH):
             return {'total_size': 0, 'file_count': 0, 'user_dirs': 0}
 
-        total_size = await cleanup_manager.get_directory_size(Config.DOWN_PATH)
+        total_size = cleanup_manager._get_directory_size_blocking(Config.DOWN_PATH)
 
         file_count = 0
         user_dirs = 0
@@ -193,10 +357,4 @@ async def get_storage_stats() -> dict:
 # Auto-cleanup scheduler
 async def start_cleanup_scheduler():
     """Start automatic cleanup scheduler"""
-    while True:
-        try:
-            await asyncio.sleep(3600)  # Run every hour
-            await scheduled_cleanup()
-        except Exception as e:
-            logger.error(f"Cleanup scheduler error: {e}")
-            await asyncio.sleep(3600)  # Wait before retrying
+    await cleanup_manager.start_cleanup_scheduler()
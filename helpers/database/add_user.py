@@ -1,16 +1,11 @@
 
 
-from configs import Config
 from helpers.database.access_db import db
+from helpers.log_channel import log_sink
 from pyrogram import Client
 from pyrogram.types import Message
 
 
 async def AddUserToDatabase(bot: Client, cmd: Message):
-    if not await db.is_user_exist(cmd.from_user.id):
-        await db.add_user(cmd.from_user.id)
-        if Config.LOG_CHANNEL is not None:
-            await bot.send_message(
-                int(Config.LOG_CHANNEL),
-                f"#NEW_USER: \n\nNew User [{cmd.from_user.first_name}](tg://user?id={cmd.from_user.id}) started @{(await bot.get_me()).username} !!"
-            )
+    if await db.register_user(cmd.from_user.id):
+        log_sink.event("NEW_USER", f"[{cmd.from_user.first_name}](tg://user?id={cmd.from_user.id})")
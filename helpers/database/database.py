@@ -1,7 +1,25 @@
 
-
+import time
 import datetime
+from collections import OrderedDict
+import logging
 import motor.motor_asyncio
+from pymongo import DeleteMany, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from configs import Config
+
+logger = logging.getLogger(__name__)
+
+# Fields a user document can carry besides id and join_date, with their defaults
+SETTINGS_DEFAULTS = dict(
+    upload_as_doc=False,
+    thumbnail=None,
+    generate_ss=False,
+    generate_sample_video=False,
+    upload_destinations=None
+)
+# Only what the bot reads back is fetched
+USER_PROJECTION = {'_id': 0, 'id': 1, **{field: 1 for field in SETTINGS_DEFAULTS}}
 
 
 class Database:
@@ -10,23 +28,98 @@ class Database:
         self._client = motor.motor_asyncio.AsyncIOMotorClient(uri)
         self.db = self._client[database_name]
         self.col = self.db.users
+        self.broadcasts = self.db.broadcasts
+        # id -> (expires_at, projected user document or None if there is no such user)
+        self._cache = OrderedDict()
 
     def new_user(self, id):
         return dict(
             id=id,
             join_date=datetime.date.today().isoformat(),
-            upload_as_doc=False,
-            thumbnail=None,
-            generate_ss=False,
-            generate_sample_video=False
+            **SETTINGS_DEFAULTS
         )
 
+    def _cache_put(self, id, user):
+        self._cache[id] = (time.time() + Config.USER_CACHE_TTL, user)
+        self._cache.move_to_end(id)
+        while len(self._cache) > Config.USER_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    def _cache_set_field(self, id, field, value):
+        """Write-through: keep a cached document in step with the update just made"""
+        cached = self._cache.get(id)
+        if cached and cached[1] is not None:
+            cached[1][field] = value
+
+    async def _get_user(self, id):
+        id = int(id)
+        cached = self._cache.get(id)
+        if cached and cached[0] > time.time():
+            self._cache.move_to_end(id)
+            return cached[1]
+        user = await self.col.find_one({'id': id}, USER_PROJECTION)
+        self._cache_put(id, user)
+        return user
+
+    async def _set_field(self, id, field, value):
+        await self.col.update_one({'id': int(id)}, {'$set': {field: value}})
+        self._cache_set_field(int(id), field, value)
+
+    async def ensure_indexes(self):
+        """Startup migration: drop duplicate users, then make id unique so lookups stay index-backed"""
+        removed = await self._dedupe_users()
+        if removed:
+            logger.info(f"Removed {removed} duplicate user documents")
+        await self.col.create_index('id', unique=True)
+
+    async def _dedupe_users(self):
+        duplicates = self.col.aggregate([
+            {'$group': {'_id': '$id', 'docs': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+            {'$match': {'count': {'$gt': 1}}}
+        ], allowDiskUse=True)
+        removed = 0
+        async for group in duplicates:
+            # Keep the oldest document, it is the one update_one has been writing settings to
+            extra = sorted(group['docs'])[1:]
+            result = await self.col.delete_many({'_id': {'$in': extra}})
+            removed += result.deleted_count
+        return removed
+
+    async def register_user(self, id):
+        """Insert the user unless known, in one upsert. Returns True if the user is new"""
+        id = int(id)
+        # Only a cached user skips the write; anyone else costs exactly the upsert
+        cached = self._cache.get(id)
+        if cached and cached[0] > time.time() and cached[1] is not None:
+            self._cache.move_to_end(id)
+            return False
+        user = self.new_user(id)
+        try:
+            # The pre-image is None exactly when the upsert inserted, otherwise it is the known user
+            existing = await self.col.find_one_and_update(
+                {'id': id},
+                {'$setOnInsert': {key: value for key, value in user.items() if key != 'id'}},
+                projection=USER_PROJECTION,
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            # Another message of the same user registered them first
+            self._cache.pop(id, None)
+            return False
+        if existing is not None:
+            self._cache_put(id, existing)
+            return False
+        self._cache_put(id, {key: user[key] for key in USER_PROJECTION if key in user})
+        return True
+
     async def add_user(self, id):
         user = self.new_user(id)
         await self.col.insert_one(user)
+        self._cache_put(int(id), {key: user[key] for key in USER_PROJECTION if key in user})
 
     async def is_user_exist(self, id):
-        user = await self.col.find_one({'id': int(id)})
+        user = await self._get_user(id)
         return True if user else False
 
     async def total_users_count(self):
@@ -37,33 +130,62 @@ class Database:
         all_users = self.col.find({})
         return all_users
 
+    def iter_users(self, after=None, batch_size=None):
+        """Cursor over user ids in _id order, optionally resuming after a given _id"""
+        query = {'_id': {'$gt': after}} if after is not None else {}
+        cursor = self.col.find(query, {'_id': 1, 'id': 1}).sort('_id', 1)
+        return cursor.batch_size(batch_size) if batch_size else cursor
+
     async def delete_user(self, user_id):
         await self.col.delete_many({'id': int(user_id)})
+        self._cache.pop(int(user_id), None)
+
+    async def delete_users(self, user_ids):
+        """Remove many users in one unordered bulk write"""
+        if not user_ids:
+            return 0
+        result = await self.col.bulk_write([DeleteMany({'id': int(user_id)}) for user_id in user_ids], ordered=False)
+        for user_id in user_ids:
+            self._cache.pop(int(user_id), None)
+        return result.deleted_count
+
+    async def save_broadcast(self, state):
+        await self.broadcasts.replace_one({'_id': state['_id']}, state, upsert=True)
+
+    async def get_running_broadcasts(self):
+        return await self.broadcasts.find({'status': 'running'}).to_list(None)
+
+    async def get_settings(self, id):
+        """All settings of a user in one lookup, defaults filled in"""
+        user = await self._get_user(id) or {}
+        return {field: user.get(field, default) for field, default in SETTINGS_DEFAULTS.items()}
 
     async def set_upload_as_doc(self, id, upload_as_doc):
-        await self.col.update_one({'id': id}, {'$set': {'upload_as_doc': upload_as_doc}})
+        await self._set_field(id, 'upload_as_doc', upload_as_doc)
 
     async def get_upload_as_doc(self, id):
-        user = await self.col.find_one({'id': int(id)})
-        return user.get('upload_as_doc', False)
+        return (await self.get_settings(id))['upload_as_doc']
 
     async def set_thumbnail(self, id, thumbnail):
-        await self.col.update_one({'id': id}, {'$set': {'thumbnail': thumbnail}})
+        await self._set_field(id, 'thumbnail', thumbnail)
 
     async def get_thumbnail(self, id):
-        user = await self.col.find_one({'id': int(id)})
-        return user.get('thumbnail', None)
+        return (await self.get_settings(id))['thumbnail']
 
     async def set_generate_ss(self, id, generate_ss):
-        await self.col.update_one({'id': id}, {'$set': {'generate_ss': generate_ss}})
+        await self._set_field(id, 'generate_ss', generate_ss)
 
     async def get_generate_ss(self, id):
-        user = await self.col.find_one({'id': int(id)})
-        return user.get('generate_ss', False)
+        return (await self.get_settings(id))['generate_ss']
 
     async def set_generate_sample_video(self, id, generate_sample_video):
-        await self.col.update_one({'id': id}, {'$set': {'generate_sample_video': generate_sample_video}})
+        await self._set_field(id, 'generate_sample_video', generate_sample_video)
 
     async def get_generate_sample_video(self, id):
-        user = await self.col.find_one({'id': int(id)})
-        return user.get('generate_sample_video', False)
+        return (await self.get_settings(id))['generate_sample_video']
+
+    async def set_upload_destinations(self, id, upload_destinations):
+        await self._set_field(id, 'upload_destinations', upload_destinations)
+
+    async def get_upload_destinations(self, id):
+        return (await self.get_settings(id))['upload_destinations']
@@ -0,0 +1,397 @@
+"""
+Upload destinations
+Registry of upload backends that a merged video can be sent to, and the runner
+that uploads to a user's chosen destinations concurrently from one shared read
+"""
+
+import asyncio
+import os
+import time
+import logging
+from typing import AsyncIterable, Awaitable, Callable, Dict, List, Optional
+from configs import Config
+from helpers.database.access_db import db
+from helpers.bandwidth import bandwidth, EGRESS
+from helpers.display_progress import humanbytes, progress_for_pyrogram, edit_status
+from helpers.fanout import FanOutReader, FanOutSink, read_chunks
+from helpers.gofile_uploader import GoFileUploader
+from helpers.log_channel import log_sink
+from helpers.tiers import link_or_clone, same_volume
+from helpers.streamtape import streamtape_upload
+from helpers.tg_uploader import TelegramPartUploader, send_uploaded_media, send_uploaded_album
+from helpers.merger import VideoMerger, split_video, get_video_duration, get_video_resolution
+from pyrogram import Client
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message, User
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(Exception):
+    """A destination rejected or lost the upload"""
+
+
+class UploadJob:
+    """Everything a backend needs to know about one merged video"""
+
+    def __init__(self, bot: Client, user: User, message: Message, file_path: str,
+                 width: int, height: int, duration: float, thumbnail: Optional[str], file_size: int):
+        self.bot = bot
+        self.user = user
+        self.message = message
+        self.file_path = file_path
+        self.file_name = os.path.basename(file_path)
+        self.width = width
+        self.height = height
+        self.duration = duration
+        self.thumbnail = thumbnail
+        self.file_size = file_size
+
+
+class UploadBackend:
+    """
+    Base class for upload destinations. Subclasses implement upload() and return
+    a result dict ({'link': ..., 'detail': ...}) or raise on failure; run() adds the
+    per-backend concurrency limit, timeout and retries around it.
+    """
+
+    name = ""
+    label = ""
+    max_concurrent = 1
+    retries = 1
+
+    def __init__(self):
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def _slots(self) -> asyncio.Semaphore:
+        # Created on first use, backends are registered before the event loop runs
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    def available(self) -> bool:
+        """Whether the backend is configured on this deployment"""
+        return True
+
+    def wants_stream(self, job: UploadJob) -> bool:
+        """Whether the backend consumes the shared read of the file"""
+        return True
+
+    def timeout(self, file_size: int) -> float:
+        """Seconds one attempt may take, scaled to the file size"""
+        return Config.UPLOAD_BASE_TIMEOUT + file_size / Config.UPLOAD_MIN_RATE
+
+    async def upload(self, job: UploadJob, chunks: AsyncIterable[bytes]) -> Dict:
+        raise NotImplementedError
+
+    async def run(self, job: UploadJob, chunks: FanOutSink = None) -> Dict:
+        """Upload with retries, returning {'success': True, ...} or {'success': False, 'error': ...}"""
+        if chunks is not None and self._slots.locked():
+            # Waiting for a free slot would stall the shared read for the other destinations
+            chunks.close()
+            chunks = None
+
+        try:
+            async with self._slots:
+                attempt = 0
+                while True:
+                    # A shared stream can only be consumed once, retries read the file themselves
+                    source = chunks if (chunks is not None and attempt == 0) else read_chunks(job.file_path)
+                    timeout = self.timeout(job.file_size)
+                    try:
+                        result = await asyncio.wait_for(self.upload(job, source), timeout)
+                        result['success'] = True
+                        return result
+                    except Exception as e:
+                        if chunks is not None:
+                            chunks.close()
+                        error = str(e) or (f"Timed out after {round(timeout)}s"
+                                           if isinstance(e, asyncio.TimeoutError) else type(e).__name__)
+                        attempt += 1
+                        if attempt > self.retries:
+                            logger.error(f"{self.name} upload of {job.file_name} failed: {error}")
+                            return {'success': False, 'error': error}
+                        logger.warning(f"{self.name} upload of {job.file_name} failed: {error}, retrying")
+                        await asyncio.sleep(2 ** attempt)
+        finally:
+            if chunks is not None:
+                chunks.close()
+
+
+def _egress_progress(user_id: int, ud_type: str, message: Message):
+    """Progress callback for uploads that also draws from the egress bandwidth budget"""
+    sent = 0
+    start = time.time()
+
+    async def progress(current, total):
+        nonlocal sent
+        await bandwidth.throttle(EGRESS, user_id, current - sent)
+        sent = current
+        await progress_for_pyrogram(current, total, ud_type, message, start)
+
+    return progress
+
+
+async def _metered(chunks: AsyncIterable[bytes], job: UploadJob, ud_type: str):
+    """Pass chunks through, reporting progress and drawing from the egress budget"""
+    progress = _egress_progress(job.user.id, ud_type, job.message)
+    sent = 0
+    async for chunk in chunks:
+        sent += len(chunk)
+        await progress(sent, job.file_size)
+        yield chunk
+
+
+def _upload_state_path(file_path: str) -> str:
+    """Where the acknowledged Telegram parts of a file are remembered"""
+    return f"{file_path}.tgupload"
+
+
+class TelegramBackend(UploadBackend):
+    name = "telegram"
+    label = "📱 Telegram"
+    max_concurrent = Config.TG_CONCURRENT_UPLOADS
+
+    def wants_stream(self, job: UploadJob) -> bool:
+        # Too big for one Telegram message: Telegram gets keyframe-aligned parts instead
+        return job.file_size <= Config.TG_MAX_FILE_SIZE
+
+    def timeout(self, file_size: int) -> float:
+        # Oversize files are split and re-read before uploading
+        factor = 2 if file_size > Config.TG_MAX_FILE_SIZE else 1
+        return factor * super().timeout(file_size)
+
+    async def upload(self, job: UploadJob, chunks: AsyncIterable[bytes]) -> Dict:
+        if not self.wants_stream(job):
+            return await self._upload_parts(job)
+        return await self._upload_single(job, chunks)
+
+    async def _upload_single(self, job: UploadJob, chunks: AsyncIterable[bytes]) -> Dict:
+        bot, user, message = job.bot, job.user, job.message
+        upload_as_doc = await db.get_upload_as_doc(user.id)
+
+        uploader = TelegramPartUploader(
+            bot, job.file_name, job.file_size,
+            progress=_egress_progress(user.id, "📱 Uploading to Telegram ...", message),
+            state_path=_upload_state_path(job.file_path),
+            file_mtime=os.path.getmtime(job.file_path)
+        )
+        input_file = await uploader.upload(chunks)
+
+        sent_ = await send_uploaded_media(
+            bot,
+            chat_id=message.chat.id,
+            input_file=input_file,
+            file_name=job.file_name,
+            as_document=upload_as_doc is not False,
+            duration=job.duration,
+            width=job.width,
+            height=job.height,
+            thumb=job.thumbnail,
+            caption=f"📱 **Telegram Upload Complete**\n\n**File:** `{job.file_name}`",
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton("Developer", url="https://t.me/AbirHasan2005")
+            ]]),
+            resend=lambda part: uploader.resend_part(part, job.file_path)
+        )
+        uploader.finish()
+
+        log_sink.event("UPLOAD", f"[{user.first_name}](tg://user?id={user.id}) `{user.id}` @{user.username}: "
+                                 f"`{job.file_name}` ({humanbytes(job.file_size)})")
+
+        return {'link': f"https://t.me/c/{str(message.chat.id)[4:]}/{sent_.id}"}
+
+    async def _upload_parts(self, job: UploadJob) -> Dict:
+        """Split an oversize video and upload the parts concurrently as one ordered album"""
+        bot, user, message = job.bot, job.user, job.message
+        await edit_status(message, "✂️ **Output exceeds Telegram's size limit, splitting into parts...**")
+        parts = await split_video(job.file_path, Config.TG_MAX_FILE_SIZE)
+        if not parts:
+            raise UploadError("Splitting the oversize video failed")
+
+        upload_as_doc = await db.get_upload_as_doc(user.id)
+        # Part thumbnails go next to the merged file, so they are removed with the merge
+        merger = VideoMerger(user.id, os.path.dirname(job.file_path))
+        part_sizes = [os.path.getsize(part) for part in parts]
+        uploaded = [0] * len(parts)
+        report = _egress_progress(user.id, f"📱 Uploading {len(parts)} parts to Telegram ...", message)
+        slots = asyncio.Semaphore(Config.TG_PARALLEL_PARTS)
+        uploaders = []
+
+        async def _upload_part(index: int, part: str):
+            async def _progress(current, total):
+                uploaded[index] = current
+                await report(sum(uploaded), sum(part_sizes))
+
+            async with slots:
+                thumbnails = await merger.generate_thumbnails(part, count=1)
+                width, height = await get_video_resolution(part)
+                uploader = TelegramPartUploader(
+                    bot, os.path.basename(part), part_sizes[index], progress=_progress,
+                    state_path=_upload_state_path(part),
+                    file_mtime=os.path.getmtime(part)
+                )
+                uploaders.append(uploader)
+                return {
+                    'input_file': await uploader.upload(read_chunks(part)),
+                    'resend': lambda part_index: uploader.resend_part(part_index, part),
+                    'file_name': os.path.basename(part),
+                    'duration': await get_video_duration(part),
+                    'width': width,
+                    'height': height,
+                    'thumb': thumbnails[0] if thumbnails else None,
+                    'caption': f"📱 **Part {index + 1}/{len(parts)}**\n\n**File:** `{os.path.basename(part)}`"
+                }
+
+        items = await asyncio.gather(*[_upload_part(i, part) for i, part in enumerate(parts)])
+        sent = await send_uploaded_album(bot, message.chat.id, items, as_document=upload_as_doc is not False)
+        for uploader in uploaders:
+            uploader.finish()
+
+        return {
+            'link': f"https://t.me/c/{str(message.chat.id)[4:]}/{sent[0].id}",
+            'detail': f"{len(sent)} parts"
+        }
+
+
+class GoFileBackend(UploadBackend):
+    name = "gofile"
+    label = "🌐 GoFile"
+    max_concurrent = Config.GOFILE_CONCURRENT_UPLOADS
+    retries = 0  # GoFileUploader already retries on a freshly chosen server
+
+    def timeout(self, file_size: int) -> float:
+        per_attempt = Config.GOFILE_BASE_TIMEOUT + file_size / Config.GOFILE_MIN_UPLOAD_RATE
+        return Config.MAX_RETRY_ATTEMPTS * per_attempt + 2 ** Config.MAX_RETRY_ATTEMPTS * 2
+
+    async def upload(self, job: UploadJob, chunks: AsyncIterable[bytes]) -> Dict:
+        result = await GoFileUploader().upload_file(job.file_path, job.message, job.user.id, chunks)
+        if not result:
+            raise UploadError("GoFile upload failed")
+        return {'link': result['download_page'], 'file_id': result['file_id']}
+
+
+class StreamtapeBackend(UploadBackend):
+    name = "streamtape"
+    label = "📺 Streamtape"
+    max_concurrent = Config.STREAMTAPE_CONCURRENT_UPLOADS
+
+    def available(self) -> bool:
+        return bool(Config.STREAMTAPE_API_USERNAME and Config.STREAMTAPE_API_PASS)
+
+    async def upload(self, job: UploadJob, chunks: AsyncIterable[bytes]) -> Dict:
+        link = await streamtape_upload(
+            job.file_path,
+            _metered(chunks, job, "📺 Uploading to Streamtape ..."),
+            timeout=self.timeout(job.file_size)
+        )
+        if not link:
+            raise UploadError("Streamtape upload failed")
+        return {'link': link}
+
+
+class LocalDirectoryBackend(UploadBackend):
+    """Copies the output into a local directory, for testing without external services"""
+
+    name = "local"
+    label = "💾 Local"
+    max_concurrent = 2
+
+    def __init__(self, path: Optional[str]):
+        super().__init__()
+        self.path = path
+
+    def available(self) -> bool:
+        return bool(self.path)
+
+    def wants_stream(self, job: UploadJob) -> bool:
+        # On the same volume the output is hard-linked or reflinked instead of copied
+        os.makedirs(self.path, exist_ok=True)
+        return not same_volume(job.file_path, self.path)
+
+    async def upload(self, job: UploadJob, chunks: AsyncIterable[bytes]) -> Dict:
+        target_dir = os.path.join(self.path, str(job.user.id))
+        os.makedirs(target_dir, exist_ok=True)
+        target = os.path.join(target_dir, job.file_name)
+        tmp_path = f"{target}.part"
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+
+        if not self.wants_stream(job):
+            method = await asyncio.to_thread(link_or_clone, job.file_path, tmp_path)
+            os.replace(tmp_path, target)
+            return {'detail': f"`{target}` ({method})"}
+
+        with open(tmp_path, 'wb') as file:
+            async for chunk in _metered(chunks, job, "💾 Copying to local storage ..."):
+                await asyncio.to_thread(file.write, chunk)
+        os.replace(tmp_path, target)
+        return {'detail': f"`{target}`"}
+
+
+BACKENDS: Dict[str, UploadBackend] = {}
+
+
+def register_backend(backend: UploadBackend) -> UploadBackend:
+    BACKENDS[backend.name] = backend
+    return backend
+
+
+def available_backends() -> List[UploadBackend]:
+    return [backend for backend in BACKENDS.values() if backend.available()]
+
+
+def default_destinations() -> List[str]:
+    return [name.strip() for name in Config.UPLOAD_DESTINATIONS.split(",") if name.strip()]
+
+
+async def get_user_destinations(user_id: int) -> List[UploadBackend]:
+    """The user's chosen destinations that are usable here, or the configured defaults"""
+    names = await db.get_upload_destinations(user_id) or default_destinations()
+    chosen = [BACKENDS[name] for name in names if name in BACKENDS and BACKENDS[name].available()]
+    if not chosen:
+        chosen = [BACKENDS[name] for name in default_destinations()
+                  if name in BACKENDS and BACKENDS[name].available()]
+    return chosen
+
+
+async def upload_to_destinations(job: UploadJob, backends: List[UploadBackend],
+                                 on_result: Callable[[UploadBackend, Dict], Awaitable[None]]) -> Dict[str, Dict]:
+    """
+    Upload to all backends at once. Streaming backends share one read of the file,
+    on_result is called as soon as each backend finishes
+    """
+    reader = FanOutReader(job.file_path)
+    streaming = False
+
+    async def _upload(backend: UploadBackend, chunks: Optional[FanOutSink]) -> Dict:
+        result = await backend.run(job, chunks)
+        try:
+            await on_result(backend, result)
+        except Exception as e:
+            logger.error(f"Reporting {backend.name} result failed: {e}")
+        return result
+
+    tasks = []
+    for backend in backends:
+        chunks = None
+        if backend.wants_stream(job):
+            chunks = reader.attach()
+            streaming = True
+        tasks.append(_upload(backend, chunks))
+
+    if streaming:
+        # A failed shared read surfaces in every sink, and the backends retry from disk
+        tasks.append(reader.run())
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    return {
+        backend.name: result if isinstance(result, dict) else {'success': False, 'error': str(result)}
+        for backend, result in zip(backends, results)
+    }
+
+
+register_backend(TelegramBackend())
+register_backend(GoFileBackend())
+register_backend(StreamtapeBackend())
+register_backend(LocalDirectoryBackend(Config.LOCAL_UPLOAD_PATH))
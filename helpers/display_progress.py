@@ -1,43 +1,185 @@
 import math
 import time
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+from pyrogram.errors import FloodWait, MessageNotModified
 from configs import Config
 
+logger = logging.getLogger(__name__)
+
+
+_dispatchers: Dict[Tuple[int, int], "ProgressDispatcher"] = {}
+# Telegram's FloodWait applies to the whole bot, so every dispatcher honours the same deadline
+_flood_until = 0.0
+
+
+class ProgressDispatcher:
+    """
+    Single writer for one status message. Updates only replace the latest pending
+    text; a background task edits the message at most once per interval, skips
+    text that is already shown, and pauses every dispatcher while a FloodWait lasts.
+    """
+
+    def __init__(self, message, interval: float = None):
+        self.message = message
+        self.interval = Config.PROGRESS_UPDATE_INTERVAL if interval is None else interval
+        self._key = (message.chat.id, message.id)
+        self._pending: Optional[Tuple[str, dict]] = None
+        self._urgent = False
+        self._waiters: List[asyncio.Future] = []
+        self._shown = None
+        self._last_edit = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def post(self, text: str, urgent: bool = False, **kwargs):
+        """Replace the pending update. Urgent updates skip the interval, but never a FloodWait"""
+        self._pending = (text, kwargs)
+        self._urgent = self._urgent or urgent
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def edit(self, text: str, **kwargs):
+        """Show a status change promptly, returning once it was sent or superseded"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.post(text, urgent=True, **kwargs)
+        await waiter
+
+    def discard(self):
+        """Drop anything pending, e.g. before the message is deleted"""
+        self._pending = None
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self._resolve(self._waiters)
+        self._waiters = []
+        if _dispatchers.get(self._key) is self:
+            del _dispatchers[self._key]
+
+    async def _run(self):
+        global _flood_until
+        try:
+            while True:
+                now = time.time()
+                if self._pending is None:
+                    # Linger for one interval so the next update still respects it
+                    linger = self._last_edit + self.interval - now
+                    if linger <= 0:
+                        break
+                    await asyncio.sleep(linger)
+                    continue
+
+                due = 0 if self._urgent else self._last_edit + self.interval
+                delay = max(_flood_until, due) - now
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+
+                text, kwargs = self._pending
+                waiters = self._waiters
+                self._pending, self._urgent, self._waiters = None, False, []
+
+                shown = (text, repr(kwargs.get('reply_markup')))
+                if shown != self._shown:
+                    try:
+                        await self.message.edit(text, **kwargs)
+                        self._shown = shown
+                        self._last_edit = time.time()
+                    except FloodWait as e:
+                        _flood_until = max(_flood_until, time.time() + e.value)
+                        logger.warning(f"FloodWait of {e.value}s, pausing progress updates")
+                        if self._pending is None:
+                            self._pending = (text, kwargs)
+                        self._urgent = True
+                        self._waiters = waiters + self._waiters
+                        continue
+                    except MessageNotModified:
+                        self._shown = shown
+                    except Exception as e:
+                        logger.debug(f"Progress edit failed: {e}")
+                self._resolve(waiters)
+        finally:
+            if self._pending is None and _dispatchers.get(self._key) is self:
+                del _dispatchers[self._key]
+
+    @staticmethod
+    def _resolve(waiters: List[asyncio.Future]):
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+def progress_dispatcher(message) -> ProgressDispatcher:
+    """The shared dispatcher of a status message, so concurrent tasks don't edit it independently"""
+    key = (message.chat.id, message.id)
+    dispatcher = _dispatchers.get(key)
+    if dispatcher is None:
+        dispatcher = _dispatchers[key] = ProgressDispatcher(message)
+    return dispatcher
+
+
+async def edit_status(message, text: str, **kwargs):
+    """Edit a status message in order with its progress updates"""
+    await progress_dispatcher(message).edit(text, **kwargs)
+
 
 async def progress_for_pyrogram(current, total, ud_type, message, start):
     now = time.time()
-    diff = now - start
-    if round(diff % 10.00) == 0 or current == total:
-        percentage = current * 100 / total
-        speed = current / diff
-        elapsed_time = round(diff) * 1000
-        time_to_completion = round((total - current) / speed) * 1000
-        estimated_total_time = elapsed_time + time_to_completion
-
-        elapsed_time = TimeFormatter(milliseconds=elapsed_time)
-        estimated_total_time = TimeFormatter(milliseconds=estimated_total_time)
-
-        progress = "[{0}{1}] \n".format(
-            ''.join(["●" for i in range(math.floor(percentage / 5))]),
-            ''.join(["○" for i in range(20 - math.floor(percentage / 5))])
-        )
-
-        tmp = progress + Config.PROGRESS.format(
-            round(percentage, 2),
-            humanbytes(current),
-            humanbytes(total),
-            humanbytes(speed),
-            estimated_total_time if estimated_total_time != '' else "0 s"
-        )
-        try:
-            await message.edit(
-                text="**{}**\n\n {}".format(
-                    ud_type,
-                    tmp
-                ),
-                parse_mode='markdown'
-            )
-        except:
-            pass
+    diff = max(now - start, 0.001)
+    percentage = current * 100 / total if total else 0
+    speed = current / diff
+    elapsed_time = round(diff) * 1000
+    time_to_completion = round((total - current) / speed) * 1000 if speed else 0
+    estimated_total_time = elapsed_time + time_to_completion
+
+    elapsed_time = TimeFormatter(milliseconds=elapsed_time)
+    estimated_total_time = TimeFormatter(milliseconds=estimated_total_time)
+
+    progress = "[{0}{1}] \n".format(
+        ''.join(["●" for i in range(math.floor(percentage / 5))]),
+        ''.join(["○" for i in range(20 - math.floor(percentage / 5))])
+    )
+
+    tmp = progress + Config.PROGRESS.format(
+        round(percentage, 2),
+        humanbytes(current),
+        humanbytes(total),
+        humanbytes(speed),
+        estimated_total_time if estimated_total_time != '' else "0 s"
+    )
+    # The dispatcher keeps only the latest text and decides when to send it
+    progress_dispatcher(message).post(
+        text="**{}**\n\n {}".format(
+            ud_type,
+            tmp
+        ),
+        urgent=current == total
+    )
+
+
+def format_batch_progress(title: str, states: list, start_time: float) -> str:
+    """Render one status text for several concurrent transfers.
+    Each state is a dict with name, downloaded, total, done and error keys."""
+    downloaded = sum(state['downloaded'] for state in states)
+    elapsed_time = time.time() - start_time
+    speed = downloaded / elapsed_time if elapsed_time > 0 else 0
+    finished = sum(1 for state in states if state['done'])
+
+    lines = [f"{title} ({finished}/{len(states)} done)", ""]
+    for i, state in enumerate(states, start=1):
+        if state['error']:
+            status = "❌ failed"
+        elif state['done']:
+            status = "✅ done"
+        elif state['total'] > 0:
+            status = f"{round(state['downloaded'] * 100 / state['total'], 1)}% of {humanbytes(state['total'])}"
+        elif state['downloaded'] > 0:
+            status = humanbytes(state['downloaded'])
+        else:
+            status = "⏳ waiting"
+        lines.append(f"`{i}.` `{state['name'][:40]}` — {status}")
+    lines += ["", f"**Speed:** {humanbytes(speed) or '0 B'}/s"]
+    return "\n".join(lines)
 
 
 def humanbytes(size):
@@ -8,10 +8,57 @@ import asyncio
 import os
 import time
 from urllib.parse import urlparse, unquote
-from typing import Optional, Tuple
+from typing import Optional, Tuple, List, Dict, Any
 import tqdm.asyncio
 from configs import Config
-from helpers.display_progress import humanbytes, TimeFormatter
+from helpers.display_progress import humanbytes, TimeFormatter, format_batch_progress, progress_dispatcher, edit_status
+from helpers.blob_store import blob_store
+from helpers.tiers import input_dir
+from helpers.bandwidth import bandwidth, INGRESS
+
+# Shared download slots: one global limit plus one limit per user
+_global_slots: Optional[asyncio.Semaphore] = None
+_user_slots: Dict[int, List[Any]] = {}
+
+
+class _DownloadSlot:
+    """Holds one global download slot plus one of the user's own slots"""
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.entry = None
+
+    async def __aenter__(self):
+        global _global_slots
+        if _global_slots is None:
+            _global_slots = asyncio.Semaphore(Config.CONCURRENT_DOWNLOADS)
+
+        # [semaphore, holders] - the entry is dropped once the user has no downloads left
+        self.entry = _user_slots.setdefault(
+            self.user_id, [asyncio.Semaphore(Config.USER_CONCURRENT_DOWNLOADS), 0]
+        )
+        self.entry[1] += 1
+        try:
+            await self.entry[0].acquire()
+            try:
+                await _global_slots.acquire()
+            except BaseException:
+                self.entry[0].release()
+                raise
+        except BaseException:
+            self._drop_holder()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        _global_slots.release()
+        self.entry[0].release()
+        self._drop_holder()
+
+    def _drop_holder(self):
+        self.entry[1] -= 1
+        if self.entry[1] == 0:
+            _user_slots.pop(self.user_id, None)
 
 
 class DirectDownloader:
@@ -33,39 +80,114 @@ class DirectDownloader:
         if self.session:
             await self.session.close()
 
-    async def download_from_url(self, url: str, user_id: int, message) -> Optional[str]:
+    async def download_from_url(self, url: str, user_id: int, message,
+                                state: Optional[Dict[str, Any]] = None) -> Optional[str]:
         """
         Download video from direct URL
         Returns: Downloaded file path or None if failed
         """
+        file_path = None
+        kept = False
         try:
             # Validate URL and get filename
             filename = self._get_filename_from_url(url)
             if not filename:
-                await message.edit("❌ Invalid URL or unsupported file type!")
+                await self._report_error(message, state, "❌ Invalid URL or unsupported file type!")
                 return None
 
-            download_path = f"{Config.DOWN_PATH}/{user_id}"
-            os.makedirs(download_path, exist_ok=True)
+            async with _DownloadSlot(user_id):
+                download_path = input_dir(user_id)
+
+                file_path = os.path.join(download_path, filename)
 
-            file_path = os.path.join(download_path, filename)
+                # Check if file already exists
+                if os.path.exists(file_path):
+                    file_path = self._get_unique_filename(file_path)
+                # Reserve the name so parallel downloads of the same filename don't collide
+                open(file_path, 'wb').close()
 
-            # Check if file already exists
-            if os.path.exists(file_path):
-                file_path = self._get_unique_filename(file_path)
+                # Reuse a copy another user already downloaded
+                cache_key = await self._get_cache_key(url)
+                if cache_key and blob_store.fetch(cache_key, file_path):
+                    await self._report_done(message, state, os.path.getsize(file_path))
+                    kept = True
+                    return file_path
 
-            # Start download with progress tracking
-            success = await self._download_with_progress(url, file_path, message)
+                # Start download with progress tracking
+                success = await self._download_with_progress(url, file_path, message, state, user_id)
 
             if success:
+                if cache_key:
+                    blob_store.add(cache_key, file_path)
+                kept = True
                 return file_path
-            else:
-                return None
+            return None
 
         except Exception as e:
-            await message.edit(f"❌ Download failed: {str(e)}")
+            await self._report_error(message, state, f"❌ Download failed: {str(e)}")
+            return None
+        finally:
+            # A failed download or its placeholder would otherwise be picked up with the queue
+            if not kept and file_path and os.path.exists(file_path):
+                os.remove(file_path)
+
+    async def download_many(self, urls: List[str], user_id: int, message) -> List[Optional[str]]:
+        """
+        Download several URLs concurrently with one aggregated progress message
+        Returns: File paths (or None for failures) in the same order as urls
+        """
+        states = [
+            {'name': self._get_filename_from_url(url) or url, 'downloaded': 0, 'total': 0,
+             'done': False, 'error': None}
+            for url in urls
+        ]
+        start_time = time.time()
+
+        async def _report_loop():
+            while True:
+                await asyncio.sleep(Config.PROGRESS_UPDATE_INTERVAL)
+                await self._update_batch_progress(message, states, start_time)
+
+        reporter = asyncio.create_task(_report_loop())
+        try:
+            results = await asyncio.gather(*[
+                self.download_from_url(url, user_id, message, state)
+                for url, state in zip(urls, states)
+            ])
+        finally:
+            reporter.cancel()
+
+        return list(results)
+
+    async def _get_cache_key(self, url: str) -> Optional[str]:
+        """Build the blob store key from the URL and the server's validators"""
+        if not blob_store.enabled:
+            return None
+        try:
+            async with self.session.head(url, allow_redirects=True) as response:
+                if response.status != 200:
+                    return None
+                return blob_store.url_key(url, response.headers)
+        except Exception:
             return None
 
+    @staticmethod
+    async def _report_done(message, state: Optional[Dict[str, Any]], size: int):
+        """Mark a download finished without transferring anything"""
+        if state is not None:
+            state.update(downloaded=size, total=size, done=True)
+            return
+        await edit_status(message, "✅ Download completed! Processing...")
+
+    @staticmethod
+    async def _report_error(message, state: Optional[Dict[str, Any]], text: str):
+        """Record an error in batch state, or show it directly for single downloads"""
+        if state is not None:
+            state['error'] = text
+            state['done'] = True
+            return
+        await edit_status(message, text)
+
     def _get_filename_from_url(self, url: str) -> Optional[str]:
         """Extract filename from URL"""
         parsed = urlparse(url)
@@ -90,24 +212,30 @@ class DirectDownloader:
             counter += 1
         return file_path
 
-    async def _download_with_progress(self, url: str, file_path: str, message) -> bool:
+    async def _download_with_progress(self, url: str, file_path: str, message,
+                                      state: Optional[Dict[str, Any]] = None,
+                                      user_id: int = None) -> bool:
         """Download file with progress tracking"""
         try:
             async with self.session.get(url) as response:
                 if response.status != 200:
-                    await message.edit(f"❌ Server returned status {response.status}")
+                    await self._report_error(message, state, f"❌ Server returned status {response.status}")
                     return False
 
                 total_size = int(response.headers.get('Content-Length', 0))
 
                 if total_size > Config.MAX_DOWNLOAD_SIZE:
-                    await message.edit(
+                    await self._report_error(
+                        message, state,
                         f"❌ File too large! "
                         f"Max size: {humanbytes(Config.MAX_DOWNLOAD_SIZE)}, "
                         f"File size: {humanbytes(total_size)}"
                     )
                     return False
 
+                if state is not None:
+                    state['total'] = total_size
+
                 downloaded = 0
                 start_time = time.time()
                 last_update = 0
@@ -116,10 +244,16 @@ class DirectDownloader:
                     async for chunk in response.content.iter_chunked(8192):
                         file.write(chunk)
                         downloaded += len(chunk)
+                        await bandwidth.throttle(INGRESS, user_id, len(chunk))
 
-                        # Update progress every 2 seconds
+                        if state is not None:
+                            # Batch downloads are reported by download_many
+                            state['downloaded'] = downloaded
+                            continue
+
+                        # Rendering per 8KB chunk is wasteful, the dispatcher decides when to edit
                         current_time = time.time()
-                        if current_time - last_update > 2:
+                        if current_time - last_update > 1:
                             await self._update_progress(
                                 message, downloaded, total_size, 
                                 start_time, current_time
@@ -127,14 +261,17 @@ class DirectDownloader:
                             last_update = current_time
 
                 # Final progress update
-                await message.edit("✅ Download completed! Processing...")
+                if state is not None:
+                    state['done'] = True
+                else:
+                    await edit_status(message, "✅ Download completed! Processing...")
                 return True
 
         except asyncio.TimeoutError:
-            await message.edit("❌ Download timed out!")
+            await self._report_error(message, state, "❌ Download timed out!")
             return False
         except Exception as e:
-            await message.edit(f"❌ Download error: {str(e)}")
+            await self._report_error(message, state, f"❌ Download error: {str(e)}")
             return False
 
     async def _update_progress(self, message, downloaded: int, total_size: int, 
@@ -165,7 +302,10 @@ class DirectDownloader:
             eta_str
         )
 
-        try:
-            await message.edit(progress_text)
-        except:
-            pass  # Ignore edit errors
+        progress_dispatcher(message).post(progress_text)
+
+    async def _update_batch_progress(self, message, states: List[Dict[str, Any]], start_time: float):
+        """Update the aggregated progress message of a batch download"""
+        progress_dispatcher(message).post(
+            format_batch_progress(f"📥 **Downloading {len(states)} links...**", states, start_time)
+        )
@@ -0,0 +1,92 @@
+"""
+Background job executor
+Handlers only admit work; downloads, merges and uploads run here with a
+concurrency limit per class of work, so the update workers stay free
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Optional, Set
+from configs import Config
+from helpers.display_progress import edit_status
+from pyrogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+
+class JobExecutor:
+    def __init__(self, limits: Dict[str, int]):
+        self.limits = limits
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.running = {kind: 0 for kind in limits}
+        self.waiting = {kind: 0 for kind in limits}
+
+    def _semaphore(self, kind: str) -> asyncio.Semaphore:
+        # Created on first use so they bind to the running loop
+        if kind not in self._slots:
+            self._slots[kind] = asyncio.Semaphore(self.limits[kind])
+        return self._slots[kind]
+
+    @asynccontextmanager
+    async def slot(self, kind: str, status: Optional[Message] = None):
+        """Hold one slot of a class of work, telling the user if they have to wait for it"""
+        semaphore = self._semaphore(kind)
+        if semaphore.locked() and status is not None:
+            await edit_status(status, f"⏳ **Waiting for a free {kind} slot...** ({self.waiting[kind] + 1} waiting)")
+        self.waiting[kind] += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting[kind] -= 1
+        self.running[kind] += 1
+        try:
+            yield
+        finally:
+            self.running[kind] -= 1
+            semaphore.release()
+
+    def submit(self, work: Awaitable, on_error: Callable[[Exception], Awaitable] = None) -> asyncio.Task:
+        """Run work in the background. on_error is awaited if it raises"""
+        async def _run():
+            try:
+                await work
+            except Exception as e:
+                logger.error(f"Background job failed: {e}")
+                if on_error is not None:
+                    try:
+                        await on_error(e)
+                    except Exception:
+                        pass
+
+        task = asyncio.create_task(_run())
+        # Keep a reference, the loop only holds weak ones
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def shutdown(self):
+        """Cancel the background jobs still running and wait for them to unwind"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {kind: {'running': self.running[kind], 'waiting': self.waiting[kind], 'limit': limit}
+                for kind, limit in self.limits.items()}
+
+
+def reply_error(message: Message) -> Callable[[Exception], Awaitable]:
+    """on_error callback for background jobs admitted from a message"""
+    async def _reply(e: Exception):
+        await message.reply_text(f"❌ **Error:** `{str(e)}`")
+    return _reply
+
+
+executor = JobExecutor({
+    'download': Config.MAX_DOWNLOAD_JOBS,
+    'merge': Config.MAX_MERGE_JOBS,
+    'upload': Config.MAX_UPLOAD_JOBS,
+})
@@ -0,0 +1,135 @@
+"""
+Single-read fan-out for concurrent uploads
+Reads a file once in large chunks and hands every chunk to all attached upload sinks
+"""
+
+import asyncio
+import logging
+from typing import List
+from configs import Config
+
+logger = logging.getLogger(__name__)
+
+
+async def read_chunks(file_path: str, chunk_size: int = None):
+    """Plain chunked read for uploads that have a file to themselves"""
+    chunk_size = chunk_size or Config.FANOUT_CHUNK_SIZE
+    with open(file_path, 'rb') as file:
+        while True:
+            chunk = await asyncio.to_thread(file.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+class FanOutSink:
+    """One consumer's view of the shared read, iterated with `async for chunk in sink`"""
+
+    def __init__(self, file_path: str, chunk_size: int, max_lag: int):
+        # The bounded queue is what limits how far this sink may fall behind the reader
+        self._queue: asyncio.Queue = asyncio.Queue(max_lag)
+        self._file_path = file_path
+        self._chunk_size = chunk_size
+        self._position = 0
+        self._file = None
+        self.closed = False
+        # Set when the reader gave up waiting on this sink, the rest is read from disk by the sink itself
+        self.detached = False
+
+    @property
+    def active(self) -> bool:
+        return not self.closed and not self.detached
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        if self.closed:
+            raise StopAsyncIteration
+        if self.detached and self._queue.empty():
+            return await self._read_own()
+        chunk = await self._queue.get()
+        if chunk is None:
+            self.closed = True
+            raise StopAsyncIteration
+        if isinstance(chunk, Exception):
+            # The shared read failed, the upload must not finish with a truncated file
+            self.closed = True
+            raise chunk
+        self._position += len(chunk)
+        return chunk
+
+    def close(self):
+        """Detach from the reader, e.g. after the upload failed. Never blocks the other sinks"""
+        self.closed = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    async def _read_own(self) -> bytes:
+        """Continue from where the shared read left this sink"""
+        if self._file is None:
+            self._file = open(self._file_path, 'rb')
+            self._file.seek(self._position)
+        chunk = await asyncio.to_thread(self._file.read, self._chunk_size)
+        if not chunk:
+            self.close()
+            raise StopAsyncIteration
+        self._position += len(chunk)
+        return chunk
+
+    async def _feed(self, chunk, patience: float = None):
+        if not self.active:
+            return
+        if not patience:
+            await self._queue.put(chunk)
+            return
+        try:
+            await asyncio.wait_for(self._queue.put(chunk), patience)
+        except asyncio.TimeoutError:
+            # A slow destination must not hold back the others, it falls back to its own reads
+            self.detached = True
+            logger.info(f"Fan-out sink for {self._file_path} fell behind, reading on its own")
+
+
+class FanOutReader:
+    """
+    Attach one sink per destination, then run() the reader alongside the consumers.
+    The file is read once for all sinks that keep up. The reader never gets more
+    than max_lag chunks ahead of a sink, and a sink that stays that far behind for
+    FANOUT_LAG_TIMEOUT seconds is detached and reads the rest of the file itself.
+    """
+
+    def __init__(self, file_path: str, chunk_size: int = None, max_lag: int = None):
+        self.file_path = file_path
+        self.chunk_size = chunk_size or Config.FANOUT_CHUNK_SIZE
+        self.max_lag = max_lag or Config.FANOUT_MAX_LAG
+        self._sinks: List[FanOutSink] = []
+
+    def attach(self) -> FanOutSink:
+        sink = FanOutSink(self.file_path, self.chunk_size, self.max_lag)
+        self._sinks.append(sink)
+        return sink
+
+    async def run(self) -> int:
+        """Read the file and feed all sinks. Returns the number of bytes read"""
+        total = 0
+        end = None
+        try:
+            with open(self.file_path, 'rb') as file:
+                while any(sink.active for sink in self._sinks):
+                    chunk = await asyncio.to_thread(file.read, self.chunk_size)
+                    if not chunk:
+                        break
+                    total += len(chunk)
+                    await asyncio.gather(*[sink._feed(chunk, Config.FANOUT_LAG_TIMEOUT) for sink in self._sinks])
+        except Exception as e:
+            end = IOError(f"Reading {self.file_path} failed: {e}")
+            raise
+        finally:
+            for sink in self._sinks:
+                await sink._feed(end)
+        logger.debug(f"Fan-out read {total} bytes of {self.file_path} for {len(self._sinks)} sinks")
+        return total
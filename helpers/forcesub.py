@@ -1,21 +1,83 @@
 
 
+import time
+from collections import OrderedDict
 from configs import Config
+from pyrogram.enums import ChatMemberStatus
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from pyrogram.errors import UserNotParticipant
 
+MEMBER = "member"
+LEFT = "left"
+BANNED = "banned"
 
-async def ForceSub(bot, cmd):
+# user_id -> (status, expires_at), oldest first
+_membership = OrderedDict()
+
+
+def _cached_status(user_id: int):
+    entry = _membership.get(user_id)
+    if entry is None:
+        return None
+    status, expires_at = entry
+    if time.monotonic() >= expires_at:
+        del _membership[user_id]
+        return None
+    _membership.move_to_end(user_id)
+    return status
+
+
+def _cache_status(user_id: int, status: str):
+    # Joining is what we are waiting for, so a non-member is re-checked sooner
+    ttl = Config.FORCESUB_CACHE_TTL if status == MEMBER else Config.FORCESUB_NEGATIVE_TTL
+    _membership[user_id] = (status, time.monotonic() + ttl)
+    _membership.move_to_end(user_id)
+    while len(_membership) > Config.FORCESUB_CACHE_SIZE:
+        _membership.popitem(last=False)
+
+
+def invalidate_membership(user_id: int):
+    """Forget a cached status, e.g. when the channel reports the user joined or left"""
+    _membership.pop(user_id, None)
+
+
+async def _membership_status(bot, user_id: int) -> str:
+    status = _cached_status(user_id)
+    if status is not None:
+        return status
     try:
-        user = await bot.get_chat_member(chat_id=Config.UPDATES_CHANNEL, user_id=cmd.from_user.id)
-        if user.status == "kicked":
-            await bot.send_message(
-                chat_id=cmd.from_user.id,
-                text="You Are Banned From Updates Channel !",
-                disable_web_page_preview=True
-            )
-            return 400
+        member = await bot.get_chat_member(chat_id=Config.UPDATES_CHANNEL, user_id=user_id)
+        if member.status == ChatMemberStatus.BANNED:
+            status = BANNED
+        elif member.status == ChatMemberStatus.LEFT:
+            status = LEFT
+        else:
+            status = MEMBER
     except UserNotParticipant:
+        status = LEFT
+    _cache_status(user_id, status)
+    return status
+
+
+async def ForceSub(bot, cmd):
+    try:
+        status = await _membership_status(bot, cmd.from_user.id)
+    except Exception as e:
+        print(f"ForceSub Error: {e}")
+        await bot.send_message(
+            chat_id=cmd.from_user.id,
+            text="Something went wrong, please contact bot admin.",
+            disable_web_page_preview=True
+        )
+        return 200
+    if status == BANNED:
+        await bot.send_message(
+            chat_id=cmd.from_user.id,
+            text="You Are Banned From Updates Channel !",
+            disable_web_page_preview=True
+        )
+        return 400
+    if status == LEFT:
         await bot.send_message(
             chat_id=cmd.from_user.id,
             text="**You Have To Join My Updates Channel To Use Me**\n\nJoin Channel and Try Again!",
@@ -29,12 +91,4 @@ async def ForceSub(bot, cmd):
             disable_web_page_preview=True
         )
         return 400
-    except Exception as e:
-        print(f"ForceSub Error: {e}")
-        await bot.send_message(
-            chat_id=cmd.from_user.id,
-            text="Something went wrong, please contact bot admin.",
-            disable_web_page_preview=True
-        )
-        return 200
     return 200
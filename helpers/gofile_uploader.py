@@ -6,24 +6,36 @@ Provides seamless file upload to GoFile.io with error handling
 import aiohttp
 import asyncio
 import os
-from typing import Optional, Dict, Any
+import time
+from typing import Optional, Dict, Any, AsyncIterable, List, Tuple
 from configs import Config
+from helpers.bandwidth import bandwidth, EGRESS
+from helpers.display_progress import progress_for_pyrogram, edit_status
+from helpers.fanout import read_chunks
+
+
+class _RetryableUploadError(Exception):
+    """Upload failed in a way worth retrying (5xx, dropped connection, timeout)"""
 
 
 class GoFileUploader:
+    # Best server shared by every uploader: (server name, expiry timestamp)
+    _server_cache: Optional[Tuple[str, float]] = None
+
     def __init__(self):
-        self.upload_endpoint = Config.GOFILE_UPLOAD_ENDPOINT
         self.api_token = Config.GOFILE_API_TOKEN
 
-    async def upload_file(self, file_path: str, message=None) -> Optional[Dict[str, Any]]:
+    async def upload_file(self, file_path: str, message=None, user_id: int = None,
+                          chunks: AsyncIterable[bytes] = None) -> Optional[Dict[str, Any]]:
         """
         Upload file to GoFile.io
+        Streams from chunks (e.g. a shared fan-out read) when given, otherwise reads the file itself
         Returns: Upload response with download link or None if failed
         """
         try:
             if not os.path.exists(file_path):
                 if message:
-                    await message.edit("❌ File not found for GoFile upload!")
+                    await edit_status(message, "❌ File not found for GoFile upload!")
                 return None
 
             # Get file size for progress tracking
@@ -31,72 +43,157 @@ class GoFileUploader:
             filename = os.path.basename(file_path)
 
             if message:
-                await message.edit(f"🌐 Uploading to GoFile.io: {filename}")
-
-            # Create form data for upload
-            async with aiohttp.ClientSession() as session:
-                with open(file_path, 'rb') as file:
-                    # Prepare form data
-                    form_data = aiohttp.FormData()
-                    form_data.add_field('file', file, filename=filename)
-
-                    # Add token if available (for account uploads)
-                    if self.api_token:
-                        form_data.add_field('token', self.api_token)
-
-                    # Upload with timeout
-                    timeout = aiohttp.ClientTimeout(total=600)  # 10 minutes for upload
-
-                    async with session.post(
-                        self.upload_endpoint,
-                        data=form_data,
-                        timeout=timeout
-                    ) as response:
-
-                        if response.status == 200:
-                            result = await response.json()
-
-                            if result.get('status') == 'ok':
-                                download_page = result['data']['downloadPage']
-
-                                if message:
-                                    await message.edit(f"✅ GoFile upload completed!\n🔗 Link: {download_page}")
-
-                                return {
-                                    'success': True,
-                                    'download_page': download_page,
-                                    'file_id': result['data'].get('code'),
-                                    'file_size': file_size,
-                                    'filename': filename
-                                }
-                            else:
-                                error_msg = result.get('message', 'Unknown error')
-                                if message:
-                                    await message.edit(f"❌ GoFile upload failed: {error_msg}")
-                                return None
-                        else:
-                            if message:
-                                await message.edit(f"❌ GoFile server error: {response.status}")
-                            return None
-
-        except asyncio.TimeoutError:
-            if message:
-                await message.edit("❌ GoFile upload timed out!")
+                await edit_status(message, f"🌐 Uploading to GoFile.io: {filename}")
+
+            for attempt in range(Config.MAX_RETRY_ATTEMPTS):
+                server = await self.get_server()
+                if not server:
+                    if message:
+                        await edit_status(message, "❌ No GoFile server available!")
+                    return None
+
+                # A shared stream can only be consumed once, retries read the file themselves
+                source = chunks if (chunks is not None and attempt == 0) else read_chunks(file_path, Config.CHUNK_SIZE)
+
+                try:
+                    result = await self._post(server, source, filename, file_size, message, user_id)
+                except _RetryableUploadError as e:
+                    self._detach(chunks)
+                    GoFileUploader._server_cache = None  # Pick a server again next time
+                    if attempt + 1 >= Config.MAX_RETRY_ATTEMPTS:
+                        if message:
+                            await edit_status(message, f"❌ GoFile upload failed: {e}")
+                        return None
+                    await asyncio.sleep(2 ** (attempt + 1))
+                    continue
+
+                if result.get('status') == 'ok':
+                    download_page = result['data']['downloadPage']
+
+                    if message:
+                        await edit_status(message, f"✅ GoFile upload completed!\n🔗 Link: {download_page}")
+
+                    return {
+                        'success': True,
+                        'download_page': download_page,
+                        'file_id': result['data'].get('code'),
+                        'file_size': file_size,
+                        'filename': filename
+                    }
+                else:
+                    error_msg = result.get('message') or result.get('status', 'Unknown error')
+                    if message:
+                        await edit_status(message, f"❌ GoFile upload failed: {error_msg}")
+                    return None
+
             return None
+
         except Exception as e:
             if message:
-                await message.edit(f"❌ GoFile upload error: {str(e)}")
+                await edit_status(message, f"❌ GoFile upload error: {str(e)}")
             return None
+        finally:
+            self._detach(chunks)
+
+    async def _post(self, server: str, chunks: AsyncIterable[bytes], filename: str, file_size: int,
+                    message, user_id: int) -> Dict[str, Any]:
+        """Stream one upload attempt to a GoFile server"""
+        form_data = aiohttp.FormData()
+        form_data.add_field(
+            'file',
+            self._counting(chunks, file_size, message, user_id),
+            filename=filename
+        )
+
+        headers = {}
+        # Add token if available (for account uploads)
+        if self.api_token:
+            form_data.add_field('token', self.api_token)
+            headers['Authorization'] = f"Bearer {self.api_token}"
+
+        # Allow for a slow link instead of a fixed ceiling: base time plus size at the minimum rate
+        timeout = aiohttp.ClientTimeout(
+            total=Config.GOFILE_BASE_TIMEOUT + file_size / Config.GOFILE_MIN_UPLOAD_RATE,
+            sock_connect=30
+        )
+
+        try:
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.post(
+                    f"https://{server}.gofile.io/contents/uploadfile",
+                    data=form_data,
+                    headers=headers
+                ) as response:
+                    if response.status >= 500:
+                        raise _RetryableUploadError(f"GoFile server error: {response.status}")
+                    if response.status != 200:
+                        return {'status': 'error', 'message': f"GoFile server error: {response.status}"}
+                    return await response.json(content_type=None)
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+            raise _RetryableUploadError(str(e) or "GoFile upload timed out") from e
+
+    @staticmethod
+    async def _counting(chunks: AsyncIterable[bytes], file_size: int, message, user_id: int):
+        """Stream chunks to aiohttp, counting bytes for progress and drawing from the egress budget"""
+        sent = 0
+        start = time.time()
+        async for chunk in chunks:
+            await bandwidth.throttle(EGRESS, user_id, len(chunk))
+            yield chunk
+            sent += len(chunk)
+            if message:
+                await progress_for_pyrogram(sent, file_size, "🌐 Uploading to GoFile.io ...", message, start)
+
+    @staticmethod
+    def _detach(chunks):
+        """Stop consuming a shared stream so the other uploads reading it are not held back"""
+        if chunks is not None and hasattr(chunks, 'close'):
+            chunks.close()
 
     async def get_server(self) -> Optional[str]:
-        """Get best available GoFile server"""
+        """Get best available GoFile server, cached for GOFILE_SERVER_TTL seconds"""
+        cached = GoFileUploader._server_cache
+        if cached and cached[1] > time.time():
+            return cached[0]
+
+        servers = await self._list_servers()
+        if not servers:
+            return None
+
+        latencies = await asyncio.gather(*[self._measure_latency(server) for server in servers])
+        reachable = [(latency, server) for latency, server in zip(latencies, servers) if latency is not None]
+        best = min(reachable)[1] if reachable else servers[0]
+
+        GoFileUploader._server_cache = (best, time.time() + Config.GOFILE_SERVER_TTL)
+        return best
+
+    async def _list_servers(self) -> List[str]:
+        """Ask the GoFile API for the upload servers currently accepting files"""
         try:
-            async with aiohttp.ClientSession() as session:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15)) as session:
+                async with session.get('https://api.gofile.io/servers') as response:
+                    if response.status == 200:
+                        result = await response.json(content_type=None)
+                        if result.get('status') == 'ok':
+                            return [server['name'] for server in result['data'].get('servers', [])]
+
+                # Older API returns a single server
                 async with session.get('https://api.gofile.io/getServer') as response:
                     if response.status == 200:
-                        result = await response.json()
+                        result = await response.json(content_type=None)
                         if result.get('status') == 'ok':
-                            return result['data']['server']
-            return None
+                            return [result['data']['server']]
+            return []
+        except:
+            return []
+
+    @staticmethod
+    async def _measure_latency(server: str) -> Optional[float]:
+        """Round-trip time of a small request to an upload server"""
+        try:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+                start = time.monotonic()
+                async with session.head(f"https://{server}.gofile.io/"):
+                    return time.monotonic() - start
         except:
             return None
@@ -0,0 +1,546 @@
+"""
+Durable job and queue store
+Keeps every user's merge queue and job states across restarts, in an embedded
+SQLite database by default or in MongoDB
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import asyncio
+import threading
+import logging
+from typing import Dict, List, Optional, Tuple
+import motor.motor_asyncio
+from pymongo import DeleteOne, ReplaceOne, ReturnDocument
+from pymongo.errors import OperationFailure
+from configs import Config
+from helpers.tiers import volumes
+from helpers.sessions import sessions, QueueEntry
+
+logger = logging.getLogger(__name__)
+
+# Created by the bot, workers never claim it until submit() queues it
+PENDING = "pending"
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED_STATES = (DONE, FAILED)
+
+# Finished jobs are kept this long for reference, then dropped at startup
+FINISHED_JOB_RETENTION = 7 * 24 * 3600
+
+JOB_FIELDS = ('id', 'user_id', 'kind', 'state', 'payload', 'error', 'created_at', 'updated_at')
+
+
+class _SQLiteBackend:
+    """
+    One file, one connection; every flush is a single transaction run off the event loop.
+    Transactions belong to the connection, not the thread, so calls take turns on it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # Workers on the same host share the file, wait for their writes instead of failing
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS queue_items (
+                    user_id INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    file_path TEXT NOT NULL,
+                    reply_id INTEGER,
+                    added_at REAL NOT NULL,
+                    PRIMARY KEY (user_id, position)
+                );
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, kind);
+            """)
+        return self._conn
+
+    def _load(self) -> Tuple[Dict[int, List[dict]], List[dict]]:
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?",
+                (*FINISHED_STATES, time.time() - FINISHED_JOB_RETENTION)
+            )
+        queues: Dict[int, List[dict]] = {}
+        for user_id, file_path, reply_id, added_at in conn.execute(
+                "SELECT user_id, file_path, reply_id, added_at FROM queue_items ORDER BY user_id, position"):
+            queues.setdefault(user_id, []).append(
+                {'file_path': file_path, 'reply_id': reply_id, 'added_at': added_at}
+            )
+        jobs = []
+        for row in conn.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs"):
+            job = dict(zip(JOB_FIELDS, row))
+            job['payload'] = json.loads(job['payload'])
+            jobs.append(job)
+        return queues, jobs
+
+    def _apply(self, queues: Dict[int, List[dict]], jobs: List[dict]):
+        conn = self._connect()
+        with conn:
+            for user_id, items in queues.items():
+                conn.execute("DELETE FROM queue_items WHERE user_id = ?", (user_id,))
+                conn.executemany(
+                    "INSERT INTO queue_items (user_id, position, file_path, reply_id, added_at) VALUES (?, ?, ?, ?, ?)",
+                    [(user_id, position, item['file_path'], item['reply_id'], item['added_at'])
+                     for position, item in enumerate(items)]
+                )
+            conn.executemany(
+                f"INSERT OR REPLACE INTO jobs ({', '.join(JOB_FIELDS)}) VALUES ({', '.join('?' * len(JOB_FIELDS))})",
+                [tuple(json.dumps(job[field]) if field == 'payload' else job[field] for field in JOB_FIELDS)
+                 for job in jobs]
+            )
+
+    def _claim(self, kind: str, worker: str) -> Optional[dict]:
+        conn = self._connect()
+        while True:
+            row = conn.execute(
+                f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE kind = ? AND state = ? ORDER BY created_at LIMIT 1",
+                (kind, QUEUED)
+            ).fetchone()
+            if row is None:
+                return None
+            job = dict(zip(JOB_FIELDS, row))
+            job['payload'] = json.loads(job['payload'])
+            job['payload'].update(worker=worker, lease=uuid.uuid4().hex)
+            job.update(state=RUNNING, updated_at=time.time())
+            with conn:
+                claimed = conn.execute(
+                    "UPDATE jobs SET state = ?, payload = ?, updated_at = ? WHERE id = ? AND state = ?",
+                    (RUNNING, json.dumps(job['payload']), job['updated_at'], job['id'], QUEUED)
+                ).rowcount
+            # Another worker may have taken it between the two statements
+            if claimed:
+                return job
+
+    @staticmethod
+    def _column(field: str) -> str:
+        # Payload fields are addressed the MongoDB way, payload.worker
+        if field.startswith('payload.'):
+            return f"json_extract(payload, '$.{field[len('payload.'):]}')"
+        return field
+
+    def _update(self, job_id: str, fields: dict, expect: dict) -> bool:
+        conn = self._connect()
+        with conn:
+            return conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{field} = ?' for field in fields)} "
+                f"WHERE id = ?{''.join(f' AND {self._column(field)} = ?' for field in expect)}",
+                (*fields.values(), job_id, *expect.values())
+            ).rowcount == 1
+
+    def _get_jobs(self, job_ids: List[str]) -> List[dict]:
+        conn = self._connect()
+        rows = conn.execute(
+            f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id IN ({', '.join('?' * len(job_ids))})", job_ids
+        ).fetchall()
+        jobs = []
+        for row in rows:
+            job = dict(zip(JOB_FIELDS, row))
+            job['payload'] = json.loads(job['payload'])
+            jobs.append(job)
+        return jobs
+
+    def _locked(self, method, *args):
+        with self._lock:
+            return method(*args)
+
+    async def _run(self, method, *args):
+        return await asyncio.to_thread(self._locked, method, *args)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def load(self):
+        return await self._run(self._load)
+
+    async def apply(self, queues: Dict[int, List[dict]], jobs: List[dict]):
+        await self._run(self._apply, queues, jobs)
+
+    async def claim(self, kind: str, worker: str) -> Optional[dict]:
+        return await self._run(self._claim, kind, worker)
+
+    async def update(self, job_id: str, fields: dict, expect: dict) -> bool:
+        return await self._run(self._update, job_id, fields, expect)
+
+    async def get_jobs(self, job_ids: List[str]) -> List[dict]:
+        if not job_ids:
+            return []
+        return await self._run(self._get_jobs, job_ids)
+
+    async def close(self):
+        await self._run(self._close)
+
+
+class _MongoBackend:
+    """One document per user queue and per job; a flush is one transaction where the server supports it"""
+
+    def __init__(self, uri: str, database_name: str):
+        self._client = motor.motor_asyncio.AsyncIOMotorClient(uri)
+        self.db = self._client[database_name]
+        self.queues = self.db.queues
+        self.jobs = self.db.jobs
+        self._transactions = True
+
+    async def load(self):
+        await self.jobs.create_index([('state', 1), ('kind', 1)])
+        await self.jobs.delete_many({
+            'state': {'$in': list(FINISHED_STATES)},
+            'updated_at': {'$lt': time.time() - FINISHED_JOB_RETENTION}
+        })
+        queues = {doc['_id']: doc['items'] async for doc in self.queues.find({})}
+        jobs = []
+        async for doc in self.jobs.find({}):
+            doc['id'] = doc.pop('_id')
+            jobs.append(doc)
+        return queues, jobs
+
+    async def apply(self, queues: Dict[int, List[dict]], jobs: List[dict]):
+        queue_ops = [
+            ReplaceOne({'_id': user_id}, {'_id': user_id, 'items': items}, upsert=True) if items
+            else DeleteOne({'_id': user_id})
+            for user_id, items in queues.items()
+        ]
+        job_ops = [
+            ReplaceOne({'_id': job['id']}, {'_id': job['id'], **{k: job[k] for k in JOB_FIELDS if k != 'id'}},
+                       upsert=True)
+            for job in jobs
+        ]
+
+        async def _write(session=None):
+            if queue_ops:
+                await self.queues.bulk_write(queue_ops, ordered=True, session=session)
+            if job_ops:
+                await self.jobs.bulk_write(job_ops, ordered=True, session=session)
+
+        if self._transactions:
+            try:
+                async with await self._client.start_session() as session:
+                    async with session.start_transaction():
+                        await _write(session)
+                return
+            except OperationFailure as e:
+                # Standalone servers have no transactions, fall back to ordered bulk writes
+                if e.code not in (20, 263):
+                    raise
+                logger.info("MongoDB transactions unavailable, job store uses plain bulk writes")
+                self._transactions = False
+        await _write()
+
+    async def claim(self, kind: str, worker: str) -> Optional[dict]:
+        doc = await self.jobs.find_one_and_update(
+            {'kind': kind, 'state': QUEUED},
+            {'$set': {'state': RUNNING, 'payload.worker': worker, 'payload.lease': uuid.uuid4().hex,
+                      'updated_at': time.time()}},
+            sort=[('created_at', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if doc:
+            doc['id'] = doc.pop('_id')
+        return doc
+
+    async def update(self, job_id: str, fields: dict, expect: dict) -> bool:
+        result = await self.jobs.update_one({'_id': job_id, **expect}, {'$set': fields})
+        return result.modified_count == 1
+
+    async def get_jobs(self, job_ids: List[str]) -> List[dict]:
+        jobs = []
+        async for doc in self.jobs.find({'_id': {'$in': job_ids}}):
+            doc['id'] = doc.pop('_id')
+            jobs.append(doc)
+        return jobs
+
+    async def close(self):
+        self._client.close()
+
+
+class JobStore:
+    """
+    Queues live on the users' sessions and jobs in memory, for instant reads. Changes are recorded as
+    dirty users and jobs, and a background task writes them behind in one
+    transaction every JOB_STORE_FLUSH_INTERVAL seconds (or on flush()).
+
+    With MERGE_WORKERS, merge jobs are submitted to the shared store instead
+    of run in-process. From then on only the worker writes them; the bot
+    follows their state with refresh().
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._jobs: Dict[str, dict] = {}
+        self._dirty_queues = set()
+        self._dirty_jobs = set()
+        # Jobs handed to merge workers, their rows belong to the worker now
+        self._submitted = set()
+        # In-process merges a restart interrupted after their output was complete
+        self._resumable: List[dict] = []
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def open(self) -> List[dict]:
+        """Load and reconcile against DOWN_PATH. Returns the jobs a restart interrupted"""
+        self._flush_lock = asyncio.Lock()
+        queues, jobs = await self.backend.load()
+        # Least recently added to first, so the sessions start out in LRU order
+        def _last_added(queue):
+            return max((item['added_at'] for item in queue[1]), default=0)
+        for user_id, items in sorted(queues.items(), key=_last_added):
+            sessions.restore(int(user_id), [QueueEntry(**item) for item in items])
+        self._jobs = {job['id']: job for job in jobs}
+        self._submitted = {job['id'] for job in jobs
+                           if job['payload'].get('submitted') and job['state'] not in FINISHED_STATES}
+        interrupted = self._reconcile()
+        await self.flush()
+        self._flusher = asyncio.create_task(self._flush_loop())
+        return interrupted
+
+    async def close(self):
+        if self._flusher:
+            self._flusher.cancel()
+        await self.flush()
+        await self.backend.close()
+
+    # --- Queues ---
+
+    @staticmethod
+    def _entries(user_id: int) -> List[QueueEntry]:
+        # Reads never count as activity, only adds do
+        session = sessions.peek(user_id)
+        return session.queue if session else []
+
+    def queue(self, user_id: int) -> List[str]:
+        return [entry.file_path for entry in self._entries(user_id)]
+
+    def reply_ids(self, user_id: int) -> List[int]:
+        return [entry.reply_id for entry in self._entries(user_id)]
+
+    def add_to_queue(self, user_id: int, file_path: str, reply_id: int = None):
+        sessions.get(user_id).queue.append(QueueEntry(file_path, reply_id))
+        self._dirty_queues.add(user_id)
+
+    def remove_from_queue(self, user_id: int, file_path: str):
+        session = sessions.peek(user_id)
+        if session:
+            session.queue = [entry for entry in session.queue if entry.file_path != file_path]
+        self._dirty_queues.add(user_id)
+
+    def queue_items(self, user_id: int) -> List[dict]:
+        return [entry.as_dict() for entry in self._entries(user_id)]
+
+    def queued_users(self) -> List[int]:
+        return [session.user_id for session in sessions.queued()]
+
+    def last_added(self, user_id: int) -> float:
+        """When the user last added to their queue, 0 if it is empty"""
+        return max((entry.added_at for entry in self._entries(user_id)), default=0)
+
+    def queue_probes(self, user_id: int) -> Dict[str, dict]:
+        """Cached probe details of the queued files that have been probed"""
+        return {entry.file_path: entry.probe for entry in self._entries(user_id) if entry.probe}
+
+    def store_probes(self, user_id: int, probes: Dict[str, dict]):
+        for entry in self._entries(user_id):
+            if entry.file_path in probes:
+                entry.probe = probes[entry.file_path]
+
+    def clear_queue(self, user_id: int) -> List[str]:
+        """Empty a user's queue, returning the files it referenced"""
+        files = self.queue(user_id)
+        session = sessions.peek(user_id)
+        if session:
+            session.queue = []
+        self._dirty_queues.add(user_id)
+        return files
+
+    # --- Jobs ---
+
+    def create_job(self, user_id: int, kind: str, **payload) -> dict:
+        now = time.time()
+        job = dict(id=uuid.uuid4().hex, user_id=user_id, kind=kind, state=PENDING,
+                   payload=payload, error=None, created_at=now, updated_at=now)
+        self._jobs[job['id']] = job
+        self._dirty_jobs.add(job['id'])
+        return job
+
+    def update_job(self, job_id: str, state: str = None, error: str = None, **payload):
+        job = self._jobs[job_id]
+        if state:
+            job['state'] = state
+        if error is not None:
+            job['error'] = error
+        job['payload'].update(payload)
+        job['updated_at'] = time.time()
+        self._dirty_jobs.add(job_id)
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        return self._jobs.get(job_id)
+
+    def user_jobs(self, user_id: int, states=(PENDING, QUEUED, RUNNING)) -> List[dict]:
+        return [job for job in self._jobs.values() if job['user_id'] == user_id and job['state'] in states]
+
+    # --- Shared queue for merge workers ---
+
+    async def submit(self, job_id: str):
+        """Hand a pending job over to the merge workers"""
+        self.update_job(job_id, state=QUEUED, submitted=True)
+        await self.flush()
+        self._submitted.add(job_id)
+
+    def resumable_jobs(self) -> List[dict]:
+        """Merges to upload again after a restart, in place of running them from scratch"""
+        jobs, self._resumable = self._resumable, []
+        return jobs
+
+    def is_submitted(self, job_id: str) -> bool:
+        return job_id in self._submitted
+
+    def submitted_jobs(self) -> List[dict]:
+        """Jobs handed to the merge workers that have not finished yet"""
+        return [self._jobs[job_id] for job_id in self._submitted]
+
+    async def refresh(self) -> List[dict]:
+        """Follow submitted jobs. Returns the ones that finished since the last call"""
+        finished = []
+        for remote in await self.backend.get_jobs(list(self._submitted)):
+            job = self._jobs.get(remote['id'])
+            if job is None:
+                continue
+            job.update(remote)
+            if job['state'] in FINISHED_STATES:
+                self._submitted.discard(job['id'])
+                finished.append(job)
+            elif job['state'] == RUNNING and time.time() - job['updated_at'] > Config.WORKER_LEASE_TIMEOUT:
+                # The worker stopped sending heartbeats, let another one take the job
+                requeued = await self.backend.update(
+                    job['id'], {'state': QUEUED, 'updated_at': time.time()},
+                    {'state': RUNNING, 'updated_at': job['updated_at']}
+                )
+                if requeued:
+                    logger.warning(f"Worker {job['payload'].get('worker')} lost job {job['id']}, requeued")
+        return finished
+
+    async def claim(self, kind: str, worker: str) -> Optional[dict]:
+        """Worker side: take the oldest queued job of a kind. payload['lease'] identifies this claim"""
+        return await self.backend.claim(kind, worker)
+
+    async def heartbeat(self, job: dict) -> bool:
+        """Worker side: keep the lease on a claimed job. False if it was requeued or claimed again since"""
+        return await self.backend.update(job['id'], {'updated_at': time.time()},
+                                         {'state': RUNNING, 'payload.lease': job['payload']['lease']})
+
+    async def complete(self, job: dict, state: str, error: str = None) -> bool:
+        """Worker side: record the outcome of a claimed job. False if the lease was lost, nothing is written then"""
+        return await self.backend.update(job['id'], {'state': state, 'error': error, 'updated_at': time.time()},
+                                         {'state': RUNNING, 'payload.lease': job['payload']['lease']})
+
+    # --- Persistence ---
+
+    async def flush(self):
+        """Write every pending change in one transaction"""
+        async with self._flush_lock:
+            if not self._dirty_queues and not self._dirty_jobs:
+                return
+            dirty_queues, self._dirty_queues = self._dirty_queues, set()
+            dirty_jobs, self._dirty_jobs = self._dirty_jobs, set()
+            queues = {user_id: self.queue_items(user_id) for user_id in dirty_queues}
+            # A submitted job's row belongs to the worker, writing it again would undo its claim
+            jobs = [dict(self._jobs[job_id], payload=dict(self._jobs[job_id]['payload']))
+                    for job_id in dirty_jobs if job_id in self._jobs and job_id not in self._submitted]
+            try:
+                await self.backend.apply(queues, jobs)
+            except Exception:
+                # Keep the changes for the next attempt
+                self._dirty_queues |= dirty_queues
+                self._dirty_jobs |= dirty_jobs
+                raise
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(Config.JOB_STORE_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Job store flush failed: {e}")
+
+    def _reconcile(self) -> List[dict]:
+        """Match the store with what survived on disk"""
+        interrupted = []
+        self._resumable = []
+        for job in self._jobs.values():
+            # A worker may still be running a submitted job, refresh() requeues it if not
+            if job['state'] not in (PENDING, RUNNING) or job['id'] in self._submitted:
+                continue
+            output = job['payload'].get('output')
+            if job['state'] == RUNNING and output and os.path.isfile(output):
+                # Only the upload is left, its work directory holds the output and the saved part state
+                self._resumable.append(job)
+                continue
+            job.update(state=FAILED, error="Interrupted by a restart", updated_at=time.time())
+            self._dirty_jobs.add(job['id'])
+            interrupted.append(job)
+
+        busy_users = {str(job['user_id']) for job in self._jobs.values() if job['id'] in self._submitted}
+        referenced = {os.path.abspath(os.path.dirname(job['payload']['output'])) for job in self._resumable}
+        for session in sessions.queued():
+            kept = [entry for entry in session.queue if os.path.isfile(entry.file_path)]
+            if len(kept) != len(session.queue):
+                logger.info(f"Dropped {len(session.queue) - len(kept)} missing files from the queue of {session.user_id}")
+                session.queue = kept
+                self._dirty_queues.add(session.user_id)
+            referenced.update(os.path.abspath(entry.file_path) for entry in kept)
+
+        # Anything else in a user directory belonged to a queue or job that no longer exists
+        removed = 0
+        for volume in volumes():
+            if not os.path.isdir(volume):
+                continue
+            for user_dir in os.listdir(volume):
+                user_path = os.path.join(volume, user_dir)
+                if not user_dir.isdigit() or not os.path.isdir(user_path) or user_dir in busy_users:
+                    continue
+                for entry in os.listdir(user_path):
+                    entry_path = os.path.join(user_path, entry)
+                    if os.path.abspath(entry_path) in referenced:
+                        continue
+                    if os.path.isdir(entry_path):
+                        shutil.rmtree(entry_path, ignore_errors=True)
+                    else:
+                        os.remove(entry_path)
+                    removed += 1
+        if removed:
+            logger.info(f"Removed {removed} orphaned files from {', '.join(volumes())}")
+        return interrupted
+
+
+def _backend_from_config():
+    if Config.JOB_STORE == "mongodb":
+        return _MongoBackend(Config.MONGODB_URI, Config.SESSION_NAME)
+    return _SQLiteBackend(Config.JOB_STORE_PATH)
+
+
+# Global job store instance
+job_store = JobStore(_backend_from_config())
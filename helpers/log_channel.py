@@ -0,0 +1,124 @@
+"""
+LOG_CHANNEL event sink
+Events are buffered and posted as one digest message (or a text document when
+too long), when LOG_DIGEST_MAX_EVENTS have piled up or LOG_DIGEST_INTERVAL
+seconds have passed, instead of costing API calls on the user's path
+"""
+
+import io
+import time
+import asyncio
+import logging
+from collections import deque, Counter
+from typing import Optional
+from configs import Config
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+
+logger = logging.getLogger(__name__)
+
+# Telegram's limit for one text message
+MAX_MESSAGE_LENGTH = 4096
+# Events kept while the channel can't be reached, oldest are dropped first
+MAX_BUFFERED_EVENTS = 5000
+
+
+class LogChannelSink:
+    def __init__(self, chat_id, max_events: int, interval: float):
+        self.chat_id = int(chat_id) if chat_id and str(chat_id).lstrip("-").isdigit() else chat_id
+        self.max_events = max_events
+        self.interval = interval
+        self.bot: Optional[Client] = None
+        self.username: Optional[str] = None
+        self.dropped = 0
+        self._events = deque()
+        # No digest is sent before this, after Telegram asked to wait
+        self._retry_at = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.chat_id)
+
+    async def start(self, bot: Client):
+        """Bind to a started client, remember its identity and begin flushing"""
+        self.bot = bot
+        if not self.enabled:
+            return
+        try:
+            self.username = (await bot.get_me()).username
+        except Exception as e:
+            logger.warning(f"Could not fetch bot identity for the log channel: {e}")
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        if self._events:
+            logger.warning(f"{len(self._events)} log channel events were never sent")
+
+    def event(self, kind: str, text: str):
+        """Record one event. Never waits on Telegram"""
+        if not self.enabled:
+            return
+        if len(self._events) >= MAX_BUFFERED_EVENTS:
+            self._events.popleft()
+            self.dropped += 1
+        self._events.append((time.time(), kind, text))
+        if len(self._events) >= self.max_events and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Log channel flush failed: {e}")
+
+    def _requeue(self, events: list):
+        """Put unsent events back in front of the ones recorded since, oldest dropped past MAX_BUFFERED_EVENTS"""
+        self._events.extendleft(reversed(events))
+        while len(self._events) > MAX_BUFFERED_EVENTS:
+            self._events.popleft()
+            self.dropped += 1
+
+    async def flush(self):
+        if not self._events or self.bot is None or time.time() < self._retry_at:
+            return
+        events = list(self._events)
+        self._events.clear()
+
+        counts = Counter(kind for _, kind, _ in events)
+        header = f"#DIGEST {' '.join(f'#{kind} ×{count}' for kind, count in counts.items())}"
+        if self.username:
+            header += f" | @{self.username}"
+        lines = [f"`{time.strftime('%H:%M:%S', time.gmtime(at))}` #{kind} {text}" for at, kind, text in events]
+        text = header + "\n\n" + "\n".join(lines)
+
+        try:
+            if len(text) <= MAX_MESSAGE_LENGTH:
+                await self.bot.send_message(self.chat_id, text, disable_web_page_preview=True)
+            else:
+                document = io.BytesIO("\n".join(lines).encode())
+                document.name = f"digest_{int(time.time())}.txt"
+                await self.bot.send_document(self.chat_id, document, caption=header)
+        except FloodWait as e:
+            # Sent with whatever arrives meanwhile once the wait is over
+            self._requeue(events)
+            self._retry_at = time.time() + e.value
+            logger.warning(f"Log channel digest of {len(events)} events postponed by FloodWait of {e.value}s")
+        except Exception:
+            self._requeue(events)
+            raise
+
+
+log_sink = LogChannelSink(Config.LOG_CHANNEL, Config.LOG_DIGEST_MAX_EVENTS, Config.LOG_DIGEST_INTERVAL)
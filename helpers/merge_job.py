@@ -0,0 +1,60 @@
+"""
+Merge pipeline shared by the bot and the merge workers
+Merges a user's queued files and uploads the result to their destinations
+"""
+
+import os
+from typing import Awaitable, Callable, Dict, List
+from configs import Config
+from helpers.display_progress import edit_status
+from helpers.executor import executor
+from helpers.storage import storage_manager, merge_estimate, StorageFull
+from helpers.tiers import bulk, scratch, merge_dir
+from helpers.merger import VideoMerger, get_video_duration, get_video_resolution
+from helpers.uploader import UploadVideo
+from pyrogram import Client
+from pyrogram.types import Message, User
+
+
+async def run_merge(bot: Client, user: User, merge_message: Message, files: List[str], job_id: str,
+                    probes: Dict[str, dict] = None, output: str = None,
+                    on_merged: Callable[[str], Awaitable] = None) -> bool:
+    """
+    Merge and upload. Returns False if the merge itself failed. probes is filled in with what was probed.
+    The work directory is one of merge_dirs(user.id, job_id), on scratch when the output fits there.
+    on_merged is awaited with the output path once it is complete; passing that path back as output
+    skips the merge, so an upload a restart interrupted resumes from its saved part state.
+    """
+    async with executor.slot('merge', merge_message):
+        if output and os.path.isfile(output):
+            merger = VideoMerger(user.id, os.path.dirname(output), probes)
+            merged_video = output
+        else:
+            try:
+                # The output is a derived copy, so it's not held against the user's quota
+                reservation = await storage_manager.reserve(user.id, merge_estimate(files), count_quota=False,
+                                                            tiers=(scratch, bulk))
+            except StorageFull as e:
+                await edit_status(merge_message, f"❌ **Merge postponed:** {e}")
+                return False
+            with reservation:
+                merger = VideoMerger(user.id, merge_dir(user.id, job_id, reservation.volume), probes)
+                merged_video = await merger.merge_videos(files, merge_message)
+
+            if not merged_video:
+                await edit_status(merge_message, Config.ERROR_MESSAGES['merge_failed'])
+                return False
+            if on_merged is not None:
+                await on_merged(merged_video)
+
+        await edit_status(merge_message, "✅ **Merge completed! Preparing for upload...**")
+
+        duration = await get_video_duration(merged_video)
+        width, height = await get_video_resolution(merged_video)
+        file_size = os.path.getsize(merged_video)
+        thumbnails = await merger.generate_thumbnails(merged_video, count=1)
+        thumbnail_path = thumbnails[0] if thumbnails else None
+
+    async with executor.slot('upload', merge_message):
+        await UploadVideo(bot, user, merge_message, merged_video, width, height, duration, thumbnail_path, file_size)
+    return True
@@ -9,16 +9,18 @@ import time
 import json
 from typing import List, Optional, Dict, Any, Tuple
 from configs import Config
-from helpers.display_progress import humanbytes, TimeFormatter
+from helpers.display_progress import humanbytes, TimeFormatter, edit_status
 from pyrogram.types import Message
 import logging
 
 logger = logging.getLogger(__name__)
 
 class VideoMerger:
-    def __init__(self, user_id: int):
+    def __init__(self, user_id: int, work_dir: str = None, probes: Dict[str, Dict[str, Any]] = None):
         self.user_id = user_id
-        self.work_dir = f"{Config.DOWN_PATH}/{user_id}"
+        self.work_dir = work_dir or f"{Config.DOWN_PATH}/{user_id}"
+        # FFprobe details by path, filled in as files are probed
+        self.probes = probes if probes is not None else {}
         self.input_file = f"{self.work_dir}/input.txt"
         self.temp_dir = f"{self.work_dir}/temp"
 
@@ -33,7 +35,7 @@ class VideoMerger:
         """
         try:
             if len(video_list) < 2:
-                await message.edit("❌ At least 2 videos required for merging!")
+                await edit_status(message, "❌ At least 2 videos required for merging!")
                 return None
 
             logger.info(f"Starting merge for user {self.user_id} with {len(video_list)} videos")
@@ -68,14 +70,14 @@ class VideoMerger:
 
         except Exception as e:
             logger.error(f"Merge error for user {self.user_id}: {e}")
-            await message.edit(f"❌ **Merge failed:** `{str(e)}`")
+            await edit_status(message, f"❌ **Merge failed:** `{str(e)}`")
             return None
 
     async def _validate_videos(self, video_list: List[str], message: Message) -> List[str]:
         """Validate that all video files exist and are accessible"""
         valid_videos = []
 
-        await message.edit("🔍 **Validating video files...**")
+        await edit_status(message, "🔍 **Validating video files...**")
 
         for i, video_path in enumerate(video_list):
             if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
@@ -85,11 +87,11 @@ class VideoMerger:
                 logger.warning(f"Invalid video file: {video_path}")
 
         if len(valid_videos) < 2:
-            await message.edit(f"❌ Only {len(valid_videos)} valid videos found. Need at least 2!")
+            await edit_status(message, f"❌ Only {len(valid_videos)} valid videos found. Need at least 2!")
             return []
 
         if len(valid_videos) < len(video_list):
-            await message.edit(f"⚠️ Using {len(valid_videos)}/{len(video_list)} valid videos for merge...")
+            await edit_status(message, f"⚠️ Using {len(valid_videos)}/{len(video_list)} valid videos for merge...")
             await asyncio.sleep(2)
 
         return valid_videos
@@ -97,7 +99,7 @@ class VideoMerger:
     async def _analyze_videos(self, video_list: List[str], message: Message) -> Optional[Dict[str, Any]]:
         """Analyze video properties for optimal merge settings"""
         try:
-            await message.edit("🔍 **Analyzing video properties...**")
+            await edit_status(message, "🔍 **Analyzing video properties...**")
 
             video_info = {
                 'codecs': set(),
@@ -139,11 +141,13 @@ class VideoMerger:
 
         except Exception as e:
             logger.error(f"Video analysis error: {e}")
-            await message.edit("⚠️ **Video analysis failed, proceeding with basic merge...**")
+            await edit_status(message, "⚠️ **Video analysis failed, proceeding with basic merge...**")
             return {'formats': {'.mp4'}, 'total_size': sum(os.path.getsize(v) for v in video_list)}
 
     async def _get_video_details(self, video_path: str) -> Optional[Dict[str, Any]]:
-        """Get detailed video information using FFprobe"""
+        """Get detailed video information using FFprobe, once per file"""
+        if video_path in self.probes:
+            return self.probes[video_path]
         try:
             cmd = [
                 'ffprobe',
@@ -175,13 +179,14 @@ class VideoMerger:
                 if video_stream:
                     duration = float(data.get('format', {}).get('duration', 0))
 
-                    return {
+                    self.probes[video_path] = {
                         'duration': duration,
                         'codec': video_stream.get('codec_name', 'unknown'),
                         'resolution': f"{video_stream.get('width', 0)}x{video_stream.get('height', 0)}",
                         'fps': eval(video_stream.get('r_frame_rate', '0/1')) if '/' in str(video_stream.get('r_frame_rate', '0')) else 0,
                         'bitrate': int(video_stream.get('bit_rate', 0))
                     }
+                    return self.probes[video_path]
         except Exception as e:
             logger.debug(f"FFprobe failed for {video_path}: {e}")
 
@@ -265,7 +270,7 @@ class VideoMerger:
             )
 
             # Monitor progress
-            await message.edit("🔄 **Merging videos with FFmpeg...**\n\nThis may take several minutes...")
+            await edit_status(message, "🔄 **Merging videos with FFmpeg...**\n\nThis may take several minutes...")
 
             # Wait for completion with timeout
             try:
@@ -275,8 +280,12 @@ class VideoMerger:
                 )
             except asyncio.TimeoutError:
                 process.kill()
-                await message.edit("❌ **Merge timeout!** Process took longer than 1 hour.")
+                await edit_status(message, "❌ **Merge timeout!** Process took longer than 1 hour.")
                 return False
+            except asyncio.CancelledError:
+                # Don't leave FFmpeg writing into a work directory that is no longer ours
+                process.kill()
+                raise
 
             # Check result
             if process.returncode == 0:
@@ -285,12 +294,12 @@ class VideoMerger:
             else:
                 error_msg = stderr.decode().strip()
                 logger.error(f"FFmpeg merge failed: {error_msg}")
-                await message.edit(f"❌ **FFmpeg Error:**\n```\n{error_msg[-500:]}\n```")
+                await edit_status(message, f"❌ **FFmpeg Error:**\n```\n{error_msg[-500:]}\n```")
                 return False
 
         except Exception as e:
             logger.error(f"Merge execution error: {e}")
-            await message.edit(f"❌ **Merge execution failed:** `{str(e)}`")
+            await edit_status(message, f"❌ **Merge execution failed:** `{str(e)}`")
             return False
 
     async def create_sample_video(self, video_path: str, duration: int = 30) -> Optional[str]:
@@ -357,7 +366,9 @@ class VideoMerger:
             # Generate thumbnails at different time points
             for i in range(count):
                 time_point = (duration / (count + 1)) * (i + 1)
-                thumbnail_path = f"{self.work_dir}/thumb_{i+1}_{int(time.time())}.jpg"
+                # Named after the source so thumbnails of several videos can be made at once
+                video_stem = os.path.splitext(os.path.basename(video_path))[0]
+                thumbnail_path = f"{self.work_dir}/thumb_{video_stem}_{i+1}_{int(time.time())}.jpg"
 
                 thumb_cmd = [
                     'ffmpeg',
@@ -484,6 +495,72 @@ async def get_video_resolution(video_path: str) -> Tuple[int, int]:
 
     return 1280, 720  # Default resolution
 
+async def split_video(video_path: str, max_part_size: int, output_dir: str = None) -> List[str]:
+    """
+    Split a video with stream copy into parts smaller than max_part_size
+    Cuts land on keyframes, so every part plays on its own
+    Returns: Ordered part paths, or an empty list if splitting failed
+    """
+    try:
+        file_size = os.path.getsize(video_path)
+        duration = await get_video_duration(video_path)
+        if duration <= 0:
+            logger.error(f"Cannot split {video_path}: unknown duration")
+            return []
+
+        output_dir = output_dir or os.path.join(os.path.dirname(video_path), "parts")
+        os.makedirs(output_dir, exist_ok=True)
+        base, ext = os.path.splitext(os.path.basename(video_path))
+
+        # Aim below the limit, segments only end on the first keyframe after segment_time
+        segment_time = duration * (max_part_size * 0.9) / file_size
+
+        for attempt in range(Config.MAX_RETRY_ATTEMPTS):
+            for name in os.listdir(output_dir):
+                os.remove(os.path.join(output_dir, name))
+
+            cmd = [
+                'ffmpeg',
+                '-i', video_path,
+                '-map', '0',
+                '-c', 'copy',
+                '-f', 'segment',
+                '-segment_time', f"{segment_time:.3f}",
+                '-reset_timestamps', '1',
+                '-y',
+                os.path.join(output_dir, f"part%03d{ext}")
+            ]
+
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await process.communicate()
+
+            if process.returncode != 0:
+                logger.error(f"FFmpeg split failed: {stderr.decode().strip()[-500:]}")
+                return []
+
+            parts = sorted(os.path.join(output_dir, name) for name in os.listdir(output_dir))
+            if parts and all(os.path.getsize(part) <= max_part_size for part in parts):
+                named_parts = []
+                for i, part in enumerate(parts, start=1):
+                    named_part = os.path.join(output_dir, f"{base}.part{i:02d}{ext}")
+                    os.rename(part, named_part)
+                    named_parts.append(named_part)
+                logger.info(f"Split {video_path} into {len(named_parts)} parts")
+                return named_parts
+
+            # Sparse keyframes or a bitrate spike pushed a part over the limit
+            segment_time *= 0.75
+            logger.warning(f"Split attempt {attempt + 1} produced an oversize part, retrying with {segment_time:.1f}s segments")
+
+    except Exception as e:
+        logger.error(f"Split error for {video_path}: {e}")
+
+    return []
+
 def validate_merge_compatibility(video_list: List[str]) -> Dict[str, Any]:
     """Validate if videos can be merged together"""
     compatibility = {
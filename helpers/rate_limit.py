@@ -0,0 +1,63 @@
+"""
+Per-user rate limiter
+Every action costs tokens from the user's bucket, so cheap commands barely
+count while merges and downloads draw the bucket down faster
+"""
+
+import math
+import logging
+from typing import Dict, Tuple
+from configs import Config
+from helpers.bandwidth import TokenBucket
+from helpers.sessions import sessions
+
+logger = logging.getLogger(__name__)
+
+# Tokens per action; the bucket refills at RATE_LIMIT_RATE tokens per second
+COSTS = {
+    'command': 1,
+    'download': 2,
+    'merge': Config.TIME_GAP,
+}
+
+
+class RateLimiter:
+    """
+    Token bucket per user, kept on their session. A bucket that has been idle
+    long enough to refill completely holds no information, so the session
+    registry drops sessions that hold nothing else after that long.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.allowed = 0
+        self.limited = 0
+
+    def check(self, user_id: int, action: str = 'command') -> Tuple[bool, float]:
+        """Charge an action. Returns (allowed, seconds until it would be allowed)"""
+        session = sessions.admit(user_id)
+        if session is None:
+            # Every session holds a queue; a sweep frees one once an idle queue expires
+            self.limited += 1
+            return False, Config.SESSION_SWEEP_INTERVAL
+        if session.bucket is None:
+            session.bucket = TokenBucket(self.rate, self.burst)
+
+        wait = session.bucket.try_consume(min(COSTS.get(action, 1), self.burst))
+        if wait:
+            self.limited += 1
+            return False, wait
+        self.allowed += 1
+        return True, 0.0
+
+    def stats(self) -> Dict[str, int]:
+        return {'allowed': self.allowed, 'limited': self.limited}
+
+
+rate_limiter = RateLimiter(Config.RATE_LIMIT_RATE, Config.RATE_LIMIT_BURST)
+
+
+def retry_seconds(wait: float) -> int:
+    """Whole seconds to show the user, never rounding a wait down to zero"""
+    return max(1, math.ceil(wait))
@@ -0,0 +1,167 @@
+"""
+Per-user sessions
+One small object per active user holds their queue entries with cached probe
+metadata, the status message of their last download or merge and their rate
+limit bucket. Idle sessions are dropped, and a queue left alone for
+SESSION_IDLE_TIMEOUT is cleared together with its files
+"""
+
+import sys
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+from configs import Config
+
+logger = logging.getLogger(__name__)
+
+
+class QueueEntry:
+    """One queued file. probe caches its ffprobe details and is never persisted"""
+
+    __slots__ = ('file_path', 'reply_id', 'added_at', 'probe')
+
+    def __init__(self, file_path: str, reply_id: int = None, added_at: float = None, probe: dict = None):
+        self.file_path = file_path
+        self.reply_id = reply_id
+        self.added_at = added_at if added_at is not None else time.time()
+        self.probe = probe
+
+    def as_dict(self) -> dict:
+        return {'file_path': self.file_path, 'reply_id': self.reply_id, 'added_at': self.added_at}
+
+
+class UserSession:
+    __slots__ = ('user_id', 'queue', 'status_id', 'bucket', 'last_seen')
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.queue: List[QueueEntry] = []
+        self.status_id: Optional[int] = None
+        # TokenBucket, created by the rate limiter on the first charged action
+        self.bucket = None
+        self.last_seen = time.monotonic()
+
+    def footprint(self) -> int:
+        """Approximate bytes held by the session and everything it owns"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.queue)
+        for entry in self.queue:
+            size += sys.getsizeof(entry) + sys.getsizeof(entry.file_path)
+            if entry.probe:
+                size += sys.getsizeof(entry.probe) + sum(sys.getsizeof(value) for value in entry.probe.values())
+        if self.bucket is not None:
+            size += sys.getsizeof(self.bucket)
+        return size
+
+
+class SessionRegistry:
+    """
+    Sessions in LRU order. An empty session only carries a rate limit bucket and
+    a status message id, so it is dropped once the bucket would have refilled;
+    a session with a queue lives until idle_timeout, when on_expire clears it.
+    max_sessions is a hard cap on new users: admit() drops the coldest empty
+    session to make room and refuses once every session has a queue.
+    """
+
+    def __init__(self, idle_timeout: float, empty_timeout: float, max_sessions: int):
+        self.idle_timeout = idle_timeout
+        self.empty_timeout = empty_timeout
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[int, UserSession]" = OrderedDict()
+        self.dropped = 0
+        self.expired = 0
+        self.refused = 0
+        # Awaited with the user id of an idle queue; returns False to keep it for now
+        self.on_expire: Optional[Callable[[int], Awaitable[bool]]] = None
+
+    def admit(self, user_id: int) -> Optional[UserSession]:
+        """The user's session for a new request, None if the registry is full of queues"""
+        if user_id not in self._sessions and len(self._sessions) >= self.max_sessions \
+                and not self._drop_coldest_empty():
+            self.refused += 1
+            return None
+        return self.get(user_id)
+
+    def get(self, user_id: int) -> UserSession:
+        """
+        The user's session, created if needed and marked as just used. Only for users
+        admit() let in, whose session may have been swept while their download ran;
+        those few can take the registry past max_sessions until the next sweep.
+        """
+        session = self._sessions.get(user_id)
+        if session is None:
+            if len(self._sessions) >= self.max_sessions:
+                self._drop_coldest_empty()
+            session = self._sessions[user_id] = UserSession(user_id)
+        else:
+            self._sessions.move_to_end(user_id)
+            session.last_seen = time.monotonic()
+        return session
+
+    def peek(self, user_id: int) -> Optional[UserSession]:
+        """The user's session without creating it or marking it used"""
+        return self._sessions.get(user_id)
+
+    def restore(self, user_id: int, entries: List[QueueEntry]):
+        """Load a persisted queue, aging the session by how long ago it was last added to"""
+        session = self.get(user_id)
+        session.queue = entries
+        idle = time.time() - max((entry.added_at for entry in entries), default=time.time())
+        session.last_seen = time.monotonic() - max(idle, 0)
+
+    def queued(self) -> List[UserSession]:
+        return [session for session in self._sessions.values() if session.queue]
+
+    def _drop_coldest_empty(self) -> bool:
+        for user_id, session in self._sessions.items():
+            if not session.queue:
+                del self._sessions[user_id]
+                self.dropped += 1
+                return True
+        return False
+
+    async def sweep(self):
+        """Drop empty idle sessions and expire idle queues"""
+        now = time.monotonic()
+        for user_id, session in list(self._sessions.items()):
+            idle = now - session.last_seen
+            if idle < self.empty_timeout:
+                # Everything after this one was used more recently
+                break
+            if not session.queue:
+                del self._sessions[user_id]
+                self.dropped += 1
+                continue
+            if not self.idle_timeout or idle < self.idle_timeout or self.on_expire is None:
+                continue
+            try:
+                if not await self.on_expire(user_id):
+                    continue
+            except Exception as e:
+                logger.warning(f"Could not expire the session of {user_id}: {e}")
+                continue
+            self.expired += 1
+            # The user may have come back while their queue was being cleared
+            if self._sessions.get(user_id) is session and not session.queue \
+                    and time.monotonic() - session.last_seen >= self.idle_timeout:
+                del self._sessions[user_id]
+
+    async def start_sweeper(self):
+        while True:
+            await asyncio.sleep(Config.SESSION_SWEEP_INTERVAL)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Session sweep failed: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        total = sum(session.footprint() for session in self._sessions.values())
+        count = len(self._sessions)
+        return {'sessions': count, 'queued': len(self.queued()), 'bytes': total,
+                'bytes_per_session': total // count if count else 0,
+                'dropped': self.dropped, 'expired': self.expired, 'refused': self.refused}
+
+
+sessions = SessionRegistry(Config.SESSION_IDLE_TIMEOUT, Config.RATE_LIMIT_BURST / Config.RATE_LIMIT_RATE,
+                           Config.SESSION_MAX)
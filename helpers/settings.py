@@ -2,19 +2,28 @@
 
 import asyncio
 from helpers.database.access_db import db
+from helpers.destinations import available_backends, get_user_destinations
 from pyrogram.errors import MessageNotModified, FloodWait
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 
 
 async def OpenSettings(m: Message, user_id: int):
     try:
+        settings = await db.get_settings(user_id)
+        chosen = [backend.name for backend in await get_user_destinations(user_id)]
+        destination_buttons = [
+            [InlineKeyboardButton(f"Upload to {backend.label} {'✅' if backend.name in chosen else '❌'}",
+                                  callback_data=f"triggerDest_{backend.name}")]
+            for backend in available_backends()
+        ]
         await m.edit(
             text="Here You Can Change or Configure Your Settings:",
             reply_markup=InlineKeyboardMarkup(
                 [
-                    [InlineKeyboardButton(f"Upload as {'Video' if (await db.get_upload_as_doc(id=user_id)) is False else 'Document'} ✅", callback_data="triggerUploadMode")],
-                    [InlineKeyboardButton(f"Generate Sample Video {'✅' if (await db.get_generate_sample_video(id=user_id)) is True else '❌'}", callback_data="triggerGenSample")],
-                    [InlineKeyboardButton(f"Generate Screenshots {'✅' if (await db.get_generate_ss(id=user_id)) is True else '❌'}", callback_data="triggerGenSS")],
+                    [InlineKeyboardButton(f"Upload as {'Video' if settings['upload_as_doc'] is False else 'Document'} ✅", callback_data="triggerUploadMode")],
+                    [InlineKeyboardButton(f"Generate Sample Video {'✅' if settings['generate_sample_video'] is True else '❌'}", callback_data="triggerGenSample")],
+                    [InlineKeyboardButton(f"Generate Screenshots {'✅' if settings['generate_ss'] is True else '❌'}", callback_data="triggerGenSS")],
+                    *destination_buttons,
                     [InlineKeyboardButton("Show Thumbnail", callback_data="showThumbnail")],
                     [InlineKeyboardButton("Show Queue Files", callback_data="showQueueFiles")],
                     [InlineKeyboardButton("Close", callback_data="closeMeh")]
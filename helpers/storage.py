@@ -0,0 +1,197 @@
+"""
+Disk storage manager
+Admits downloads and merges only when a volume has room for them, reserving
+their expected size on that volume up front, and frees space by evicting the
+least recently used idle queues when the bulk volumes run short
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+from configs import Config
+from helpers.clean import cleanup_manager
+from helpers.display_progress import humanbytes
+from helpers.job_store import job_store
+from helpers.user_jobs import user_jobs
+from helpers.tiers import StorageTier, bulk, free_bytes
+
+logger = logging.getLogger(__name__)
+
+
+class StorageFull(Exception):
+    """Raised when a reservation can't be admitted; the message is shown to the user"""
+
+
+class Reservation:
+    """Bytes set aside on a volume for a download or merge until the block ends"""
+
+    __slots__ = ('manager', 'user_id', 'nbytes', 'volume')
+
+    def __init__(self, manager: "StorageManager", user_id: int, nbytes: int, volume: str):
+        self.manager = manager
+        self.user_id = user_id
+        self.nbytes = nbytes
+        self.volume = volume
+
+    def release(self):
+        if self.manager is not None:
+            self.manager._release(self)
+            self.manager = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class StorageManager:
+    def __init__(self, user_quota: int, evict_idle: int):
+        self.user_quota = user_quota
+        self.evict_idle = evict_idle
+        self.reserved = 0
+        self._volume_reserved: Dict[str, int] = {}
+        self._user_reserved: Dict[int, int] = {}
+        self._user_reservations: Dict[int, int] = {}
+        self.evicted = 0
+        # Users whose directory is being removed; their new reservations wait for it
+        self._evicting: Dict[int, asyncio.Event] = {}
+        # Awaited with the user id after their queue was evicted
+        self.on_evict: Optional[Callable[[int], Awaitable]] = None
+
+    def available(self, tier: StorageTier, volume: str) -> int:
+        """Bytes still available for new work on a volume, net of its reservations and the tier's headroom"""
+        return free_bytes(volume) - self._volume_reserved.get(os.path.abspath(volume), 0) - tier.headroom
+
+    def place(self, tier: StorageTier, nbytes: int) -> Optional[str]:
+        """The volume of tier with the most room left that still fits nbytes, None if none does"""
+        best, best_free = None, -1
+        for volume in tier.paths:
+            free = self.available(tier, volume)
+            if free >= nbytes and free > best_free:
+                best, best_free = volume, free
+        return best
+
+    def free_space(self, tier: StorageTier = bulk) -> int:
+        return max((self.available(tier, volume) for volume in tier.paths), default=0)
+
+    def user_usage(self, user_id: int) -> int:
+        used = self._user_reserved.get(user_id, 0)
+        for file_path in job_store.queue(user_id):
+            try:
+                used += os.path.getsize(file_path)
+            except OSError:
+                pass
+        return used
+
+    async def reserve(self, user_id: int, nbytes: int, count_quota: bool = True,
+                      tiers: Sequence[StorageTier] = (bulk,)) -> Reservation:
+        """
+        Admit work expected to write nbytes on the first of tiers with room for it,
+        evicting idle queues if not even bulk has. Raises StorageFull.
+        The volume is chosen here, so callers must write to reservation.volume.
+        """
+        while user_id in self._evicting:
+            await self._evicting[user_id].wait()
+        if count_quota and self.user_quota and self.user_usage(user_id) + nbytes > self.user_quota:
+            raise StorageFull(
+                f"This needs {humanbytes(nbytes)}, which would exceed your {humanbytes(self.user_quota)} "
+                f"storage limit. Merge or /clear your queue first."
+            )
+        volume = None
+        for tier in tiers:
+            volume = self.place(tier, nbytes)
+            if volume:
+                break
+        if volume is None:
+            await self.evict(nbytes - self.free_space(), exclude=user_id)
+            volume = self.place(bulk, nbytes)
+            if volume is None:
+                raise StorageFull("The server is low on disk space right now, please try again later.")
+
+        reservation = Reservation(self, user_id, nbytes, volume)
+        self.reserved += nbytes
+        key = os.path.abspath(volume)
+        self._volume_reserved[key] = self._volume_reserved.get(key, 0) + nbytes
+        self._user_reserved[user_id] = self._user_reserved.get(user_id, 0) + nbytes
+        self._user_reservations[user_id] = self._user_reservations.get(user_id, 0) + 1
+        return reservation
+
+    def has_reservations(self, user_id: int) -> bool:
+        return user_id in self._user_reservations
+
+    def _release(self, reservation: Reservation):
+        user_id = reservation.user_id
+        self.reserved -= reservation.nbytes
+        key = os.path.abspath(reservation.volume)
+        left = self._volume_reserved.pop(key, 0) - reservation.nbytes
+        if left:
+            self._volume_reserved[key] = left
+        self._user_reserved[user_id] -= reservation.nbytes
+        self._user_reservations[user_id] -= 1
+        if not self._user_reservations[user_id]:
+            del self._user_reservations[user_id]
+            del self._user_reserved[user_id]
+
+    def _evictable(self, user_id: int, now: float) -> bool:
+        return not self.has_reservations(user_id) and now - job_store.last_added(user_id) >= self.evict_idle
+
+    def _eviction_candidates(self, exclude: int) -> List[int]:
+        """Queues nobody is working on, least recently added to first"""
+        now = time.time()
+        candidates = [(job_store.last_added(user_id), user_id) for user_id in job_store.queued_users()
+                      if user_id != exclude and not user_jobs.busy(user_id) and self._evictable(user_id, now)]
+        return [user_id for _, user_id in sorted(candidates)]
+
+    async def evict(self, nbytes: int, exclude: int = None) -> List[int]:
+        """Clear idle queues until nbytes are freed or none are left"""
+        evicted = []
+        freed = 0
+        for user_id in self._eviction_candidates(exclude):
+            if freed >= nbytes:
+                break
+            # Cleaning the earlier candidates awaited, so this one may have started a merge,
+            # a download or added to its queue since the list was made
+            async with user_jobs.if_idle(user_id) as idle:
+                if not idle or not job_store.queue(user_id) or not self._evictable(user_id, time.time()):
+                    continue
+                done = self._evicting[user_id] = asyncio.Event()
+                try:
+                    freed += self.user_usage(user_id)
+                    job_store.clear_queue(user_id)
+                    await cleanup_manager.clean_user_directory(user_id)
+                finally:
+                    del self._evicting[user_id]
+                    done.set()
+            evicted.append(user_id)
+        if evicted:
+            await job_store.flush()
+            self.evicted += len(evicted)
+            logger.warning(f"Evicted {len(evicted)} idle queue(s), about {humanbytes(freed)} freed")
+            if self.on_evict is not None:
+                for user_id in evicted:
+                    try:
+                        await self.on_evict(user_id)
+                    except Exception as e:
+                        logger.warning(f"Could not notify {user_id} about eviction: {e}")
+        return evicted
+
+    def stats(self) -> Dict[str, int]:
+        return {'free': self.free_space(), 'reserved': self.reserved,
+                'reservations': sum(self._user_reservations.values()), 'evicted': self.evicted}
+
+
+def merge_estimate(files: List[str]) -> int:
+    """Bytes a merge of files is expected to write"""
+    total = 0
+    for file_path in files:
+        try:
+            total += os.path.getsize(file_path)
+        except OSError:
+            pass
+    return int(total * Config.MERGE_SPACE_FACTOR)
+
+
+storage_manager = StorageManager(Config.USER_DISK_QUOTA, Config.STORAGE_EVICT_IDLE)
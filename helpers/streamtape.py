@@ -1,29 +1,41 @@
 # (c) @AbirHasan2005
 
+import os
 import aiohttp
+from typing import AsyncIterable
 from configs import Config
+from helpers.fanout import read_chunks
 
 
-async def streamtape_upload(file_path: str):
+async def streamtape_upload(file_path: str, chunks: AsyncIterable[bytes] = None, timeout: float = None):
+    """Upload to Streamtape, streaming from chunks when given. Returns the file URL or None"""
     try:
-        async with aiohttp.ClientSession() as session:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout, sock_connect=30)) as session:
             # Get upload URL
-            async with session.get(f"https://api.streamtape.com/file/ul?login={Config.STREAMTAPE_API_USERNAME}&key={Config.STREAMTAPE_API_PASS}") as resp:
-                if resp.status == 200:
-                    result = await resp.json()
-                    if result['status'] == 200:
-                        upload_url = result['result']['url']
+            async with session.get(
+                "https://api.streamtape.com/file/ul",
+                params={'login': Config.STREAMTAPE_API_USERNAME, 'key': Config.STREAMTAPE_API_PASS}
+            ) as resp:
+                if resp.status != 200:
+                    return None
+                result = await resp.json(content_type=None)
+                if result['status'] != 200:
+                    return None
+                upload_url = result['result']['url']
 
-                        # Upload file
-                        with open(file_path, 'rb') as file:
-                            data = aiohttp.FormData()
-                            data.add_field('file1', file)
+            # Upload file
+            data = aiohttp.FormData()
+            data.add_field(
+                'file1',
+                chunks if chunks is not None else read_chunks(file_path),
+                filename=os.path.basename(file_path)
+            )
 
-                            async with session.post(upload_url, data=data) as upload_resp:
-                                if upload_resp.status == 200:
-                                    upload_result = await upload_resp.json()
-                                    if upload_result['status'] == 200:
-                                        return upload_result['result']['url']
+            async with session.post(upload_url, data=data) as upload_resp:
+                if upload_resp.status == 200:
+                    upload_result = await upload_resp.json(content_type=None)
+                    if upload_result['status'] == 200:
+                        return upload_result['result']['url']
         return None
     except Exception as e:
         print(f"Streamtape upload error: {e}")
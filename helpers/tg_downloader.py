@@ -0,0 +1,120 @@
+"""
+Parallel Telegram media downloader
+Fetches different offsets of the same file concurrently. Pyrogram streams every
+range over the one media session it keeps per DC, and each range holds one of the
+client's TG_MAX_TRANSMISSIONS slots while it runs, so a file uses at most
+TG_DOWNLOAD_WORKERS of them and leaves the rest to other users' downloads
+"""
+
+import asyncio
+import math
+import os
+import time
+import logging
+from typing import Optional, List, Tuple, Callable, Awaitable
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+from pyrogram.types import Message
+from configs import Config
+from helpers.display_progress import progress_for_pyrogram
+from helpers.bandwidth import bandwidth, INGRESS
+
+logger = logging.getLogger(__name__)
+
+# Pyrogram's stream_media always yields 1 MiB chunks, offsets are counted in chunks
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def _split_ranges(total_chunks: int, workers: int) -> List[Tuple[int, int]]:
+    """Split a file into (chunk_offset, chunk_count) ranges, one per worker"""
+    per_worker = math.ceil(total_chunks / workers)
+    return [
+        (offset, min(per_worker, total_chunks - offset))
+        for offset in range(0, total_chunks, per_worker)
+    ]
+
+
+async def download_media_parallel(bot: Client, message: Message, file_path: str,
+                                  status_message: Message, workers: int = None,
+                                  progress: Callable[[int, int], Awaitable[None]] = None) -> Optional[str]:
+    """
+    Download the media of a message by fetching byte ranges concurrently
+    Small files fall back to Pyrogram's sequential download
+    Progress goes to status_message unless a progress(current, total) callback is given
+    Returns: Downloaded file path or None if failed
+    """
+    media = message.video or message.document
+    file_size = getattr(media, 'file_size', 0) or 0
+    # Never let one file take every transmission slot of the client
+    workers = min(workers or Config.TG_DOWNLOAD_WORKERS, max(1, Config.TG_MAX_TRANSMISSIONS // 2))
+    user_id = message.from_user.id if message.from_user else None
+    progress_args = ("📥 Downloading from Telegram ...", status_message, time.time())
+
+    async def _report(current: int, total: int):
+        if progress:
+            await progress(current, total)
+        else:
+            await progress_for_pyrogram(current, total, *progress_args)
+
+    if workers <= 1 or file_size < Config.TG_PARALLEL_THRESHOLD:
+        received = 0
+
+        async def _progress(current, total):
+            nonlocal received
+            await bandwidth.throttle(INGRESS, user_id, current - received)
+            received = current
+            await _report(current, total)
+
+        return await bot.download_media(message, file_name=file_path, progress=_progress)
+
+    total_chunks = math.ceil(file_size / STREAM_CHUNK_SIZE)
+    ranges = _split_ranges(total_chunks, workers)
+    downloaded = 0
+
+    # Preallocate the file so every worker can write its range in place
+    with open(file_path, 'wb') as file:
+        file.truncate(file_size)
+
+    async def _fetch_range(offset: int, count: int):
+        nonlocal downloaded
+        done = 0
+        attempts = 0
+
+        with open(file_path, 'r+b') as file:
+            while done < count:
+                try:
+                    file.seek((offset + done) * STREAM_CHUNK_SIZE)
+                    async for chunk in bot.stream_media(message, offset=offset + done, limit=count - done):
+                        file.write(chunk)
+                        done += 1
+                        downloaded += len(chunk)
+                        await bandwidth.throttle(INGRESS, user_id, len(chunk))
+                        await _report(downloaded, file_size)
+                except FloodWait as e:
+                    await asyncio.sleep(e.value)
+                except (OSError, ConnectionError, asyncio.TimeoutError) as e:
+                    # Resume the range from the first chunk that did not arrive
+                    attempts += 1
+                    if attempts > Config.MAX_RETRY_ATTEMPTS:
+                        raise
+                    logger.warning(f"Range {offset}+{count} failed at chunk {done}: {e}, retrying")
+                    await asyncio.sleep(2 ** attempts)
+                else:
+                    if done < count:
+                        raise IOError(f"Telegram stream ended early at chunk {offset + done}")
+
+    try:
+        logger.info(f"Downloading {file_path} in {len(ranges)} parallel ranges")
+        await asyncio.gather(*[_fetch_range(offset, count) for offset, count in ranges])
+    except Exception as e:
+        logger.error(f"Parallel download failed for {file_path}: {e}")
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        return None
+
+    if os.path.getsize(file_path) != file_size:
+        logger.error(f"Parallel download size mismatch for {file_path}")
+        os.remove(file_path)
+        return None
+
+    return file_path
@@ -0,0 +1,369 @@
+"""
+Telegram part uploader
+Uploads a file from a stream of chunks with Telegram's raw upload API,
+so the same disk read can feed several upload destinations
+"""
+
+import os
+import json
+import math
+import time
+import asyncio
+import hashlib
+import logging
+from typing import AsyncIterable, Callable, Awaitable, Optional, List, Dict, Any, Set
+from pyrogram import Client, raw, types, utils
+from pyrogram.errors import FloodWait, FilePartMissing
+from pyrogram.session import Session
+from configs import Config
+
+logger = logging.getLogger(__name__)
+
+# Telegram accepts upload parts of exactly 512 KiB (except the last one)
+TG_PART_SIZE = 512 * 1024
+# Files above this size must be uploaded as "big" files
+TG_BIG_FILE_SIZE = 10 * 1024 * 1024
+# Telegram albums hold at most 10 items
+TG_ALBUM_SIZE = 10
+# Uploaded parts are only kept by Telegram for a while, older saved state is not worth resuming
+UPLOAD_STATE_MAX_AGE = 6 * 3600
+
+
+class TelegramPartUploader:
+    """
+    Upload parts over a dedicated media session with a few parts in flight at once.
+
+    With a state_path, acknowledged parts are recorded on disk. A FloodWait or a
+    dropped connection only retries the part in flight, and uploading the same
+    file again (e.g. after a restart) skips every part Telegram already has.
+    """
+
+    def __init__(self, bot: Client, file_name: str, file_size: int,
+                 progress: Callable[[int, int], Awaitable[None]] = None,
+                 state_path: str = None, file_mtime: float = None):
+        self.bot = bot
+        self.file_name = file_name
+        self.file_size = file_size
+        self.progress = progress
+        self.state_path = state_path
+        self.file_mtime = file_mtime
+        self.file_id = bot.rnd_id()
+        self.is_big = file_size > TG_BIG_FILE_SIZE
+        self.total_parts = math.ceil(file_size / TG_PART_SIZE)
+        self.acked: Set[int] = set()
+        self.uploaded = 0
+        self._md5 = None if self.is_big else hashlib.md5()
+        self._session: Optional[Session] = None
+        self._session_lock = asyncio.Lock()
+        self._slots = asyncio.Semaphore(Config.TG_UPLOAD_WORKERS if self.is_big else 1)
+        self._persisted_at = 0.0
+        self._created_at = time.time()
+        self._load_state()
+
+    async def upload(self, chunks: AsyncIterable[bytes]) -> "raw.base.InputFile":
+        """Consume the chunk stream and return the InputFile to attach to a message"""
+        if self.file_size == 0:
+            raise ValueError("File size equals to 0 B")
+
+        self._session = await self._new_session()
+
+        pending = set()
+        buffer = bytearray()
+        part_index = 0
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+                while len(buffer) >= TG_PART_SIZE:
+                    task = await self._schedule(part_index, bytes(buffer[:TG_PART_SIZE]))
+                    if task:
+                        pending.add(task)
+                    del buffer[:TG_PART_SIZE]
+                    part_index += 1
+                    self._reap(pending)
+            if buffer:
+                task = await self._schedule(part_index, bytes(buffer))
+                if task:
+                    pending.add(task)
+                part_index += 1
+
+            # Surface the first failed part, if any
+            await asyncio.gather(*pending)
+        finally:
+            for task in pending:
+                task.cancel()
+            self._persist(force=True)
+            await self._session.stop()
+
+        if part_index != self.total_parts:
+            raise IOError(f"Expected {self.total_parts} parts, read {part_index}")
+
+        return self.input_file()
+
+    def input_file(self) -> "raw.base.InputFile":
+        if self.is_big:
+            return raw.types.InputFileBig(id=self.file_id, parts=self.total_parts, name=self.file_name)
+        return raw.types.InputFile(
+            id=self.file_id,
+            parts=self.total_parts,
+            name=self.file_name,
+            md5_checksum=self._md5.hexdigest()
+        )
+
+    async def resend_part(self, index: int, file_path: str):
+        """Upload one part again from disk, for when Telegram reports it missing at send time"""
+        with open(file_path, 'rb') as file:
+            file.seek(index * TG_PART_SIZE)
+            data = file.read(TG_PART_SIZE)
+
+        self.acked.discard(index)
+        self._session = await self._new_session()
+        try:
+            await self._slots.acquire()
+            await self._save_part(index, data)
+        finally:
+            self._persist(force=True)
+            await self._session.stop()
+
+    def finish(self):
+        """Forget the saved state once the file was sent"""
+        if self.state_path and os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+    @staticmethod
+    def _reap(pending: set):
+        """Forget finished parts, re-raising a failed one right away"""
+        for task in [task for task in pending if task.done()]:
+            pending.discard(task)
+            task.result()
+
+    async def _schedule(self, index: int, data: bytes) -> Optional[asyncio.Task]:
+        """Start a part upload once a slot is free. Parts Telegram already has are skipped"""
+        if self._md5:
+            self._md5.update(data)
+        if index in self.acked:
+            self.uploaded += len(data)
+            return None
+        await self._slots.acquire()
+        return asyncio.create_task(self._save_part(index, data))
+
+    async def _save_part(self, index: int, data: bytes):
+        try:
+            if self.is_big:
+                rpc = raw.functions.upload.SaveBigFilePart(
+                    file_id=self.file_id,
+                    file_part=index,
+                    file_total_parts=self.total_parts,
+                    bytes=data
+                )
+            else:
+                rpc = raw.functions.upload.SaveFilePart(file_id=self.file_id, file_part=index, bytes=data)
+
+            attempts = 0
+            while True:
+                session = self._session
+                try:
+                    await session.invoke(rpc)
+                    break
+                except FloodWait as e:
+                    await asyncio.sleep(e.value)
+                except (OSError, ConnectionError, TimeoutError, asyncio.TimeoutError) as e:
+                    attempts += 1
+                    if attempts > Config.MAX_RETRY_ATTEMPTS:
+                        raise
+                    logger.warning(f"Part {index} of {self.file_name} failed: {e}, reconnecting")
+                    await asyncio.sleep(2 ** attempts)
+                    await self._restart_session(session)
+
+            self.acked.add(index)
+            self.uploaded += len(data)
+            self._persist()
+            if self.progress:
+                await self.progress(self.uploaded, self.file_size)
+        finally:
+            self._slots.release()
+
+    async def _new_session(self) -> Session:
+        session = Session(
+            self.bot, await self.bot.storage.dc_id(), await self.bot.storage.auth_key(),
+            await self.bot.storage.test_mode(), is_media=True
+        )
+        await session.start()
+        return session
+
+    async def _restart_session(self, broken: Session):
+        """Replace a dead media session once, however many parts noticed it"""
+        async with self._session_lock:
+            if self._session is not broken:
+                return
+            try:
+                await broken.stop()
+            except Exception:
+                pass
+            self._session = await self._new_session()
+
+    def _load_state(self):
+        """Adopt the file id and acknowledged parts of an earlier attempt on the same file"""
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if (state.get('file_size') != self.file_size
+                or state.get('file_mtime') != self.file_mtime
+                or time.time() - state.get('created', 0) > UPLOAD_STATE_MAX_AGE):
+            return
+
+        self.file_id = state['file_id']
+        self.acked = set(state.get('acked', []))
+        self._created_at = state['created']
+        logger.info(f"Resuming upload of {self.file_name}: {len(self.acked)}/{self.total_parts} parts already sent")
+
+    def _persist(self, force: bool = False):
+        """Write the acknowledged parts to disk, at most once a second unless forced"""
+        if not self.state_path:
+            return
+        now = time.time()
+        if not force and now - self._persisted_at < 1:
+            return
+        self._persisted_at = now
+
+        state = {
+            'file_id': self.file_id,
+            'file_size': self.file_size,
+            'file_mtime': self.file_mtime,
+            'created': self._created_at,
+            'acked': sorted(self.acked)
+        }
+        tmp_path = f"{self.state_path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            logger.warning(f"Could not save upload state {self.state_path}: {e}")
+
+
+async def _uploaded_document(bot: Client, input_file: "raw.base.InputFile", file_name: str,
+                             as_document: bool, duration: float, width: int, height: int,
+                             thumb: Optional[str]) -> "raw.types.InputMediaUploadedDocument":
+    """Describe an uploaded file as a streamable video, or as a plain document"""
+    attributes = [raw.types.DocumentAttributeFilename(file_name=file_name)]
+    if not as_document:
+        attributes.insert(0, raw.types.DocumentAttributeVideo(
+            supports_streaming=True,
+            duration=int(duration),
+            w=width,
+            h=height
+        ))
+
+    return raw.types.InputMediaUploadedDocument(
+        mime_type=bot.guess_mime_type(file_name) or "video/mp4",
+        file=input_file,
+        thumb=await bot.save_file(thumb) if thumb else None,
+        force_file=as_document or None,
+        attributes=attributes
+    )
+
+
+async def _invoke_resending(bot: Client, query, resend: Optional[Callable[[int], Awaitable[None]]],
+                            **kwargs):
+    """Invoke a query that references uploaded parts, re-uploading any part Telegram reports missing"""
+    for _ in range(Config.MAX_RETRY_ATTEMPTS + 1):
+        try:
+            return await bot.invoke(query, **kwargs)
+        except FilePartMissing as e:
+            if not resend:
+                raise
+            logger.warning(f"Telegram is missing upload part {e.value}, sending it again")
+            await resend(e.value)
+    return await bot.invoke(query, **kwargs)
+
+
+async def send_uploaded_media(bot: Client, chat_id: int, input_file: "raw.base.InputFile", file_name: str,
+                              as_document: bool = False, duration: float = 0, width: int = 0, height: int = 0,
+                              thumb: str = None, caption: str = "",
+                              reply_markup: types.InlineKeyboardMarkup = None,
+                              resend: Callable[[int], Awaitable[None]] = None) -> Optional[types.Message]:
+    """
+    Send an already uploaded file as a video or document, mirroring Pyrogram's send_video/send_document
+    resend(part) is called to upload a part again when Telegram reports it missing
+    """
+    media = await _uploaded_document(bot, input_file, file_name, as_document, duration, width, height, thumb)
+
+    r = await _invoke_resending(
+        bot,
+        raw.functions.messages.SendMedia(
+            peer=await bot.resolve_peer(chat_id),
+            media=media,
+            random_id=bot.rnd_id(),
+            reply_markup=await reply_markup.write(bot) if reply_markup else None,
+            **await utils.parse_text_entities(bot, caption, None, None)
+        ),
+        resend
+    )
+
+    for update in r.updates:
+        if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+            return await types.Message._parse(
+                bot, update.message,
+                {user.id: user for user in r.users},
+                {chat.id: chat for chat in r.chats}
+            )
+    return None
+
+
+async def send_uploaded_album(bot: Client, chat_id: int, items: List[Dict[str, Any]],
+                              as_document: bool = False) -> List[types.Message]:
+    """
+    Send already uploaded files as ordered albums of up to 10, mirroring Pyrogram's send_media_group
+    Each item holds input_file, file_name, duration, width, height, thumb, caption and optionally resend
+    """
+    peer = await bot.resolve_peer(chat_id)
+    sent = []
+
+    for start in range(0, len(items), TG_ALBUM_SIZE):
+        multi_media = []
+        for item in items[start:start + TG_ALBUM_SIZE]:
+            uploaded = await _invoke_resending(
+                bot,
+                raw.functions.messages.UploadMedia(
+                    peer=peer,
+                    media=await _uploaded_document(
+                        bot, item['input_file'], item['file_name'], as_document,
+                        item['duration'], item['width'], item['height'], item['thumb']
+                    )
+                ),
+                item.get('resend')
+            )
+            multi_media.append(
+                raw.types.InputSingleMedia(
+                    media=raw.types.InputMediaDocument(
+                        id=raw.types.InputDocument(
+                            id=uploaded.document.id,
+                            access_hash=uploaded.document.access_hash,
+                            file_reference=uploaded.document.file_reference
+                        )
+                    ),
+                    random_id=bot.rnd_id(),
+                    **await utils.parse_text_entities(bot, item['caption'], None, None)
+                )
+            )
+
+        r = await bot.invoke(
+            raw.functions.messages.SendMultiMedia(peer=peer, multi_media=multi_media),
+            sleep_threshold=60
+        )
+        sent += await utils.parse_messages(
+            bot,
+            raw.types.messages.Messages(
+                messages=[update.message for update in r.updates
+                          if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage))],
+                users=r.users,
+                chats=r.chats
+            )
+        )
+
+    return sent
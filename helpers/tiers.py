@@ -0,0 +1,116 @@
+"""
+Storage tiers
+Intermediates go to a fast scratch volume (tmpfs or NVMe) when they fit,
+queued inputs to the bulk volumes. Each volume keeps the <volume>/<user_id>
+layout, and files are shared by hard link or reflink before falling back to a copy
+"""
+
+import os
+import fcntl
+import shutil
+import logging
+from typing import List, Optional
+from configs import Config
+
+logger = logging.getLogger(__name__)
+
+# FICLONE from linux/fs.h: share the source's extents instead of copying them
+FICLONE = 0x40049409
+
+
+def _split_paths(value: Optional[str]) -> List[str]:
+    return [path.strip() for path in (value or "").split(",") if path.strip()]
+
+
+def free_bytes(path: str) -> int:
+    try:
+        os.makedirs(path, exist_ok=True)
+        return shutil.disk_usage(path).free
+    except OSError as e:
+        logger.warning(f"Volume {path} is unusable: {e}")
+        return 0
+
+
+class StorageTier:
+    """Volumes of one kind; headroom is left free on each of them"""
+
+    def __init__(self, name: str, paths: List[str], headroom: int = 0):
+        self.name = name
+        self.paths = paths
+        self.headroom = headroom
+
+    def place(self, expected_size: int = 0) -> Optional[str]:
+        """The volume with the most free space that still fits expected_size, None if none does"""
+        best, best_free = None, 0
+        for path in self.paths:
+            free = free_bytes(path) - self.headroom
+            if free >= expected_size and free > best_free:
+                best, best_free = path, free
+        return best
+
+
+bulk = StorageTier("bulk", _split_paths(Config.BULK_PATHS) or [Config.DOWN_PATH], Config.STORAGE_MIN_FREE)
+scratch = StorageTier("scratch", _split_paths(Config.SCRATCH_PATHS), Config.SCRATCH_HEADROOM)
+
+
+def volumes() -> List[str]:
+    """Every volume that may hold user directories"""
+    paths = []
+    for path in [Config.DOWN_PATH] + bulk.paths + scratch.paths:
+        if os.path.abspath(path) not in map(os.path.abspath, paths):
+            paths.append(path)
+    return paths
+
+
+def user_dirs(user_id: int) -> List[str]:
+    return [os.path.join(path, str(user_id)) for path in volumes()]
+
+
+def input_dir(user_id: int, volume: str = None) -> str:
+    """The user's download directory on volume, by default the bulk volume with the most free space"""
+    path = os.path.join(volume or bulk.place() or bulk.paths[0], str(user_id))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def merge_dir(user_id: int, job_id: str, volume: str) -> str:
+    """Work directory of one merge on the volume its reservation was admitted on"""
+    return os.path.join(volume, str(user_id), f"merge_{job_id}")
+
+
+def merge_dirs(user_id: int, job_id: str) -> List[str]:
+    """Every place the work directory of a merge may be, for cleanup before or after it was placed"""
+    return [merge_dir(user_id, job_id, volume) for volume in volumes()]
+
+
+def same_volume(path: str, other: str) -> bool:
+    try:
+        return os.stat(path).st_dev == os.stat(other).st_dev
+    except OSError:
+        return False
+
+
+def clone_file(src: str, dst: str):
+    """Reflink src to dst (btrfs, XFS, ...). Raises OSError where unsupported"""
+    with open(src, 'rb') as source, open(dst, 'wb') as target:
+        try:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        except OSError:
+            target.close()
+            os.remove(dst)
+            raise
+
+
+def link_or_clone(src: str, dst: str) -> str:
+    """Give dst the content of src without copying it where possible. Returns how: link, reflink or copy"""
+    try:
+        os.link(src, dst)
+        return "link"
+    except OSError:
+        pass
+    try:
+        clone_file(src, dst)
+        return "reflink"
+    except OSError:
+        shutil.copyfile(src, dst)
+        return "copy"
@@ -0,0 +1,95 @@
+"""
+Per-user job registry
+Keeps at most one merge per user and orders queue changes behind it
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class UserJobs:
+    """
+    A merge holds its user's lock from the moment it snapshots the queue until
+    it has taken its files out again. Adds and clears take the same lock, so
+    they apply in arrival order behind the merge instead of racing it. A second
+    merge request while one is in flight is pointed at the running one.
+    """
+
+    def __init__(self):
+        # user_id -> [lock, holders and waiters], dropped when nobody needs the lock
+        self._locks: Dict[int, list] = {}
+        self._merges: Dict[int, dict] = {}
+
+    async def _acquire(self, user_id: int):
+        entry = self._locks.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._release_ref(user_id)
+            raise
+
+    def _release(self, user_id: int):
+        self._locks[user_id][0].release()
+        self._release_ref(user_id)
+
+    def _release_ref(self, user_id: int):
+        entry = self._locks[user_id]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._locks[user_id]
+
+    def busy(self, user_id: int) -> bool:
+        return user_id in self._locks
+
+    def busy_users(self) -> List[int]:
+        return list(self._locks)
+
+    @asynccontextmanager
+    async def queue_change(self, user_id: int):
+        """Hold the user's lock for an add or clear, waiting behind a running merge"""
+        await self._acquire(user_id)
+        try:
+            yield
+        finally:
+            self._release(user_id)
+
+    @asynccontextmanager
+    async def if_idle(self, user_id: int):
+        """Hold the user's lock only if nobody holds or waits for it. Yields whether it was taken"""
+        if self.busy(user_id):
+            yield False
+            return
+        # A fresh lock, so this never suspends and nobody can get in between
+        await self._acquire(user_id)
+        try:
+            yield True
+        finally:
+            self._release(user_id)
+
+    def merge_in_flight(self, user_id: int) -> Optional[dict]:
+        return self._merges.get(user_id)
+
+    def begin_merge(self, user_id: int) -> dict:
+        """Register a merge before anything is awaited, so a second tap finds it"""
+        entry = {'job': None, 'status_id': None, 'holding': False}
+        self._merges[user_id] = entry
+        return entry
+
+    async def hold(self, user_id: int):
+        """Take the user's lock for the registered merge. Released by end_merge()"""
+        await self._acquire(user_id)
+        self._merges[user_id]['holding'] = True
+
+    def end_merge(self, user_id: int):
+        """Unregister the merge and release the user's lock if it took it"""
+        entry = self._merges.pop(user_id, None)
+        if entry is not None and entry['holding']:
+            self._release(user_id)
+
+
+user_jobs = UserJobs()
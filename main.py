@@ -14,23 +14,32 @@ from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQ
 from configs import Config
 from helpers.database.add_user import AddUserToDatabase
 from helpers.check_gap import CheckTimeGap
-from helpers.clean import CleanupManager
+from helpers.rate_limit import rate_limiter
+from helpers.clean import cleanup_manager
 from helpers.downloader import DirectDownloader
-from helpers.merger import VideoMerger, get_video_duration, get_video_resolution
-from helpers.forcesub import ForceSub
-from helpers.uploader import UploadVideo
+from helpers.tg_downloader import download_media_parallel
+from helpers.blob_store import blob_store
+from helpers.bandwidth import bandwidth
+from helpers.display_progress import humanbytes, format_batch_progress, progress_dispatcher, edit_status
+from helpers.album import AlbumCollector
+from helpers.forcesub import ForceSub, invalidate_membership
+from helpers.merge_job import run_merge
+from helpers.user_jobs import user_jobs
+from helpers.sessions import sessions
+from helpers.executor import executor, reply_error
+from helpers.storage import storage_manager, StorageFull
+from helpers.tiers import input_dir, merge_dirs
+from helpers.destinations import BACKENDS, get_user_destinations
+from helpers.database.access_db import db
 from helpers.settings import OpenSettings
-from helpers.broadcast import broadcast_handler
+from helpers.broadcast import broadcast_handler, resume_broadcasts
+from helpers.log_channel import log_sink
+from helpers.job_store import job_store, RUNNING, DONE, FAILED
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Global dictionaries for queue management
-QueueDB = {}
-ReplyDB = {}
-cleanup_manager = CleanupManager()
-
 # --- > > > अंतिम और सही क्लाइंट आरंभीकरण < < < ---
 # Pyrogram को सत्र फ़ाइल को स्वयं प्रबंधित करने दें, यह अधिक स्थिर है।
 NubBot = Client(
@@ -39,29 +48,245 @@ NubBot = Client(
     api_hash=Config.API_HASH,
     bot_token=Config.BOT_TOKEN,
     workers=4,
-    sleep_threshold=60
+    sleep_threshold=60,
+    # Bot-wide; each download limits its own ranges to TG_DOWNLOAD_WORKERS
+    max_concurrent_transmissions=Config.TG_MAX_TRANSMISSIONS
+)
+
+
+URL_PATTERN = re.compile(
+    r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*(),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
 )
 
 
 def is_direct_video_url(text: str) -> bool:
     """Check if text contains a direct video URL"""
-    url_pattern = re.compile(
-        r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*(),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-    )
-    
-    if url_pattern.match(text):
+    if URL_PATTERN.match(text):
         video_indicators = Config.SUPPORTED_VIDEO_FORMATS + ['.zip', '.rar', 'video', 'watch', 'dl', 'download']
         return any(indicator.lower() in text.lower() for indicator in video_indicators)
     return False
 
+
+def extract_video_urls(text: str) -> list:
+    """Pull every direct video URL out of a text, keeping submission order"""
+    urls = []
+    for url in URL_PATTERN.findall(text or ""):
+        url = url.rstrip(".,;)")
+        if is_direct_video_url(url) and url not in urls:
+            urls.append(url)
+    return urls
+
+
+def is_url_list_document(message) -> bool:
+    """Check if message carries a .txt list of links"""
+    document = message.document
+    if not document:
+        return False
+    return (document.mime_type == "text/plain"
+            or (document.file_name or "").lower().endswith(".txt"))
+
+
+async def ingest_urls(bot, message, urls: list):
+    """Download a batch of URLs concurrently and queue them in submission order"""
+    user_id = message.from_user.id
+
+    is_spam, wait_time = await CheckTimeGap(user_id, 'download')
+    if is_spam:
+        await message.reply_text(Config.ERROR_MESSAGES['spam_protection'].format(seconds=wait_time))
+        return
+
+    free_slots = Config.MAX_VIDEOS - len(job_store.queue(user_id))
+    if free_slots <= 0:
+        await message.reply_text(Config.ERROR_MESSAGES['queue_full'].format(max_videos=Config.MAX_VIDEOS))
+        return
+    skipped = len(urls) - free_slots
+    urls = urls[:free_slots]
+
+    # Link sizes are unknown up front, so only the quota and free space margin are checked
+    try:
+        reservation = await storage_manager.reserve(user_id, 0)
+    except StorageFull as e:
+        await message.reply_text(f"❌ {e}")
+        return
+
+    with reservation:
+        download_msg = await message.reply_text(f"🔄 **Processing {len(urls)} URL(s)...**", quote=True)
+
+        async with executor.slot('download', download_msg):
+            async with DirectDownloader() as downloader:
+                downloaded_files = await downloader.download_many(urls, user_id, download_msg)
+
+        await queue_downloaded_files(user_id, download_msg, downloaded_files, skipped)
+
+
+async def ingest_url_list(bot, message):
+    """Fetch a .txt list of links and ingest the URLs in it"""
+    url_list = await bot.download_media(message, in_memory=True)
+    urls = extract_video_urls(url_list.getvalue().decode("utf-8", errors="ignore"))
+    if not urls:
+        await message.reply_text(Config.ERROR_MESSAGES['invalid_url'])
+        return
+    await ingest_urls(bot, message, urls)
+
+
+def is_video_message(message) -> bool:
+    """Check if message carries a video file"""
+    media = message.video or message.document
+    return bool(media and media.mime_type and "video" in media.mime_type)
+
+
+async def download_telegram_video(bot, message, user_id: int, status_msg, volume: str, progress=None):
+    """Fetch one Telegram video into the user's directory on volume, reusing the shared store when possible"""
+    media = message.video or message.document
+    file_path = os.path.join(input_dir(user_id, volume), f"{time.time()}_{media.file_name or 'video.mp4'}")
+
+    cache_key = blob_store.telegram_key(media.file_unique_id)
+    if blob_store.fetch(cache_key, file_path):
+        return file_path
+    if not await download_media_parallel(bot, message, file_path, status_msg, progress=progress):
+        return None
+    blob_store.add(cache_key, file_path)
+    return file_path
+
+
+async def ingest_media(bot, messages: list):
+    """Download Telegram videos (a single file or a whole album) and queue them in album order"""
+    first = messages[0]
+    user_id = first.from_user.id
+
+    is_spam, wait_time = await CheckTimeGap(user_id, 'download')
+    if is_spam:
+        await first.reply_text(Config.ERROR_MESSAGES['spam_protection'].format(seconds=wait_time))
+        return
+
+    videos = [message for message in messages if is_video_message(message)]
+    if not videos:
+        await first.reply_text("❌ Please send only video files.")
+        return
+
+    free_slots = Config.MAX_VIDEOS - len(job_store.queue(user_id))
+    if free_slots <= 0:
+        await first.reply_text(Config.ERROR_MESSAGES['queue_full'].format(max_videos=Config.MAX_VIDEOS))
+        return
+    skipped = len(videos) - free_slots
+    videos = videos[:free_slots]
+
+    try:
+        reservation = await storage_manager.reserve(
+            user_id, sum((message.video or message.document).file_size or 0 for message in videos)
+        )
+    except StorageFull as e:
+        await first.reply_text(f"❌ {e}")
+        return
+
+    with reservation:
+        if len(videos) == 1:
+            download_msg = await videos[0].reply_text("📥 **Downloading video...**", quote=True)
+            async with executor.slot('download', download_msg):
+                downloaded_files = [await download_telegram_video(bot, videos[0], user_id, download_msg,
+                                                                  reservation.volume)]
+        else:
+            download_msg = await first.reply_text(f"📥 **Downloading {len(videos)} videos...**", quote=True)
+            async with executor.slot('download', download_msg):
+                downloaded_files = await download_album(bot, videos, user_id, download_msg, reservation.volume)
+
+        await queue_downloaded_files(user_id, download_msg, downloaded_files, skipped)
+
+
+async def download_album(bot, videos: list, user_id: int, download_msg, volume: str) -> list:
+    """Download album members concurrently with one aggregated progress message"""
+    states = [
+        {'name': (message.video or message.document).file_name or 'video.mp4',
+         'downloaded': 0, 'total': 0, 'done': False, 'error': None}
+        for message in videos
+    ]
+    start_time = time.time()
+    slots = asyncio.Semaphore(Config.USER_CONCURRENT_DOWNLOADS)
+
+    async def _download(message, state):
+        async def _progress(current, total):
+            state['downloaded'], state['total'] = current, total
+
+        async with slots:
+            try:
+                path = await download_telegram_video(bot, message, user_id, download_msg, volume, _progress)
+            except Exception as e:
+                logger.error(f"Album member download error: {e}")
+                path = None
+        state['done'] = True
+        state['error'] = None if path else "failed"
+        return path
+
+    async def _report_loop():
+        while True:
+            await asyncio.sleep(Config.PROGRESS_UPDATE_INTERVAL)
+            progress_dispatcher(download_msg).post(format_batch_progress(
+                f"📥 **Downloading {len(videos)} videos...**", states, start_time
+            ))
+
+    reporter = asyncio.create_task(_report_loop())
+    try:
+        return list(await asyncio.gather(*[_download(m, s) for m, s in zip(videos, states)]))
+    finally:
+        reporter.cancel()
+
+
+async def queue_downloaded_files(user_id: int, download_msg, downloaded_files: list, skipped: int = 0):
+    """Append finished downloads to the user's queue in order and summarize them"""
+    added = [path for path in downloaded_files if path and os.path.isfile(path)]
+    if added and user_jobs.busy(user_id):
+        await edit_status(download_msg, "⏳ **Downloaded, waiting for your running merge to finish...**")
+    sessions.get(user_id).status_id = download_msg.id
+    async with user_jobs.queue_change(user_id):
+        # The queue may have changed while downloading, e.g. behind a failed merge
+        free_slots = Config.MAX_VIDEOS - len(job_store.queue(user_id))
+        for path in added[max(free_slots, 0):]:
+            os.remove(path)
+        skipped += max(len(added) - max(free_slots, 0), 0)
+        added = added[:max(free_slots, 0)]
+        for path in added:
+            job_store.add_to_queue(user_id, path, download_msg.id)
+            cleanup_manager.track(path, user_id)
+
+    if not added:
+        await edit_status(download_msg, "❌ **Download failed!** Please check your files or links and try again.")
+        return
+
+    if len(downloaded_files) == 1:
+        lines = ["✅ **Video added!**", "", f"📁 **File:** `{os.path.basename(added[0])}`"]
+    else:
+        lines = [f"✅ **Download complete!** ({len(added)}/{len(downloaded_files)} added)", ""]
+        lines += [f"📁 `{os.path.basename(path)}`" for path in added]
+    failed = len(downloaded_files) - len(added)
+    if failed:
+        lines.append(f"\n❌ **Failed:** {failed}")
+    if skipped > 0:
+        lines.append(f"⚠️ **Skipped:** {skipped} (queue limit)")
+    lines.append(f"\n🎬 **Queue:** {len(job_store.queue(user_id))}/{Config.MAX_VIDEOS}")
+
+    await edit_status(
+        download_msg,
+        "\n".join(lines),
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔀 Merge Now", callback_data="merge_now")],
+            [InlineKeyboardButton("🗑 Clear Queue", callback_data="clear_queue")]
+        ])
+    )
+
+
+album_collector = AlbumCollector(ingest_media)
+
 # Your existing handlers remain the same...
 @NubBot.on_message(filters.command(["start", "ping"]) & filters.private)
 async def start_handler(bot, message):
+    # Cheap commands are charged too, but over-limit ones are dropped without a reply
+    if not rate_limiter.check(message.from_user.id)[0]:
+        return
     try:
         await AddUserToDatabase(bot, message)
         
         if Config.UPDATES_CHANNEL:
-            if not await ForceSub(bot, message):
+            if await ForceSub(bot, message) == 400:
                 return
         
         await message.reply_text(
@@ -78,18 +303,32 @@ async def start_handler(bot, message):
 
 @NubBot.on_message(filters.command(["help"]) & filters.private)
 async def help_handler(bot, message):
+    if not rate_limiter.check(message.from_user.id)[0]:
+        return
     await message.reply_text(Config.HELP_TEXT.format(max_videos=Config.MAX_VIDEOS), quote=True)
 
 @NubBot.on_message(filters.command(["settings"]) & filters.private)
 async def settings_handler(bot, message):
-    await OpenSettings(message)
+    if not rate_limiter.check(message.from_user.id)[0]:
+        return
+    settings_message = await message.reply_text("⚙️ **Loading settings...**", quote=True)
+    await OpenSettings(settings_message, message.from_user.id)
 
 @NubBot.on_message(filters.command(["merge"]) & filters.private)
 async def merge_handler(bot, message):
     user_id = message.from_user.id
-    
+
     try:
-        if user_id not in QueueDB or len(QueueDB.get(user_id, [])) < 2:
+        running = user_jobs.merge_in_flight(user_id)
+        if running:
+            logger.info(f"Merge request of {user_id} pointed at the running one")
+            await message.reply_text(
+                "⏳ **Your merge is already running.** Its progress is shown in the message above.",
+                reply_to_message_id=running['status_id']
+            )
+            return
+
+        if len(job_store.queue(user_id)) < 2:
             await message.reply_text(Config.ERROR_MESSAGES['not_enough_videos'])
             return
         
@@ -98,40 +337,161 @@ async def merge_handler(bot, message):
             await message.reply_text(Config.ERROR_MESSAGES['spam_protection'].format(seconds=wait_time))
             return
         
-        merge_message = await message.reply_text("🚀 **Initializing merge process...**")
-        
-        merger = VideoMerger(user_id)
-        merged_video = await merger.merge_videos(QueueDB[user_id], merge_message)
-        
-        if merged_video:
-            await merge_message.edit("✅ **Merge completed! Preparing for upload...**")
-            
-            duration = await get_video_duration(merged_video)
-            width, height = await get_video_resolution(merged_video)
-            file_size = os.path.getsize(merged_video)
-            thumbnails = await merger.generate_thumbnails(merged_video, count=1)
-            thumbnail_path = thumbnails[0] if thumbnails else None
-            
-            await UploadVideo(bot, message, merged_video, width, height, duration, thumbnail_path, file_size)
-            
-            if user_id in QueueDB: del QueueDB[user_id]
-            if user_id in ReplyDB: del ReplyDB[user_id]
-            await cleanup_manager.clean_user_directory(user_id)
+        entry = user_jobs.begin_merge(user_id)
+        try:
+            merge_message = await message.reply_text("🚀 **Initializing merge process...**")
+        except Exception:
+            user_jobs.end_merge(user_id)
+            raise
+        entry['status_id'] = sessions.get(user_id).status_id = merge_message.id
+
+        if Config.MERGE_WORKERS:
+            executor.submit(submit_merge_job(message, merge_message), on_error=reply_error(message))
         else:
-            await merge_message.edit(Config.ERROR_MESSAGES['merge_failed'])
+            executor.submit(run_merge_job(bot, message, merge_message), on_error=reply_error(message))
 
     except Exception as e:
         logger.error(f"Merge handler error: {e}")
         await message.reply_text(f"❌ **Error:** `{str(e)}`")
 
+async def take_merge_files(user_id: int, merge_message) -> list:
+    """Wait for queue changes ahead of the merge, then snapshot the queue it will merge"""
+    await user_jobs.hold(user_id)
+    files = job_store.queue(user_id)
+    if len(files) < 2:
+        await edit_status(merge_message, Config.ERROR_MESSAGES['not_enough_videos'])
+        return []
+    return files
+
+async def run_merge_job(bot, message, merge_message):
+    """Background part of /merge when merging in-process"""
+    user_id = message.from_user.id
+    job = None
+    try:
+        files = await take_merge_files(user_id, merge_message)
+        if not files:
+            return
+        job = job_store.create_job(user_id, "merge", files=files, chat_id=merge_message.chat.id,
+                                   message_id=merge_message.id)
+        job_store.update_job(job['id'], state=RUNNING)
+        user_jobs.merge_in_flight(user_id)['job'] = job
+
+        # Its own directory, so nothing else of the user's is overwritten; placed once the merge is admitted
+        for work_dir in merge_dirs(user_id, job['id']):
+            cleanup_manager.track(work_dir, user_id)
+        probes = job_store.queue_probes(user_id)
+
+        async def _merged(output):
+            # Persisted before the upload starts, so a restart resumes it instead of merging again
+            job_store.update_job(job['id'], output=output)
+            await job_store.flush()
+
+        if await run_merge(bot, message.from_user, merge_message, files, job['id'], probes, on_merged=_merged):
+            job_store.update_job(job['id'], state=DONE)
+            await finish_merge_files(job)
+        else:
+            job_store.update_job(job['id'], state=FAILED, error="merge failed")
+            # A retry of the same queue doesn't probe the files again
+            job_store.store_probes(user_id, probes)
+            await cleanup_manager.clean_job_files(merge_dirs(user_id, job['id']))
+    except Exception as e:
+        if job:
+            job_store.update_job(job['id'], state=FAILED, error=str(e))
+        raise
+    finally:
+        user_jobs.end_merge(user_id)
+
+async def resume_merge_job(bot, job: dict):
+    """Upload the output of a merge that a restart interrupted; the user is held by the caller"""
+    user_id = job['user_id']
+    payload = job['payload']
+    try:
+        merge_message = await bot.get_messages(payload['chat_id'], payload['message_id'])
+        if not merge_message or merge_message.empty:
+            merge_message = await bot.send_message(user_id, "🔄 **Resuming your upload after a restart...**")
+        else:
+            await edit_status(merge_message, "🔄 **Resuming your upload after a restart...**")
+        user = await bot.get_users(user_id)
+        if await run_merge(bot, user, merge_message, payload['files'], job['id'], output=payload['output']):
+            job_store.update_job(job['id'], state=DONE)
+            await finish_merge_files(job)
+        else:
+            job_store.update_job(job['id'], state=FAILED, error="upload failed")
+            await cleanup_manager.clean_job_files(merge_dirs(user_id, job['id']))
+    except Exception as e:
+        job_store.update_job(job['id'], state=FAILED, error=str(e))
+        await cleanup_manager.clean_job_files(merge_dirs(user_id, job['id']))
+        raise
+    finally:
+        user_jobs.end_merge(user_id)
+
+async def submit_merge_job(message, merge_message):
+    """Background part of /merge with MERGE_WORKERS; the user stays locked until a worker finishes"""
+    user_id = message.from_user.id
+    user = message.from_user
+    job = None
+    try:
+        files = await take_merge_files(user_id, merge_message)
+        if not files:
+            user_jobs.end_merge(user_id)
+            return
+        job = job_store.create_job(user_id, "merge", files=files, chat_id=merge_message.chat.id,
+                                   message_id=merge_message.id,
+                                   user={'id': user.id, 'first_name': user.first_name, 'username': user.username})
+        user_jobs.merge_in_flight(user_id)['job'] = job
+        # Before submitting, so it can't overwrite a fast worker's progress
+        await edit_status(merge_message, "⏳ **Queued for a merge worker...**")
+        await job_store.submit(job['id'])
+    except Exception as e:
+        # Never submitted, so no worker will pick it up after the user is unlocked
+        if job and not job_store.is_submitted(job['id']):
+            job_store.update_job(job['id'], state=FAILED, error=str(e))
+        user_jobs.end_merge(user_id)
+        raise
+
+async def finish_merge_files(job: dict):
+    """Take merged files out of the queue and remove only what the merge used"""
+    files = job['payload']['files']
+    for file_path in files:
+        job_store.remove_from_queue(job['user_id'], file_path)
+    await job_store.flush()
+    await cleanup_manager.clean_job_files(files + merge_dirs(job['user_id'], job['id']))
+
+async def clear_user_queue(user_id: int):
+    async with user_jobs.queue_change(user_id):
+        job_store.clear_queue(user_id)
+        await job_store.flush()
+        await cleanup_manager.clean_user_directory(user_id)
+
+async def expire_session(user_id: int) -> bool:
+    """Clear a queue left alone for SESSION_IDLE_TIMEOUT. False while something still uses it"""
+    if user_jobs.busy(user_id) or storage_manager.has_reservations(user_id):
+        return False
+    session = sessions.peek(user_id)
+    status_id = session.status_id or session.queue[-1].reply_id
+    await clear_user_queue(user_id)
+    logger.info(f"Cleared the idle queue of {user_id}")
+    try:
+        await NubBot.send_message(
+            user_id,
+            "🗑 **Your queue was cleared after being idle for a while.**\n\nSend your videos again to merge them.",
+            reply_to_message_id=status_id
+        )
+    except Exception as e:
+        logger.warning(f"Could not notify {user_id} about their expired queue: {e}")
+    return True
+
 @NubBot.on_message(filters.command(["clear"]) & filters.private)
 async def clear_handler(bot, message):
     user_id = message.from_user.id
-    
-    if user_id in QueueDB: del QueueDB[user_id]
-    if user_id in ReplyDB: del ReplyDB[user_id]
-    
-    await cleanup_manager.clean_user_directory(user_id)
+
+    if user_jobs.busy(user_id):
+        # Ordered behind the running merge, which still needs the files
+        await message.reply_text("⏳ **Your queue will be cleared once the running merge finishes.**")
+        executor.submit(clear_user_queue(user_id), on_error=reply_error(message))
+        return
+
+    await clear_user_queue(user_id)
     await message.reply_text("✅ **Queue cleared successfully!**")
 
 @NubBot.on_message((filters.video | filters.document) & filters.private)
@@ -142,89 +502,54 @@ async def media_handler(bot, message):
         await AddUserToDatabase(bot, message)
         
         if Config.UPDATES_CHANNEL:
-            if not await ForceSub(bot, message):
+            if await ForceSub(bot, message) == 400:
                 return
         
-        is_spam, wait_time = await CheckTimeGap(user_id)
-        if is_spam:
-            await message.reply_text(Config.ERROR_MESSAGES['spam_protection'].format(seconds=wait_time))
-            return
-        
-        if len(QueueDB.get(user_id, [])) >= Config.MAX_VIDEOS:
-            await message.reply_text(Config.ERROR_MESSAGES['queue_full'].format(max_videos=Config.MAX_VIDEOS))
+        if is_url_list_document(message):
+            if message.document.file_size > Config.MAX_URL_LIST_SIZE:
+                await message.reply_text("❌ Link list is too large.")
+                return
+            executor.submit(ingest_url_list(bot, message), on_error=reply_error(message))
             return
 
-        media = message.video or message.document
-        if not media.mime_type or "video" not in media.mime_type:
-            await message.reply_text("❌ Please send only video files.")
+        # Album members and forwarded bursts are admitted together once the group is complete
+        if album_collector.add(bot, message):
             return
 
-        download_msg = await message.reply_text("📥 **Downloading video...**", quote=True)
-        
-        file_path = os.path.join(Config.DOWN_PATH, str(user_id), f"{time.time()}_{media.file_name or 'video.mp4'}")
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        
-        await bot.download_media(message, file_name=file_path)
-        
-        QueueDB.setdefault(user_id, []).append(file_path)
-        ReplyDB.setdefault(user_id, []).append(download_msg.message_id)
-        
-        await download_msg.edit(
-            f"✅ **Video added!**\n\n📁 **File:** `{os.path.basename(file_path)}`\n🎬 **Queue:** {len(QueueDB[user_id])}/{Config.MAX_VIDEOS}",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔀 Merge Now", callback_data="merge_now")],
-                [InlineKeyboardButton("🗑 Clear Queue", callback_data="clear_queue")]
-            ])
-        )
+        executor.submit(ingest_media(bot, [message]), on_error=reply_error(message))
 
     except Exception as e:
         logger.error(f"Media handler error: {e}")
         await message.reply_text(f"❌ **Error:** `{str(e)}`")
 
-@NubBot.on_message(filters.text & filters.private & ~filters.command(["start", "ping", "help", "settings", "merge", "clear", "broadcast"]))
+@NubBot.on_message(filters.text & filters.private & ~filters.command(["start", "ping", "help", "settings", "merge", "clear", "broadcast", "status"]))
 async def url_handler(bot, message):
-    user_id = message.from_user.id
-
-    if is_direct_video_url(message.text):
+    urls = extract_video_urls(message.text)
+    if urls:
         try:
             await AddUserToDatabase(bot, message)
 
             if Config.UPDATES_CHANNEL:
-                if not await ForceSub(bot, message): return
-            
-            is_spam, wait_time = await CheckTimeGap(user_id)
-            if is_spam:
-                await message.reply_text(Config.ERROR_MESSAGES['spam_protection'].format(seconds=wait_time))
-                return
+                if await ForceSub(bot, message) == 400: return
 
-            if len(QueueDB.get(user_id, [])) >= Config.MAX_VIDEOS:
-                await message.reply_text(Config.ERROR_MESSAGES['queue_full'].format(max_videos=Config.MAX_VIDEOS))
-                return
-
-            download_msg = await message.reply_text("🔄 **Processing URL...**", quote=True)
-            
-            async with DirectDownloader() as downloader:
-                downloaded_file = await downloader.download_from_url(message.text, user_id, download_msg)
-            
-            if downloaded_file:
-                QueueDB.setdefault(user_id, []).append(downloaded_file)
-                ReplyDB.setdefault(user_id, []).append(download_msg.message_id)
-                
-                await download_msg.edit(
-                    f"✅ **Download complete!**\n\n📁 **File:** `{os.path.basename(downloaded_file)}`\n🎬 **Queue:** {len(QueueDB[user_id])}/{Config.MAX_VIDEOS}",
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("🔀 Merge Now", callback_data="merge_now")],
-                        [InlineKeyboardButton("🗑 Clear Queue", callback_data="clear_queue")]
-                    ])
-                )
-            else:
-                await download_msg.edit("❌ **Download failed!** Please check the URL and try again.")
+            executor.submit(ingest_urls(bot, message, urls), on_error=reply_error(message))
         except Exception as e:
             logger.error(f"URL handler error: {e}")
             await message.reply_text(f"❌ **Error:** `{str(e)}`")
     else:
         await message.reply_text("Please send video files, direct video links, or use /help.")
 
+UPDATES_CHAT = Config.UPDATES_CHANNEL
+if UPDATES_CHAT and UPDATES_CHAT.lstrip("-").isdigit():
+    UPDATES_CHAT = int(UPDATES_CHAT)
+
+@NubBot.on_chat_member_updated(filters.chat(UPDATES_CHAT) if UPDATES_CHAT else filters.all)
+async def channel_member_handler(bot, update):
+    # Only delivered while the bot is an admin of the channel; otherwise the cache TTLs apply
+    member = update.new_chat_member or update.old_chat_member
+    if Config.UPDATES_CHANNEL and member and member.user:
+        invalidate_membership(member.user.id)
+
 @NubBot.on_callback_query()
 async def callback_handler(bot, cb: CallbackQuery):
     user_id = cb.from_user.id
@@ -232,7 +557,19 @@ async def callback_handler(bot, cb: CallbackQuery):
     if cb.data == "help":
         await cb.message.edit_text(Config.HELP_TEXT.format(max_videos=Config.MAX_VIDEOS))
     elif cb.data == "settings":
-        await OpenSettings(cb.message)
+        await OpenSettings(cb.message, user_id)
+    elif cb.data.startswith("triggerDest_"):
+        name = cb.data.split("_", 1)[1]
+        chosen = [backend.name for backend in await get_user_destinations(user_id)]
+        if name in chosen:
+            if len(chosen) == 1:
+                await cb.answer("At least one upload destination is required!", show_alert=True)
+                return
+            chosen.remove(name)
+        elif name in BACKENDS:
+            chosen.append(name)
+        await db.set_upload_destinations(user_id, chosen)
+        await OpenSettings(cb.message, user_id)
     elif cb.data == "merge_now":
         class FakeMessage:
             def __init__(self, user, chat):
@@ -251,19 +588,105 @@ async def callback_handler(bot, cb: CallbackQuery):
 @NubBot.on_message(filters.command(["broadcast"]) & filters.user(Config.BOT_OWNER))
 async def broadcast_command(bot, message):
     if message.reply_to_message:
-        await broadcast_handler(message)
+        # Runs for as long as the user base takes, so it must not hold a handler worker
+        executor.submit(broadcast_handler(bot, message), on_error=reply_error(message))
     else:
         await message.reply_text("Reply to a message to broadcast it.")
 
+@NubBot.on_message(filters.command(["status"]) & filters.user(Config.BOT_OWNER))
+async def status_command(bot, message):
+    lines = ["📊 **Bot Status**", ""]
+    for direction, stats in bandwidth.stats().items():
+        limit = humanbytes(stats['limit']) + "/s" if stats['limit'] > 0 else "unlimited"
+        usage = f" ({round(stats['utilization'] * 100, 1)}%)" if stats['utilization'] is not None else ""
+        lines.append(
+            f"**{direction.title()}:** {humanbytes(stats['throughput']) or '0 B'}/s of {limit}{usage}, "
+            f"{stats['active_users']} active user(s)"
+        )
+    for kind, stats in executor.stats().items():
+        lines.append(f"**{kind.title()} jobs:** {stats['running']}/{stats['limit']} running, {stats['waiting']} waiting")
+    limits = rate_limiter.stats()
+    lines.append(f"**Rate limiter:** {limits['allowed']} allowed, {limits['limited']} limited")
+    users = sessions.stats()
+    lines.append(f"**Sessions:** {users['sessions']} ({users['queued']} with a queue), "
+                 f"{humanbytes(users['bytes']) or '0 B'} at {users['bytes_per_session']} B each, "
+                 f"{users['dropped']} idle session(s) dropped, {users['expired']} idle queue(s) expired, "
+                 f"{users['refused']} new user(s) refused")
+    disk = storage_manager.stats()
+    lines.append(f"**Disk:** {humanbytes(disk['free']) or '0 B'} free, {humanbytes(disk['reserved']) or '0 B'} reserved "
+                 f"by {disk['reservations']} job(s), {disk['evicted']} idle queue(s) evicted")
+    store = blob_store.stats()
+    lines.append(f"**Shared store:** {store['blobs']} files, {humanbytes(store['total_size']) or '0 B'}")
+    await message.reply_text("\n".join(lines), quote=True)
+
+async def watch_merge_workers():
+    """Tidy up after merges that the workers finished"""
+    while True:
+        await asyncio.sleep(Config.WORKER_POLL_INTERVAL)
+        try:
+            finished = await job_store.refresh()
+        except Exception as e:
+            logger.error(f"Following merge workers failed: {e}")
+            continue
+        for job in finished:
+            if job['state'] == DONE:
+                await finish_merge_files(job)
+            else:
+                await cleanup_manager.clean_job_files(merge_dirs(job['user_id'], job['id']))
+            user_jobs.end_merge(job['user_id'])
+
 async def start_bot():
     """Start the bot with robust error handling."""
     logger.info("Starting Enhanced VideoMerge Bot...")
     try:
+        # Queues must match the disk before the first update is handled
+        interrupted = await job_store.open()
+
         await NubBot.start()
         logger.info("Bot started successfully!")
+        await log_sink.start(NubBot)
+
+        async def _notify_evicted(user_id):
+            await NubBot.send_message(user_id, "🗑 **Your idle queue was cleared to free disk space.**\n\nSend your videos again to merge them.")
+        storage_manager.on_evict = _notify_evicted
+        sessions.on_expire = expire_session
+
+        for job in interrupted:
+            try:
+                await NubBot.send_message(
+                    job['user_id'],
+                    "⚠️ **Your merge was interrupted by a restart.**\n\nYour queue is still there, send /merge to try again."
+                )
+            except Exception as e:
+                logger.warning(f"Could not notify {job['user_id']} about interrupted job: {e}")
+
+        try:
+            await db.ensure_indexes()
+        except Exception as e:
+            logger.error(f"User index migration failed: {e}")
+        try:
+            await resume_broadcasts(NubBot)
+        except Exception as e:
+            logger.error(f"Resuming broadcasts failed: {e}")
         
-        # Start scheduled cleanup
+        # Merges that were uploading when the bot stopped finish their upload; the user stays locked until then
+        for job in job_store.resumable_jobs():
+            entry = user_jobs.begin_merge(job['user_id'])
+            entry.update(job=job, status_id=job['payload']['message_id'])
+            await user_jobs.hold(job['user_id'])
+            executor.submit(resume_merge_job(NubBot, job))
+
+        if Config.MERGE_WORKERS:
+            # Merges submitted before a restart keep their users locked until they finish
+            for job in job_store.submitted_jobs():
+                user_jobs.begin_merge(job['user_id'])['job'] = job
+                await user_jobs.hold(job['user_id'])
+            asyncio.create_task(watch_merge_workers())
+
+        # Expire tracked files and reconcile DOWN_PATH now and then
         asyncio.create_task(cleanup_manager.start_cleanup_scheduler())
+        # Drop idle sessions and clear queues nobody came back to
+        asyncio.create_task(sessions.start_sweeper())
         
         # Keep running
         await asyncio.Event().wait()
@@ -274,6 +697,16 @@ async def start_bot():
     except Exception as e:
         logger.error(f"A fatal error occurred during startup: {e}")
         sys.exit(1)
+    finally:
+        await executor.shutdown()
+        try:
+            await log_sink.close()
+        except Exception as e:
+            logger.error(f"Flushing the log channel failed: {e}")
+        try:
+            await job_store.close()
+        except Exception as e:
+            logger.error(f"Saving the job store failed: {e}")
 
 if __name__ == "__main__":
     try:
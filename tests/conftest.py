@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+# Config reads these at import time; the modules under test never talk to Telegram or MongoDB
+for name, value in (("API_ID", "1"), ("API_HASH", "test"), ("BOT_TOKEN", "test"),
+                    ("MONGODB_URI", "mongodb://localhost"), ("BOT_OWNER", "1")):
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeClock:
+    """Stands in for time.time or time.monotonic; tests move it by adding to now"""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def fake_clock():
+    return FakeClock()
@@ -0,0 +1,88 @@
+import asyncio
+from types import SimpleNamespace
+
+from helpers import album
+from helpers.album import AlbumCollector
+from helpers.executor import JobExecutor
+
+
+def message(id, chat_id=1, media_group_id=None, forward_date=None):
+    return SimpleNamespace(id=id, chat=SimpleNamespace(id=chat_id), media_group_id=media_group_id,
+                           forward_date=forward_date)
+
+
+def collect(monkeypatch, arrivals, delay=0.05):
+    """Feed (message, pause before it) pairs to a collector, returning the groups it handed over"""
+    jobs = JobExecutor({})
+    monkeypatch.setattr(album, "executor", jobs)
+    groups = []
+
+    async def on_group(bot, messages):
+        groups.append([m.id for m in messages])
+
+    async def scenario():
+        collector = AlbumCollector(on_group, delay=delay)
+        taken = []
+        for m, pause in arrivals:
+            await asyncio.sleep(pause)
+            taken.append(collector.add(None, m))
+        await asyncio.sleep(delay * 3)
+        await asyncio.gather(*jobs._tasks)
+        return taken
+
+    return scenario, groups
+
+
+def test_an_album_is_handed_over_once_in_message_order(monkeypatch):
+    scenario, groups = collect(monkeypatch, [
+        (message(3, media_group_id="a"), 0), (message(1, media_group_id="a"), 0), (message(2, media_group_id="a"), 0)
+    ])
+    assert asyncio.run(scenario()) == [True, True, True]
+    assert groups == [[1, 2, 3]]
+
+
+def test_a_late_member_extends_the_wait(monkeypatch):
+    scenario, groups = collect(monkeypatch, [
+        (message(1, media_group_id="a"), 0), (message(2, media_group_id="a"), 0.03), (message(3, media_group_id="a"), 0.03)
+    ])
+    asyncio.run(scenario())
+    assert groups == [[1, 2, 3]]
+
+
+def test_groups_are_kept_apart_by_album_and_chat(monkeypatch):
+    scenario, groups = collect(monkeypatch, [
+        (message(1, media_group_id="a"), 0), (message(2, media_group_id="b"), 0),
+        (message(3, chat_id=2, forward_date=1), 0), (message(4, chat_id=2, forward_date=1), 0),
+        (message(5, chat_id=3, forward_date=1), 0)
+    ])
+    asyncio.run(scenario())
+    assert sorted(groups) == [[1], [2], [3, 4], [5]]
+
+
+def test_plain_messages_are_not_collected(monkeypatch):
+    scenario, groups = collect(monkeypatch, [(message(1), 0)])
+    assert asyncio.run(scenario()) == [False]
+    assert groups == []
+
+
+def test_a_failing_group_is_reported_to_its_first_message(monkeypatch):
+    jobs = JobExecutor({})
+    monkeypatch.setattr(album, "executor", jobs)
+    replies = []
+
+    class Member(SimpleNamespace):
+        async def reply_text(self, text):
+            replies.append((self.id, text))
+
+    async def on_group(bot, messages):
+        raise RuntimeError("storage full")
+
+    async def scenario():
+        collector = AlbumCollector(on_group, delay=0.01)
+        for id in (2, 1):
+            collector.add(None, Member(id=id, chat=SimpleNamespace(id=1), media_group_id="a", forward_date=None))
+        await asyncio.sleep(0.05)
+        await asyncio.gather(*jobs._tasks)
+
+    asyncio.run(scenario())
+    assert replies == [(1, "❌ **Error:** `storage full`")]
@@ -0,0 +1,118 @@
+import os
+import asyncio
+
+import pytest
+
+from helpers import clean
+from helpers import job_store as job_store_module
+from helpers.blob_store import BlobStore
+from helpers.clean import CleanupManager
+from helpers.job_store import JobStore, _SQLiteBackend
+from helpers.sessions import SessionRegistry
+from helpers.user_jobs import UserJobs
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch, fake_clock):
+    clock = fake_clock
+    volume = tmp_path / "downloads"
+    volume.mkdir()
+    monkeypatch.setattr("helpers.clean.time.time", clock)
+    monkeypatch.setattr(clean, "volumes", lambda: [str(volume)])
+    monkeypatch.setattr(clean, "blob_store", BlobStore(str(tmp_path / "blobs"), max_size=0))
+    monkeypatch.setattr(clean, "user_jobs", UserJobs())
+    monkeypatch.setattr(job_store_module, "sessions", SessionRegistry(0, 10, 100))
+    store = JobStore(_SQLiteBackend(str(tmp_path / "jobs.db")))
+    monkeypatch.setattr(clean, "job_store", store)
+    manager = CleanupManager()
+    manager.tick = 10
+    manager._cursor = int(clock.now // manager.tick)
+    return clock, volume, store, manager
+
+
+def write_file(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"video")
+    return str(path)
+
+
+def test_tracked_files_expire_on_their_tick(env):
+    clock, volume, store, manager = env
+    path = write_file(volume / "7" / "a.mp4")
+    manager.track(path, 7, ttl=25)
+
+    clock.now += 20
+    assert asyncio.run(manager.expire_due()) == 0
+    assert os.path.exists(path)
+
+    clock.now += 10
+    assert asyncio.run(manager.expire_due()) == 1
+    assert not os.path.exists(path)
+    assert manager.expired == 1
+
+
+def test_untracked_and_refreshed_paths_are_not_expired_early(env):
+    clock, volume, store, manager = env
+    forgotten = write_file(volume / "7" / "a.mp4")
+    refreshed = write_file(volume / "7" / "b.mp4")
+    manager.track(forgotten, 7, ttl=10)
+    manager.track(refreshed, 7, ttl=10)
+    manager.untrack(forgotten)
+    manager.track(refreshed, 7, ttl=100)
+
+    clock.now += 50
+    asyncio.run(manager.expire_due())
+    assert os.path.exists(forgotten)
+    assert os.path.exists(refreshed)
+
+
+def test_expiry_waits_for_a_busy_user(env):
+    clock, volume, store, manager = env
+    path = write_file(volume / "7" / "a.mp4")
+    manager.track(path, 7, ttl=10)
+
+    async def scenario():
+        async with clean.user_jobs.queue_change(7):
+            clock.now += 20
+            assert await manager.expire_due() == 0
+        assert os.path.exists(path)
+        clock.now += manager.tick * 5
+        assert await manager.expire_due() == 1
+
+    asyncio.run(scenario())
+    assert not os.path.exists(path)
+
+
+def test_an_expired_file_leaves_the_queue(env):
+    clock, volume, store, manager = env
+
+    async def scenario():
+        await store.open()
+        try:
+            path = write_file(volume / "7" / "a.mp4")
+            store.add_to_queue(7, path)
+            manager.track(path, 7, ttl=10)
+            clock.now += 20
+            await manager.expire_due()
+            return store.queue(7)
+        finally:
+            await store.close()
+
+    assert asyncio.run(scenario()) == []
+
+
+def test_reconcile_removes_only_old_untracked_files(env):
+    clock, volume, store, manager = env
+    tracked = write_file(volume / "7" / "tracked.mp4")
+    orphan = write_file(volume / "7" / "orphan.mp4")
+    recent = write_file(volume / "7" / "recent.mp4")
+    old = clock.now - clean.Config.CLEANUP_FILE_TTL - 1
+    for path in (tracked, orphan):
+        os.utime(path, (old, old))
+    os.utime(recent, (clock.now, clock.now))
+    manager.track(tracked, 7)
+
+    assert asyncio.run(manager.reconcile()) == 1
+    assert not os.path.exists(orphan)
+    assert os.path.exists(tracked)
+    assert os.path.exists(recent)
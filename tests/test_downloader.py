@@ -0,0 +1,52 @@
+import os
+import asyncio
+
+import pytest
+
+from helpers import downloader
+from helpers.downloader import DirectDownloader
+
+
+@pytest.fixture
+def download_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "input_dir", lambda user_id: str(tmp_path))
+    return tmp_path
+
+
+def new_state():
+    return {'name': "a.mp4", 'downloaded': 0, 'total': 0, 'done': False, 'error': None}
+
+
+@pytest.mark.parametrize("failing", ["_get_cache_key", "_download_with_progress"])
+def test_a_failed_download_leaves_no_placeholder(download_dir, monkeypatch, failing):
+    async def _fail(*args, **kwargs):
+        raise ConnectionError("connection reset")
+
+    async def _no_key(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(DirectDownloader, "_get_cache_key", _no_key)
+    monkeypatch.setattr(DirectDownloader, failing, _fail)
+    state = new_state()
+    result = asyncio.run(DirectDownloader().download_from_url("https://example.com/a.mp4", 7, None, state))
+    assert result is None
+    assert "connection reset" in state['error']
+    assert os.listdir(download_dir) == []
+
+
+def test_a_finished_download_is_kept(download_dir, monkeypatch):
+    async def _no_key(*args, **kwargs):
+        return None
+
+    async def _download(self, url, file_path, *args, **kwargs):
+        with open(file_path, 'wb') as f:
+            f.write(b"video")
+        return True
+
+    monkeypatch.setattr(DirectDownloader, "_get_cache_key", _no_key)
+    monkeypatch.setattr(DirectDownloader, "_download_with_progress", _download)
+    # A file of the same name is already queued
+    (download_dir / "a.mp4").write_bytes(b"older")
+    result = asyncio.run(DirectDownloader().download_from_url("https://example.com/a.mp4", 7, None, new_state()))
+    assert result == str(download_dir / "a_1.mp4")
+    assert sorted(os.listdir(download_dir)) == ["a.mp4", "a_1.mp4"]
@@ -0,0 +1,130 @@
+import asyncio
+
+from helpers import executor as executor_module
+from helpers.executor import JobExecutor, reply_error
+
+
+def test_each_class_of_work_has_its_own_limit():
+    jobs = JobExecutor({'download': 2, 'merge': 1})
+    peak = {'download': 0, 'merge': 0}
+
+    async def work(kind, gate):
+        async with jobs.slot(kind):
+            peak[kind] = max(peak[kind], jobs.running[kind])
+            await gate.wait()
+
+    async def scenario():
+        gate = asyncio.Event()
+        tasks = [asyncio.create_task(work(kind, gate)) for kind in ['download'] * 3 + ['merge'] * 2]
+        await asyncio.sleep(0.01)
+        during = jobs.stats()
+        gate.set()
+        await asyncio.gather(*tasks)
+        return during, jobs.stats()
+
+    during, after = asyncio.run(scenario())
+    assert during == {'download': {'running': 2, 'waiting': 1, 'limit': 2},
+                      'merge': {'running': 1, 'waiting': 1, 'limit': 1}}
+    assert after == {'download': {'running': 0, 'waiting': 0, 'limit': 2},
+                     'merge': {'running': 0, 'waiting': 0, 'limit': 1}}
+    assert peak == {'download': 2, 'merge': 1}
+
+
+def test_waiting_for_a_slot_is_shown_on_the_status_message(monkeypatch):
+    jobs = JobExecutor({'merge': 1})
+    shown = []
+
+    async def _edit_status(message, text):
+        shown.append((message, text))
+    monkeypatch.setattr(executor_module, "edit_status", _edit_status)
+
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def first():
+            async with jobs.slot('merge', "status 1"):
+                await gate.wait()
+
+        async def second():
+            async with jobs.slot('merge', "status 2"):
+                pass
+
+        tasks = [asyncio.create_task(first())]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(second()))
+        await asyncio.sleep(0.01)
+        gate.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert shown == [("status 2", "⏳ **Waiting for a free merge slot...** (1 waiting)")]
+
+
+def test_a_cancelled_waiter_gives_up_its_place():
+    jobs = JobExecutor({'merge': 1})
+
+    async def wait_for_slot():
+        async with jobs.slot('merge'):
+            pass
+
+    async def scenario():
+        async with jobs.slot('merge'):
+            waiter = asyncio.create_task(wait_for_slot())
+            await asyncio.sleep(0)
+            assert jobs.waiting['merge'] == 1
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+        async with jobs.slot('merge'):
+            return jobs.stats()['merge']
+
+    assert asyncio.run(scenario()) == {'running': 1, 'waiting': 0, 'limit': 1}
+
+
+def test_submitted_failures_reach_on_error():
+    jobs = JobExecutor({})
+    errors = []
+
+    async def fail():
+        raise ValueError("no space left")
+
+    async def on_error(e):
+        errors.append(str(e))
+
+    async def scenario():
+        await jobs.submit(fail(), on_error=on_error)
+        return len(jobs._tasks)
+
+    assert asyncio.run(scenario()) == 0
+    assert errors == ["no space left"]
+
+
+def test_shutdown_cancels_running_jobs():
+    jobs = JobExecutor({})
+    cancelled = []
+
+    async def forever():
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def scenario():
+        jobs.submit(forever())
+        jobs.submit(forever())
+        await asyncio.sleep(0)
+        await jobs.shutdown()
+
+    asyncio.run(scenario())
+    assert cancelled == [True, True]
+
+
+def test_reply_error_answers_the_message():
+    replies = []
+
+    class FakeMessage:
+        async def reply_text(self, text):
+            replies.append(text)
+
+    asyncio.run(reply_error(FakeMessage())(RuntimeError("boom")))
+    assert replies == ["❌ **Error:** `boom`"]
@@ -0,0 +1,118 @@
+import os
+import asyncio
+
+import pytest
+
+from configs import Config
+from helpers.fanout import FanOutReader, read_chunks
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "merged.mp4"
+    path.write_bytes(os.urandom(10 * 1024 + 123))
+    return path
+
+
+async def consume(sink, fail_after: int = None, delay: float = 0):
+    received = b""
+    async for chunk in sink:
+        received += chunk
+        if fail_after is not None and len(received) >= fail_after:
+            # What an upload does when its destination errors out
+            sink.close()
+            raise ConnectionError("upload failed")
+        if delay:
+            await asyncio.sleep(delay)
+    return received
+
+
+def test_every_sink_gets_the_whole_file(video):
+    async def scenario():
+        reader = FanOutReader(str(video), chunk_size=1024, max_lag=2)
+        sinks = [reader.attach() for _ in range(3)]
+        results = await asyncio.gather(reader.run(), *(consume(sink) for sink in sinks))
+        return results
+
+    total, *received = asyncio.run(scenario())
+    assert total == video.stat().st_size
+    assert received == [video.read_bytes()] * 3
+
+
+def test_a_failing_sink_does_not_stall_the_others(video):
+    async def scenario():
+        reader = FanOutReader(str(video), chunk_size=1024, max_lag=1)
+        healthy, failing = reader.attach(), reader.attach()
+        return await asyncio.wait_for(
+            asyncio.gather(reader.run(), consume(healthy), consume(failing, fail_after=2048),
+                           return_exceptions=True),
+            timeout=5
+        )
+
+    total, received, error = asyncio.run(scenario())
+    assert total == video.stat().st_size
+    assert received == video.read_bytes()
+    assert isinstance(error, ConnectionError)
+
+
+def test_reading_stops_once_every_sink_failed(video):
+    async def scenario():
+        reader = FanOutReader(str(video), chunk_size=1024, max_lag=1)
+        sinks = [reader.attach() for _ in range(2)]
+        return await asyncio.wait_for(
+            asyncio.gather(reader.run(), *(consume(sink, fail_after=1024) for sink in sinks),
+                           return_exceptions=True),
+            timeout=5
+        )
+
+    total, *errors = asyncio.run(scenario())
+    assert total < video.stat().st_size
+    assert all(isinstance(error, ConnectionError) for error in errors)
+
+
+def test_a_slow_sink_is_detached_and_reads_the_rest_itself(video, monkeypatch):
+    monkeypatch.setattr(Config, "FANOUT_LAG_TIMEOUT", 0.01)
+
+    async def scenario():
+        reader = FanOutReader(str(video), chunk_size=1024, max_lag=1)
+        fast, slow = reader.attach(), reader.attach()
+        results = await asyncio.gather(reader.run(), consume(fast), consume(slow, delay=0.05))
+        return results, slow.detached
+
+    (total, fast, slow), detached = asyncio.run(scenario())
+    assert detached
+    assert fast == slow == video.read_bytes()
+
+
+def test_a_read_error_reaches_every_sink(video, monkeypatch):
+    async def scenario():
+        reader = FanOutReader(str(video), chunk_size=1024, max_lag=4)
+        sinks = [reader.attach() for _ in range(2)]
+        reads = 0
+        real_to_thread = asyncio.to_thread
+
+        async def _failing_read(func, *args):
+            nonlocal reads
+            reads += 1
+            if reads == 3:
+                raise OSError("disk gone")
+            return await real_to_thread(func, *args)
+
+        monkeypatch.setattr("helpers.fanout.asyncio.to_thread", _failing_read)
+        return await asyncio.wait_for(
+            asyncio.gather(reader.run(), *(consume(sink) for sink in sinks), return_exceptions=True),
+            timeout=5
+        )
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, OSError) for result in results)
+    assert "disk gone" in str(results[1])
+
+
+def test_read_chunks_covers_the_file(video):
+    async def scenario():
+        return [chunk async for chunk in read_chunks(str(video), 4096)]
+
+    chunks = asyncio.run(scenario())
+    assert [len(chunk) for chunk in chunks] == [4096, 4096, 2171]
+    assert b"".join(chunks) == video.read_bytes()
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+from pyrogram.enums import ChatMemberStatus
+from pyrogram.errors import UserNotParticipant
+
+from configs import Config
+from helpers import forcesub
+from helpers.forcesub import _membership_status, invalidate_membership, MEMBER, LEFT, BANNED
+
+
+class FakeMember:
+    def __init__(self, status):
+        self.status = status
+
+
+class FakeBot:
+    def __init__(self):
+        # user_id -> ChatMemberStatus, or None for someone who never joined
+        self.statuses = {}
+        self.lookups = 0
+
+    async def get_chat_member(self, chat_id, user_id):
+        self.lookups += 1
+        status = self.statuses.get(user_id)
+        if status is None:
+            raise UserNotParticipant()
+        return FakeMember(status)
+
+
+@pytest.fixture
+def bot(fake_clock, monkeypatch):
+    monkeypatch.setattr("helpers.forcesub.time.monotonic", fake_clock)
+    monkeypatch.setattr(forcesub, "_membership", forcesub.OrderedDict())
+    monkeypatch.setattr(Config, "FORCESUB_CACHE_TTL", 600)
+    monkeypatch.setattr(Config, "FORCESUB_NEGATIVE_TTL", 30)
+    monkeypatch.setattr(Config, "FORCESUB_CACHE_SIZE", 100)
+    return FakeBot()
+
+
+def status(bot, user_id):
+    return asyncio.run(_membership_status(bot, user_id))
+
+
+def test_members_are_looked_up_once_per_ttl(bot, fake_clock):
+    bot.statuses[1] = ChatMemberStatus.MEMBER
+    assert [status(bot, 1) for _ in range(3)] == [MEMBER] * 3
+    assert bot.lookups == 1
+
+    fake_clock.now += 599
+    status(bot, 1)
+    assert bot.lookups == 1
+    fake_clock.now += 1
+    status(bot, 1)
+    assert bot.lookups == 2
+
+
+def test_non_members_are_checked_again_sooner(bot, fake_clock):
+    assert status(bot, 1) == LEFT
+    bot.statuses[1] = ChatMemberStatus.MEMBER
+    fake_clock.now += 29
+    assert status(bot, 1) == LEFT
+    fake_clock.now += 1
+    assert status(bot, 1) == MEMBER
+    assert bot.lookups == 2
+
+
+def test_statuses_map_to_member_left_and_banned(bot):
+    bot.statuses.update({1: ChatMemberStatus.ADMINISTRATOR, 2: ChatMemberStatus.LEFT, 3: ChatMemberStatus.BANNED})
+    assert [status(bot, user_id) for user_id in (1, 2, 3, 4)] == [MEMBER, LEFT, BANNED, LEFT]
+
+
+def test_invalidation_forces_a_fresh_lookup(bot):
+    assert status(bot, 1) == LEFT
+    bot.statuses[1] = ChatMemberStatus.MEMBER
+    invalidate_membership(1)
+    assert status(bot, 1) == MEMBER
+    assert bot.lookups == 2
+    # Forgetting someone who was never cached is harmless
+    invalidate_membership(2)
+
+
+def test_the_cache_keeps_the_most_recently_used_users(bot, monkeypatch):
+    monkeypatch.setattr(Config, "FORCESUB_CACHE_SIZE", 2)
+    for user_id in (1, 2):
+        bot.statuses[user_id] = ChatMemberStatus.MEMBER
+        status(bot, user_id)
+    status(bot, 1)
+    status(bot, 3)
+    assert list(forcesub._membership) == [1, 3]
+    status(bot, 2)
+    assert bot.lookups == 4
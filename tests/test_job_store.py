@@ -0,0 +1,217 @@
+import os
+import asyncio
+
+import pytest
+
+from configs import Config
+from helpers import job_store as job_store_module
+from helpers.job_store import JobStore, _SQLiteBackend, PENDING, QUEUED, RUNNING, DONE, FAILED
+from helpers.sessions import SessionRegistry
+
+
+@pytest.fixture
+def volume(tmp_path, monkeypatch):
+    path = tmp_path / "downloads"
+    path.mkdir()
+    monkeypatch.setattr(job_store_module, "volumes", lambda: [str(path)])
+    monkeypatch.setattr(job_store_module, "sessions", SessionRegistry(0, 10, 100))
+    return path
+
+
+def new_store(tmp_path):
+    return JobStore(_SQLiteBackend(str(tmp_path / "jobs.db")))
+
+
+def write_file(path, content=b"video"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_queue_survives_restart_and_orphans_are_removed(tmp_path, volume):
+    kept = str(volume / "7" / "a.mp4")
+    gone = str(volume / "7" / "b.mp4")
+
+    async def first_run():
+        store = new_store(tmp_path)
+        await store.open()
+        write_file(volume / "7" / "a.mp4")
+        write_file(volume / "7" / "b.mp4")
+        store.add_to_queue(7, kept, reply_id=11)
+        store.add_to_queue(7, gone, reply_id=12)
+        await store.close()
+
+    async def second_run():
+        store = new_store(tmp_path)
+        await store.open()
+        try:
+            return store.queue(7), store.reply_ids(7)
+        finally:
+            await store.close()
+
+    asyncio.run(first_run())
+    os.remove(gone)
+    orphan = write_file(volume / "7" / "leftover.mp4")
+    job_store_module.sessions._sessions.clear()
+
+    queue, reply_ids = asyncio.run(second_run())
+    assert queue == [kept]
+    assert reply_ids == [11]
+    assert os.path.exists(kept)
+    assert not os.path.exists(orphan)
+
+
+def test_restart_fails_jobs_that_were_running_in_process(tmp_path, volume):
+    async def first_run():
+        store = new_store(tmp_path)
+        await store.open()
+        job = store.create_job(7, "merge", files=[])
+        store.update_job(job['id'], state=RUNNING)
+        await store.close()
+        return job['id']
+
+    async def second_run():
+        store = new_store(tmp_path)
+        interrupted = await store.open()
+        await store.close()
+        return interrupted
+
+    job_id = asyncio.run(first_run())
+    interrupted = asyncio.run(second_run())
+    assert [job['id'] for job in interrupted] == [job_id]
+    assert interrupted[0]['state'] == FAILED
+
+
+def test_restart_keeps_a_merged_output_for_its_upload(tmp_path, volume):
+    work_dir = volume / "7" / "merge_abc"
+
+    async def first_run():
+        store = new_store(tmp_path)
+        await store.open()
+        uploading = store.create_job(7, "merge", files=[])
+        merging = store.create_job(7, "merge", files=[])
+        output = write_file(work_dir / "merged.mp4")
+        write_file(work_dir / "merged.mp4.tgupload", b"{}")
+        write_file(volume / "7" / f"merge_{merging['id']}" / "partial.mp4")
+        store.update_job(uploading['id'], state=RUNNING, output=output)
+        store.update_job(merging['id'], state=RUNNING)
+        await store.close()
+        return uploading['id'], merging['id']
+
+    async def second_run():
+        store = new_store(tmp_path)
+        interrupted = await store.open()
+        try:
+            return interrupted, store.resumable_jobs(), store.resumable_jobs()
+        finally:
+            await store.close()
+
+    uploading_id, merging_id = asyncio.run(first_run())
+    interrupted, resumable, again = asyncio.run(second_run())
+    assert [job['id'] for job in resumable] == [uploading_id]
+    assert again == []
+    assert [job['id'] for job in interrupted] == [merging_id]
+    assert (work_dir / "merged.mp4").exists()
+    assert (work_dir / "merged.mp4.tgupload").exists()
+    assert not (volume / "7" / f"merge_{merging_id}").exists()
+
+
+def test_workers_only_claim_submitted_jobs_once(tmp_path, volume):
+    async def scenario():
+        store = new_store(tmp_path)
+        worker_side = _SQLiteBackend(str(tmp_path / "jobs.db"))
+        await store.open()
+        try:
+            job = store.create_job(7, "merge", files=[])
+            # Written behind by the flush loop while the bot is still preparing the job
+            await store.flush()
+            assert job['state'] == PENDING
+            assert await worker_side.claim("merge", "a") is None
+
+            await store.submit(job['id'])
+            claimed = await worker_side.claim("merge", "a")
+            assert claimed['id'] == job['id']
+
+            # Later flushes must not hand the claimed job out again
+            store.update_job(job['id'], state=QUEUED)
+            await store.flush()
+            assert await worker_side.claim("merge", "b") is None
+        finally:
+            await worker_side.close()
+            await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_claim_takes_the_oldest_job(tmp_path, volume):
+    async def scenario():
+        store = new_store(tmp_path)
+        await store.open()
+        try:
+            first = store.create_job(1, "merge", files=[])
+            second = store.create_job(2, "merge", files=[])
+            await store.submit(second['id'])
+            await store.submit(first['id'])
+            assert (await store.claim("merge", "a"))['id'] == first['id']
+            assert (await store.claim("merge", "a"))['id'] == second['id']
+            assert await store.claim("merge", "a") is None
+        finally:
+            await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_a_stale_worker_cannot_touch_a_requeued_job(tmp_path, volume, monkeypatch):
+    # Every running job has missed its heartbeat
+    monkeypatch.setattr(Config, "WORKER_LEASE_TIMEOUT", -1)
+
+    async def scenario():
+        store = new_store(tmp_path)
+        await store.open()
+        try:
+            job = store.create_job(7, "merge", files=[])
+            await store.submit(job['id'])
+            stale = await store.claim("merge", "host")
+            assert await store.refresh() == []
+            # Workers on one host share a name, only the claim tells them apart
+            fresh = await store.claim("merge", "host")
+            assert fresh['id'] == job['id']
+
+            assert not await store.heartbeat(stale)
+            assert not await store.complete(stale, FAILED, "merged twice")
+            assert await store.heartbeat(fresh)
+            assert await store.complete(fresh, DONE)
+
+            finished = await store.refresh()
+            assert [(job['state'], job['error']) for job in finished] == [(DONE, None)]
+        finally:
+            await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_one_backend_serves_concurrent_calls(tmp_path, volume):
+    backend = _SQLiteBackend(str(tmp_path / "jobs.db"))
+    now = 1000.0
+    jobs = [dict(id=f"job{i}", user_id=i, kind="merge", state=QUEUED, payload={'files': []},
+                 error=None, created_at=now + i, updated_at=now + i) for i in range(40)]
+
+    async def scenario():
+        await backend.load()
+        await backend.apply({}, jobs)
+        try:
+            results = await asyncio.gather(
+                *(backend.claim("merge", "host") for _ in jobs),
+                *(backend.update(job['id'], {'error': "seen"}, {}) for job in jobs),
+                *(backend.apply({user_id: [{'file_path': f"{user_id}.mp4", 'reply_id': None, 'added_at': now}]}, [])
+                  for user_id in range(40))
+            )
+            return results[:len(jobs)], await backend.get_jobs([job['id'] for job in jobs]), await backend.load()
+        finally:
+            await backend.close()
+
+    claimed, stored, (queues, _) = asyncio.run(scenario())
+    assert sorted(job['id'] for job in claimed) == sorted(job['id'] for job in jobs)
+    assert all(job['state'] == RUNNING and job['error'] == "seen" for job in stored)
+    assert {user_id: [item['file_path'] for item in items] for user_id, items in queues.items()} == \
+        {user_id: [f"{user_id}.mp4"] for user_id in range(40)}
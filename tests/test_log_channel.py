@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+from pyrogram.errors import FloodWait
+
+from helpers import log_channel
+from helpers.log_channel import LogChannelSink
+
+
+class FakeBot:
+    def __init__(self):
+        self.messages = []
+        self.documents = []
+        # Raised by the next send, then cleared
+        self.error = None
+
+    def _maybe_fail(self):
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self._maybe_fail()
+        self.messages.append(text)
+
+    async def send_document(self, chat_id, document, caption=None, **kwargs):
+        self._maybe_fail()
+        self.documents.append((document.getvalue().decode(), caption))
+
+
+@pytest.fixture
+def sink():
+    sink = LogChannelSink("-100123", max_events=3, interval=60)
+    sink.bot = FakeBot()
+    return sink
+
+
+def test_events_are_sent_as_one_digest(sink):
+    sink.event("NEW_USER", "alice")
+    sink.event("MERGE", "bob merged 3 files")
+    sink.event("NEW_USER", "carol")
+    asyncio.run(sink.flush())
+
+    assert len(sink.bot.messages) == 1
+    digest = sink.bot.messages[0]
+    assert digest.startswith("#DIGEST #NEW_USER ×2 #MERGE ×1")
+    assert [line.split("` ", 1)[1] for line in digest.split("\n\n", 1)[1].split("\n")] == [
+        "#NEW_USER alice", "#MERGE bob merged 3 files", "#NEW_USER carol"
+    ]
+    asyncio.run(sink.flush())
+    assert len(sink.bot.messages) == 1
+
+
+def test_a_full_batch_wakes_the_flusher(sink):
+    async def scenario():
+        sink._wakeup = asyncio.Event()
+        sink.event("MERGE", "one")
+        sink.event("MERGE", "two")
+        woken_early = sink._wakeup.is_set()
+        sink.event("MERGE", "three")
+        return woken_early, sink._wakeup.is_set()
+
+    assert asyncio.run(scenario()) == (False, True)
+
+
+def test_a_long_digest_is_sent_as_a_document(sink, monkeypatch):
+    monkeypatch.setattr(log_channel, "MAX_MESSAGE_LENGTH", 50)
+    sink.event("MERGE", "x" * 60)
+    asyncio.run(sink.flush())
+    assert sink.bot.messages == []
+    (content, caption), = sink.bot.documents
+    assert caption == "#DIGEST #MERGE ×1"
+    assert content.endswith("#MERGE " + "x" * 60)
+
+
+def test_overflow_drops_the_oldest_events(sink, monkeypatch):
+    monkeypatch.setattr(log_channel, "MAX_BUFFERED_EVENTS", 3)
+    for i in range(5):
+        sink.event("MERGE", f"event {i}")
+    assert [text for _, _, text in sink._events] == ["event 2", "event 3", "event 4"]
+    assert sink.dropped == 2
+
+
+def test_a_failed_send_keeps_the_events_in_order(sink, monkeypatch):
+    monkeypatch.setattr(log_channel, "MAX_BUFFERED_EVENTS", 3)
+
+    async def scenario():
+        sink.event("MERGE", "a")
+        sink.event("MERGE", "b")
+
+        async def _fail(*args, **kwargs):
+            # Another event arrives while the send is in flight
+            sink.event("MERGE", "c")
+            sink.event("MERGE", "d")
+            raise ConnectionError("network down")
+        sink.bot.send_message = _fail
+        with pytest.raises(ConnectionError):
+            await sink.flush()
+
+    asyncio.run(scenario())
+    assert [text for _, _, text in sink._events] == ["b", "c", "d"]
+    assert sink.dropped == 1
+
+
+def test_floodwait_postpones_the_digest(sink, monkeypatch, fake_clock):
+    monkeypatch.setattr(log_channel.time, "time", fake_clock)
+    sink.event("MERGE", "a")
+    sink.bot.error = FloodWait(30)
+    asyncio.run(sink.flush())
+    assert sink.bot.messages == []
+    assert len(sink._events) == 1
+
+    sink.event("MERGE", "b")
+    fake_clock.now += 10
+    asyncio.run(sink.flush())
+    assert sink.bot.messages == []
+
+    fake_clock.now += 25
+    asyncio.run(sink.flush())
+    assert len(sink.bot.messages) == 1
+    assert "#MERGE ×2" in sink.bot.messages[0]
+    assert sink.dropped == 0
@@ -0,0 +1,59 @@
+import pytest
+
+from helpers import rate_limit
+from helpers.rate_limit import RateLimiter, COSTS, retry_seconds
+from helpers.sessions import SessionRegistry
+
+
+@pytest.fixture
+def clock(fake_clock, monkeypatch):
+    monkeypatch.setattr("helpers.bandwidth.time.monotonic", fake_clock)
+    monkeypatch.setattr(rate_limit, "sessions", SessionRegistry(0, 10, 100))
+    return fake_clock
+
+
+def test_commands_are_limited_after_the_burst(clock):
+    limiter = RateLimiter(rate=1.0, burst=3)
+    assert [limiter.check(1)[0] for _ in range(3)] == [True, True, True]
+    allowed, wait = limiter.check(1)
+    assert not allowed
+    assert wait == pytest.approx(1.0)
+    assert limiter.stats() == {'allowed': 3, 'limited': 1}
+
+
+def test_buckets_refill_over_time(clock):
+    limiter = RateLimiter(rate=2.0, burst=2)
+    limiter.check(1)
+    limiter.check(1)
+    assert not limiter.check(1)[0]
+    clock.now += 0.5
+    assert limiter.check(1)[0]
+
+
+def test_actions_cost_different_amounts(clock):
+    limiter = RateLimiter(rate=1.0, burst=COSTS['merge'] + COSTS['download'])
+    assert limiter.check(1, 'merge')[0]
+    assert limiter.check(1, 'download')[0]
+    allowed, wait = limiter.check(1, 'download')
+    assert not allowed
+    assert wait == pytest.approx(COSTS['download'])
+
+
+def test_a_cost_above_the_burst_is_capped(clock):
+    limiter = RateLimiter(rate=1.0, burst=2)
+    assert limiter.check(1, 'merge')[0]
+    assert not limiter.check(1, 'command')[0]
+
+
+def test_users_have_separate_buckets(clock):
+    limiter = RateLimiter(rate=1.0, burst=1)
+    assert limiter.check(1)[0]
+    assert not limiter.check(1)[0]
+    assert limiter.check(2)[0]
+    assert rate_limit.sessions.peek(1).bucket is not rate_limit.sessions.peek(2).bucket
+
+
+def test_retry_seconds_never_rounds_down_to_zero():
+    assert retry_seconds(0.01) == 1
+    assert retry_seconds(1.2) == 2
+    assert retry_seconds(3) == 3
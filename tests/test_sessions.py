@@ -0,0 +1,78 @@
+import asyncio
+
+from helpers import rate_limit
+from helpers.rate_limit import RateLimiter
+from helpers.sessions import SessionRegistry, QueueEntry
+
+
+def queue_file(registry, user_id):
+    registry.get(user_id).queue.append(QueueEntry(f"/nowhere/{user_id}.mp4"))
+
+
+def test_a_new_user_makes_room_by_dropping_the_coldest_empty_session():
+    registry = SessionRegistry(0, 10, 3)
+    queue_file(registry, 1)
+    registry.get(2)
+    registry.get(3)
+    registry.get(2)
+
+    assert registry.admit(4) is registry.peek(4)
+    assert registry.peek(3) is None
+    assert [session.user_id for session in registry.queued()] == [1]
+    assert registry.stats()['sessions'] == 3
+    assert registry.dropped == 1
+
+
+def test_a_registry_full_of_queues_refuses_new_users():
+    registry = SessionRegistry(0, 10, 2)
+    queue_file(registry, 1)
+    queue_file(registry, 2)
+
+    assert registry.admit(3) is None
+    assert registry.peek(3) is None
+    assert registry.stats()['sessions'] == 2
+    assert registry.refused == 1
+    # Users already in keep their sessions
+    assert registry.admit(1) is registry.peek(1)
+
+    registry.peek(2).queue.clear()
+    assert registry.admit(3) is not None
+    assert registry.peek(2) is None
+
+
+def test_the_rate_limiter_turns_away_users_the_registry_refuses(monkeypatch):
+    registry = SessionRegistry(0, 10, 1)
+    monkeypatch.setattr(rate_limit, "sessions", registry)
+    limiter = RateLimiter(rate=1.0, burst=5)
+    assert limiter.check(1)[0]
+    queue_file(registry, 1)
+
+    allowed, wait = limiter.check(2)
+    assert not allowed
+    assert wait > 0
+    assert limiter.stats() == {'allowed': 1, 'limited': 1}
+
+
+def test_the_sweep_drops_idle_empty_sessions_and_keeps_queues(fake_clock, monkeypatch):
+    monkeypatch.setattr("helpers.sessions.time.monotonic", fake_clock)
+    registry = SessionRegistry(idle_timeout=100, empty_timeout=10, max_sessions=10)
+    expired = []
+
+    async def on_expire(user_id):
+        expired.append(user_id)
+        registry.peek(user_id).queue.clear()
+        return True
+    registry.on_expire = on_expire
+
+    queue_file(registry, 1)
+    registry.get(2)
+    fake_clock.now += 20
+    registry.get(3)
+    asyncio.run(registry.sweep())
+    assert [user_id for user_id in (1, 2, 3) if registry.peek(user_id)] == [1, 3]
+
+    fake_clock.now += 100
+    asyncio.run(registry.sweep())
+    assert expired == [1]
+    assert registry.peek(1) is None
+    assert registry.stats()['expired'] == 1
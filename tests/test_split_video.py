@@ -0,0 +1,80 @@
+import os
+import asyncio
+
+import pytest
+
+from configs import Config
+from helpers import merger
+from helpers.merger import split_video
+
+
+class FakeFFmpeg:
+    """Writes the segments one scripted attempt asks for, recording the segment_time it was given"""
+
+    def __init__(self, attempts):
+        self.attempts = list(attempts)
+        self.segment_times = []
+
+    async def __call__(self, *cmd, **kwargs):
+        self.segment_times.append(float(cmd[cmd.index('-segment_time') + 1]))
+        pattern = cmd[-1]
+        sizes = self.attempts.pop(0)
+        for i, size in enumerate(sizes or []):
+            with open(pattern % i, 'wb') as part:
+                part.write(b"\0" * size)
+        return FakeProcess(0 if sizes is not None else 1)
+
+
+class FakeProcess:
+    def __init__(self, returncode):
+        self.returncode = returncode
+
+    async def communicate(self):
+        return b"", b"" if self.returncode == 0 else b"Invalid data found"
+
+
+@pytest.fixture
+def video(tmp_path, monkeypatch):
+    path = tmp_path / "merged.mp4"
+    path.write_bytes(b"\0" * 1000)
+
+    async def _duration(video_path):
+        return 100.0
+    monkeypatch.setattr(merger, "get_video_duration", _duration)
+    monkeypatch.setattr(Config, "MAX_RETRY_ATTEMPTS", 3)
+    return path
+
+
+def split(video, ffmpeg, monkeypatch, max_part_size=400):
+    monkeypatch.setattr(merger.asyncio, "create_subprocess_exec", ffmpeg)
+    return asyncio.run(split_video(str(video), max_part_size))
+
+
+def test_parts_under_the_limit_are_named_in_order(video, monkeypatch):
+    ffmpeg = FakeFFmpeg([[390, 380, 230]])
+    parts = split(video, ffmpeg, monkeypatch)
+    assert [os.path.basename(part) for part in parts] == ["merged.part01.mp4", "merged.part02.mp4", "merged.part03.mp4"]
+    assert [os.path.getsize(part) for part in parts] == [390, 380, 230]
+    # 90% of the limit's share of the duration
+    assert ffmpeg.segment_times == [pytest.approx(36.0)]
+
+
+def test_an_oversize_part_retries_with_shorter_segments(video, monkeypatch):
+    ffmpeg = FakeFFmpeg([[450, 550], [300, 300, 300, 100]])
+    parts = split(video, ffmpeg, monkeypatch)
+    assert [os.path.getsize(part) for part in parts] == [300, 300, 300, 100]
+    assert ffmpeg.segment_times == [pytest.approx(36.0), pytest.approx(27.0)]
+    # Nothing of the first attempt is left next to the parts
+    assert sorted(os.listdir(os.path.dirname(parts[0]))) == [os.path.basename(part) for part in parts]
+
+
+def test_splitting_gives_up_after_the_retry_limit(video, monkeypatch):
+    ffmpeg = FakeFFmpeg([[500, 500]] * 3)
+    assert split(video, ffmpeg, monkeypatch) == []
+    assert len(ffmpeg.segment_times) == 3
+
+
+def test_an_ffmpeg_failure_is_not_retried(video, monkeypatch):
+    ffmpeg = FakeFFmpeg([None, [300, 300]])
+    assert split(video, ffmpeg, monkeypatch) == []
+    assert len(ffmpeg.segment_times) == 1
@@ -0,0 +1,164 @@
+import time
+import asyncio
+
+import pytest
+
+from helpers import storage
+from helpers import job_store as job_store_module
+from helpers.job_store import JobStore, _SQLiteBackend
+from helpers.sessions import SessionRegistry
+from helpers.storage import StorageManager, StorageFull
+from helpers.tiers import StorageTier
+from helpers.user_jobs import UserJobs
+
+
+class FakeCleanup:
+    def __init__(self):
+        self.cleaned = []
+        # Awaited with the user id in place of removing their directory
+        self.during = None
+
+    async def clean_user_directory(self, user_id: int, keep_recent: bool = False) -> bool:
+        self.cleaned.append(user_id)
+        if self.during is not None:
+            await self.during(user_id)
+        return True
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_store_module, "volumes", lambda: [str(tmp_path / "downloads")])
+    monkeypatch.setattr(job_store_module, "sessions", SessionRegistry(0, 10, 100))
+    monkeypatch.setattr(storage, "free_bytes", lambda path: 1 << 40)
+    store = JobStore(_SQLiteBackend(str(tmp_path / "jobs.db")))
+    jobs = UserJobs()
+    cleanup = FakeCleanup()
+    monkeypatch.setattr(storage, "job_store", store)
+    monkeypatch.setattr(storage, "user_jobs", jobs)
+    monkeypatch.setattr(storage, "cleanup_manager", cleanup)
+    return store, jobs, cleanup, StorageManager(user_quota=0, evict_idle=60)
+
+
+def add_idle(store, user_id, idle):
+    store.add_to_queue(user_id, f"/nowhere/{user_id}.mp4")
+    job_store_module.sessions.peek(user_id).queue[-1].added_at = time.time() - idle
+
+
+def run(store, scenario):
+    async def _run():
+        await store.open()
+        try:
+            return await scenario()
+        finally:
+            await store.close()
+    return asyncio.run(_run())
+
+
+def test_candidates_are_idle_queues_oldest_first(env):
+    store, jobs, cleanup, manager = env
+
+    async def scenario():
+        add_idle(store, 1, 3600)
+        add_idle(store, 2, 7200)
+        add_idle(store, 3, 10)      # added to recently
+        add_idle(store, 4, 7200)    # merging
+        add_idle(store, 5, 7200)    # downloading
+        add_idle(store, 6, 7200)    # the user asking for space
+        jobs.begin_merge(4)
+        await jobs.hold(4)
+        with await manager.reserve(5, 0):
+            return manager._eviction_candidates(exclude=6)
+
+    assert run(store, scenario) == [2, 1]
+
+
+def test_eviction_skips_a_user_who_became_busy_meanwhile(env):
+    store, jobs, cleanup, manager = env
+
+    async def scenario():
+        add_idle(store, 1, 7200)
+        add_idle(store, 2, 3600)
+        add_idle(store, 3, 1800)
+
+        async def during(user_id):
+            if user_id == 1:
+                # While the first directory is removed, user 2 starts a merge and user 3 a download
+                jobs.begin_merge(2)
+                await jobs.hold(2)
+                await manager.reserve(3, 0)
+        cleanup.during = during
+
+        evicted = await manager.evict(1 << 40)
+        return evicted, store.queue(1), store.queue(2), store.queue(3)
+
+    evicted, first, second, third = run(store, scenario)
+    assert evicted == [1]
+    assert cleanup.cleaned == [1]
+    assert first == []
+    assert second == ["/nowhere/2.mp4"]
+    assert third == ["/nowhere/3.mp4"]
+
+
+def test_a_reservation_waits_for_its_users_eviction(env):
+    store, jobs, cleanup, manager = env
+
+    async def scenario():
+        add_idle(store, 1, 7200)
+        waiting = []
+
+        async def during(user_id):
+            # The user comes back with a download while their directory is being removed
+            waiting.append(asyncio.create_task(manager.reserve(1, 0)))
+            await asyncio.sleep(0.01)
+            waiting.append(waiting[0].done())
+        cleanup.during = during
+
+        evicted = await manager.evict(1 << 40)
+        (await waiting[0]).release()
+        return evicted, waiting[1]
+
+    assert run(store, scenario) == ([1], False)
+
+
+def test_reservations_fill_scratch_first_and_count_per_volume(env, monkeypatch):
+    store, jobs, cleanup, manager = env
+    free = {"/scratch": 1000, "/bulk-a": 5000, "/bulk-b": 8000}
+    monkeypatch.setattr(storage, "free_bytes", lambda path: free[path])
+    fast = StorageTier("scratch", ["/scratch"], headroom=100)
+    slow = StorageTier("bulk", ["/bulk-a", "/bulk-b"])
+
+    async def scenario():
+        first = await manager.reserve(1, 800, tiers=(fast, slow))
+        # Scratch has 100 left after the first merge and its headroom
+        second = await manager.reserve(2, 800, tiers=(fast, slow))
+        third = await manager.reserve(3, 7000, tiers=(fast, slow))
+        # The second and third fill /bulk-b even though its disk still reports 8000 free
+        fourth = await manager.reserve(4, 1000, tiers=(fast, slow))
+        reservations = (first, second, third, fourth)
+        placed = [reservation.volume for reservation in reservations]
+        left = manager.available(slow, "/bulk-b")
+        for reservation in reservations:
+            reservation.release()
+        return placed, left
+
+    placed, left = run(store, scenario)
+    assert placed == ["/scratch", "/bulk-b", "/bulk-b", "/bulk-a"]
+    assert left == 8000 - 800 - 7000
+    assert manager.reserved == 0
+    assert not manager.has_reservations(1)
+    assert manager._volume_reserved == {}
+
+
+def test_a_reservation_over_the_user_quota_is_refused(env):
+    store, jobs, cleanup, manager = env
+    manager.user_quota = 1000
+
+    async def scenario():
+        with await manager.reserve(1, 600):
+            with pytest.raises(StorageFull):
+                await manager.reserve(1, 600)
+            # Merge outputs are not held against the quota
+            (await manager.reserve(1, 600, count_quota=False)).release()
+            (await manager.reserve(2, 600)).release()
+
+    run(store, scenario)
@@ -0,0 +1,113 @@
+import os
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from configs import Config
+from helpers import tg_downloader
+from helpers.tg_downloader import download_media_parallel, _split_ranges
+
+CHUNK = 16
+
+
+class FakeBot:
+    """Streams a byte string in CHUNK sized pieces, like stream_media with its 1 MiB chunks"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.streams = []
+        # (chunk offset, chunks into the stream) pairs that raise once
+        self.failures = set()
+        self.active = 0
+        self.peak = 0
+
+    async def stream_media(self, message, offset, limit):
+        self.streams.append((offset, limit))
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            for i in range(limit):
+                if (offset, i) in self.failures:
+                    self.failures.discard((offset, i))
+                    raise ConnectionError("connection reset")
+                start = (offset + i) * CHUNK
+                await asyncio.sleep(0)
+                yield self.data[start:start + CHUNK]
+        finally:
+            self.active -= 1
+
+
+@pytest.fixture
+def setup(tmp_path, monkeypatch):
+    async def _no_wait(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(tg_downloader, "STREAM_CHUNK_SIZE", CHUNK)
+    monkeypatch.setattr(tg_downloader.bandwidth, "throttle", _no_wait)
+    monkeypatch.setattr(Config, "TG_PARALLEL_THRESHOLD", 0)
+    monkeypatch.setattr(Config, "TG_DOWNLOAD_WORKERS", 4)
+    monkeypatch.setattr(Config, "TG_MAX_TRANSMISSIONS", 16)
+    data = os.urandom(CHUNK * 10 + 5)
+    message = SimpleNamespace(video=SimpleNamespace(file_size=len(data)), document=None,
+                              from_user=SimpleNamespace(id=7))
+    return FakeBot(data), message, str(tmp_path / "video.mp4")
+
+
+async def _ignore_progress(current, total):
+    pass
+
+
+def download(bot, message, file_path):
+    return asyncio.run(download_media_parallel(bot, message, file_path, None, progress=_ignore_progress))
+
+
+def test_ranges_cover_every_chunk_once():
+    assert _split_ranges(11, 4) == [(0, 3), (3, 3), (6, 3), (9, 2)]
+    assert _split_ranges(2, 4) == [(0, 1), (1, 1)]
+    assert _split_ranges(1, 1) == [(0, 1)]
+
+
+def test_ranges_are_fetched_in_parallel_and_assembled_in_place(setup):
+    bot, message, file_path = setup
+    assert download(bot, message, file_path) == file_path
+    with open(file_path, 'rb') as f:
+        assert f.read() == bot.data
+    assert sorted(bot.streams) == [(0, 3), (3, 3), (6, 3), (9, 2)]
+    assert bot.peak == 4
+
+
+def test_a_file_never_takes_more_than_half_the_transmissions(setup, monkeypatch):
+    bot, message, file_path = setup
+    monkeypatch.setattr(Config, "TG_MAX_TRANSMISSIONS", 4)
+    assert download(bot, message, file_path) == file_path
+    assert len(bot.streams) == 2
+    assert bot.peak == 2
+
+
+def test_a_failed_range_resumes_from_its_missing_chunk(setup, monkeypatch):
+    bot, message, file_path = setup
+
+    async def _no_sleep(seconds):
+        pass
+
+    monkeypatch.setattr(tg_downloader.asyncio, "sleep", _no_sleep)
+    bot.failures.add((3, 2))
+    assert download(bot, message, file_path) == file_path
+    with open(file_path, 'rb') as f:
+        assert f.read() == bot.data
+    # Chunks 3 and 4 arrived before the failure, only 5 is fetched again
+    assert (5, 1) in bot.streams
+
+
+def test_a_range_that_keeps_failing_removes_the_file(setup, monkeypatch):
+    bot, message, file_path = setup
+
+    async def _no_sleep(seconds):
+        pass
+
+    monkeypatch.setattr(tg_downloader.asyncio, "sleep", _no_sleep)
+    monkeypatch.setattr(Config, "MAX_RETRY_ATTEMPTS", 1)
+    bot.failures.update({(0, 0), (0, 1)})
+    assert download(bot, message, file_path) is None
+    assert not os.path.exists(file_path)
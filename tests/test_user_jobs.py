@@ -0,0 +1,82 @@
+import asyncio
+
+from helpers.user_jobs import UserJobs
+
+
+def test_queue_changes_wait_behind_a_merge_in_arrival_order():
+    jobs = UserJobs()
+    applied = []
+
+    async def change(name):
+        async with jobs.queue_change(1):
+            applied.append(name)
+            await asyncio.sleep(0)
+
+    async def scenario():
+        jobs.begin_merge(1)
+        await jobs.hold(1)
+        changes = [asyncio.create_task(change(name)) for name in ("add a", "clear", "add b")]
+        await asyncio.sleep(0.01)
+        held = list(applied)
+        jobs.end_merge(1)
+        await asyncio.gather(*changes)
+        return held
+
+    assert asyncio.run(scenario()) == []
+    assert applied == ["add a", "clear", "add b"]
+    assert not jobs.busy(1)
+
+
+def test_a_merge_snapshots_the_queue_after_earlier_changes():
+    jobs = UserJobs()
+    order = []
+
+    async def add():
+        async with jobs.queue_change(1):
+            await asyncio.sleep(0.01)
+            order.append("add")
+
+    async def merge():
+        jobs.begin_merge(1)
+        await jobs.hold(1)
+        order.append("snapshot")
+        jobs.end_merge(1)
+
+    async def scenario():
+        adding = asyncio.create_task(add())
+        await asyncio.sleep(0)
+        await asyncio.gather(adding, merge())
+
+    asyncio.run(scenario())
+    assert order == ["add", "snapshot"]
+    assert not jobs.busy(1)
+
+
+def test_a_second_merge_request_finds_the_running_one():
+    jobs = UserJobs()
+    assert jobs.merge_in_flight(1) is None
+    entry = jobs.begin_merge(1)
+    entry['status_id'] = 42
+    assert jobs.merge_in_flight(1)['status_id'] == 42
+    assert jobs.merge_in_flight(2) is None
+    # Ended before it took the lock, e.g. the status message could not be sent
+    jobs.end_merge(1)
+    assert jobs.merge_in_flight(1) is None
+    assert not jobs.busy(1)
+
+
+def test_if_idle_only_takes_an_unused_lock():
+    jobs = UserJobs()
+
+    async def scenario():
+        jobs.begin_merge(1)
+        await jobs.hold(1)
+        async with jobs.if_idle(1) as busy_user:
+            pass
+        async with jobs.if_idle(2) as idle_user:
+            assert jobs.busy(2)
+        jobs.end_merge(1)
+        return busy_user, idle_user
+
+    assert asyncio.run(scenario()) == (False, True)
+    assert jobs.busy_users() == []
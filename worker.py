@@ -0,0 +1,111 @@
+"""
+Merge worker
+Claims merge jobs that the bot put in the shared job store, then merges and
+uploads them with its own Telegram client. Start as many as the CPUs allow,
+next to main.py running with MERGE_WORKERS=true and the same DOWN_PATH.
+"""
+
+import asyncio
+import logging
+import sys
+from pyrogram import Client
+from pyrogram.types import User
+from pyrogram.errors import BadMsgNotification, AuthKeyUnregistered
+
+from configs import Config
+from helpers.job_store import job_store, DONE, FAILED
+from helpers.merge_job import run_merge
+from helpers.log_channel import log_sink
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+WORKER_ID = Config.WORKER_NAME
+
+WorkerBot = Client(
+    name=f"{Config.SESSION_NAME}-worker-{WORKER_ID}",
+    api_id=Config.API_ID,
+    api_hash=Config.API_HASH,
+    bot_token=Config.BOT_TOKEN,
+    no_updates=True,  # Updates are the bot's business, workers only send
+    max_concurrent_transmissions=Config.TG_UPLOAD_WORKERS
+)
+
+
+async def _keep_lease(job: dict, work: asyncio.Task):
+    while True:
+        await asyncio.sleep(Config.WORKER_LEASE_TIMEOUT / 4)
+        try:
+            kept = await job_store.heartbeat(job)
+        except Exception as e:
+            # The store may be back before the lease runs out
+            logger.warning(f"Heartbeat for job {job['id']} failed: {e}")
+            continue
+        if not kept:
+            # The job was requeued, another worker may be merging it into the same directory by now
+            logger.warning(f"Lost the lease on job {job['id']}, stopping it")
+            work.cancel()
+            return
+
+
+async def run_job(job: dict):
+    payload = job['payload']
+    logger.info(f"Merging job {job['id']} for user {job['user_id']} ({len(payload['files'])} files)")
+    lease = asyncio.create_task(_keep_lease(job, asyncio.current_task()))
+    try:
+        merge_message = await WorkerBot.get_messages(payload['chat_id'], payload['message_id'])
+        user = User(id=job['user_id'], first_name=payload['user'].get('first_name'),
+                    username=payload['user'].get('username'))
+        merged = await run_merge(WorkerBot, user, merge_message, payload['files'], job['id'])
+        outcome = (DONE, None) if merged else (FAILED, "merge failed")
+    except asyncio.CancelledError:
+        logger.info(f"Stopped job {job['id']}")
+        raise
+    except Exception as e:
+        logger.error(f"Job {job['id']} failed: {e}")
+        outcome = (FAILED, str(e))
+    finally:
+        lease.cancel()
+    try:
+        completed = await job_store.complete(job, *outcome)
+    except Exception as e:
+        logger.error(f"Recording the outcome of job {job['id']} failed: {e}")
+        return
+    if not completed:
+        logger.warning(f"Job {job['id']} was requeued before it finished, its outcome is dropped")
+
+
+async def start_worker():
+    logger.info(f"Starting merge worker {WORKER_ID}...")
+    try:
+        await WorkerBot.start()
+        await log_sink.start(WorkerBot)
+        slots = asyncio.Semaphore(Config.WORKER_CONCURRENCY)
+
+        while True:
+            await slots.acquire()
+            try:
+                job = await job_store.claim("merge", WORKER_ID)
+            except Exception as e:
+                logger.error(f"Claiming a job failed: {e}")
+                job = None
+            if job is None:
+                slots.release()
+                await asyncio.sleep(Config.WORKER_POLL_INTERVAL)
+                continue
+            task = asyncio.create_task(run_job(job))
+            task.add_done_callback(lambda _: slots.release())
+
+    except (BadMsgNotification, AuthKeyUnregistered) as e:
+        logger.error(f"Fatal Telegram auth error: {e}. Exiting.")
+        sys.exit(1)
+    finally:
+        await log_sink.close()
+        await job_store.backend.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(start_worker())
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("Worker stopping...")